@@ -0,0 +1,4 @@
+"""
+Benchmarks, run from the repo root with `python -m benchmarks.<module>`.
+`python -m benchmarks.run` runs the whole suite on a synthetic vault.
+"""
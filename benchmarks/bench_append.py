@@ -0,0 +1,68 @@
+"""
+Capture latency of `append_to_daily_vault` as the daily note grows, against
+parsing the whole note on every capture (no `note_snapshot`) and the
+previous read / split lines / join / rewrite implementation.
+
+Run from the repo root: `python -m benchmarks.bench_append`
+"""
+import os
+import time
+import tempfile
+
+from scripts.utils import \
+    append_to_daily_vault, get_daily_note_path, write_to_path, modify_note, get_batch_insertions
+from benchmarks.bench_note_parser import legacy_find_header_pos
+
+def legacy_append(daily_path, header, message):
+    with open(daily_path, 'r') as f:
+        note_content = f.read()
+
+    start_line, end_line = legacy_find_header_pos(note_content, header)
+    lines = note_content.split('\n')
+    lines.insert(end_line + 1, message)
+
+    write_to_path(daily_path, '\n'.join(lines))
+
+def append_without_snapshot(vault_path, header, message):
+    def get_insertions(note_bytes):
+        return get_batch_insertions(note_bytes, [(header, message)])
+    modify_note(vault_path, get_daily_note_path(vault_path), get_insertions)
+
+def make_daily_note(entries):
+    bookmarks = ''.join(f'- [Bookmark {i}](https://example.com/{i})\n' for i in range(entries))
+    return f'## Todo\n\n- something\n\n## Bookmarks\n\n{bookmarks}\n## Other\n\n- last\n'
+
+def time_appends(func, repeat=20):
+    start = time.perf_counter()
+    for i in range(repeat):
+        func(i)
+    return (time.perf_counter() - start) / repeat
+
+def run():
+    os.environ.setdefault('daily_note_format', '%Y-%m-%d')
+
+    with tempfile.TemporaryDirectory() as vault_path:
+        daily_path = get_daily_note_path(vault_path)
+
+        for entries in [1_000, 10_000, 100_000]:
+            content = make_daily_note(entries)
+
+            write_to_path(daily_path, content)
+            # The first capture parses the note for the snapshot
+            append_to_daily_vault(vault_path, '## Bookmarks', '- first')
+            current_s = time_appends(
+                lambda i: append_to_daily_vault(vault_path, '## Bookmarks', f'- new {i}'))
+
+            write_to_path(daily_path, content)
+            parse_s = time_appends(
+                lambda i: append_without_snapshot(vault_path, '## Bookmarks', f'- new {i}'))
+
+            write_to_path(daily_path, content)
+            legacy_s = time_appends(
+                lambda i: legacy_append(daily_path, '## Bookmarks', f'- new {i}'))
+
+            print(f"{len(content) / 1e6:6.2f}MB note  {current_s * 1000:8.2f}ms per append  "
+                  f"(parsing every time {parse_s * 1000:8.2f}ms, legacy {legacy_s * 1000:8.2f}ms)")
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,91 @@
+"""
+Memory held by the header index of a large vault: the {filename: [headers]}
+dict loaded from the on disk index against `CompactIndex`, plus the cost
+of a full scan and a search on each.
+
+Run from the repo root: `python -m benchmarks.bench_compact_index [notes]`
+"""
+import gc
+import sys
+import json
+import random
+import tracemalloc
+
+from scripts.compact_index import CompactIndex
+from scripts.vault_index import get_headers_by_path
+from scripts.utils import tree_schema
+from benchmarks.bench_note_parser import time_it
+from benchmarks.vault_gen import make_vocabulary, daily_sections
+
+vault_path = '/Users/someone/Documents/vault'
+
+def make_index_json(notes=100_000, headers_per_note=8, daily_share=0.2, seed=0):
+    """
+    `headers_index.json` text for a vault like `vault_gen` writes: notes in
+    a two level folder tree with Zipf worded headers, a share of them daily
+    notes with the template's headers
+    """
+    rng = random.Random(seed)
+    words, cum_weights = make_vocabulary(rng)
+    folders = [''] + [f'{rng.choice(words)} {i}/{rng.choice(words)} {j}' for i in range(4) for j in range(4)]
+
+    files = {}
+    for i in range(notes):
+        if rng.random() < daily_share:
+            rel_path = f'Daily/{2000 + i // 365}-{i % 12 + 1:02}-{i % 28 + 1:02} {i}.md'
+            headers = list(daily_sections)
+        else:
+            name = '.'.join(rng.choices(words, cum_weights=cum_weights, k=2))
+            rel_path = f'{folders[i % len(folders)]}/{name}.{i}.md'.lstrip('/')
+            headers = [
+                f"{'#' * rng.randint(1, 3)} {' '.join(rng.choices(words, cum_weights=cum_weights, k=rng.randint(1, 4)))}"
+                for _ in range(headers_per_note)]
+        files[rel_path] = {'fp': [i, 1_000, i], 'headers': headers}
+    return json.dumps({'version': 1, 'files': files})
+
+def measure(build):
+    """
+    (result, bytes still allocated once built, peak bytes while building)
+    """
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, peak
+
+def load_dict(index_json):
+    files = json.loads(index_json)['files']
+    return get_headers_by_path(vault_path, files)
+
+def load_compact(index_json):
+    return CompactIndex.from_headers_index(vault_path, load_dict(index_json))
+
+def scan(headers_index):
+    return sum(len(headers) for _, headers in headers_index.items())
+
+def search(headers_index):
+    return tree_schema(vault_path, 'a:b', headers_index=headers_index, limit=50)
+
+def run(notes):
+    index_json = make_index_json(notes)
+
+    results = {}
+    for name, load in [('dict of lists', load_dict), ('compact', load_compact)]:
+        headers_index, current, peak = measure(lambda: load(index_json))
+        results[name] = current
+        print(f"{name:14} {current / 1e6:8.1f}MB held  {current / len(headers_index):6.0f}B/note  "
+              f"{peak / 1e6:8.1f}MB peak  load {time_it(load, index_json, repeat=1) * 1000:8.1f}ms  "
+              f"scan {time_it(scan, headers_index, repeat=3) * 1000:7.1f}ms  "
+              f"search {time_it(search, headers_index, repeat=3) * 1000:7.1f}ms")
+
+        if name == 'compact':
+            print(f"{'':14} {len(headers_index)} notes, {len(headers_index.folders)} folders, "
+                  f"{headers_index.header_count()} headers, {len(headers_index.texts)} distinct")
+        del headers_index
+
+    print(f"compact holds {results['compact'] / results['dict of lists']:.0%} of the dict's memory")
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,150 @@
+"""
+Per keystroke latency of `ns` searches answered by the daemon on a 20k note
+vault, measured at the client like Alfred's script filter sees it: socket
+round trip, json and all. Queries are typed one character at a time with
+the workflow's defaults (50 results, fuzzy fallback, section previews), once
+with the query cache and once with it cleared before every request, with
+the vault watched by inotify / polling and without a watcher. Each scenario
+types the queries `rounds` times, long enough for background polls / sweeps
+to run during it.
+
+Fails when a p99 is over `target_p99_ms`. `--profile` prints where the
+daemon spends the time of cache misses instead.
+
+Run from the repo root: `python -m benchmarks.bench_daemon [notes] [--profile]`
+"""
+import gc
+import os
+import sys
+import time
+import pstats
+import random
+import cProfile
+import tempfile
+import threading
+
+from scripts.daemon import VaultServer
+from scripts.client import call_daemon, default_max_results
+from scripts.vault_walk import walk_vault
+from benchmarks.vault_gen import generate_vault
+
+# Per keystroke budget of the daemon search
+target_p99_ms = 20
+rounds = 3
+
+def make_queries(vault_path, count=12, seed=0):
+    """
+    `path:header` queries built from words of random notes, some path or
+    header only, a couple with a typo so the fuzzy fallback runs
+    """
+    rng = random.Random(seed)
+    filenames = sorted(filename for filename, _ in walk_vault(vault_path))
+    queries = []
+    for i in range(count):
+        filename = rng.choice(filenames)
+        with open(filename, 'r') as f:
+            headers = [line.lstrip('#').split() for line in f if line.startswith('#')]
+        path_word = os.path.basename(filename).split('.')[0]
+        header_word = rng.choice(rng.choice(headers)) if headers else ''
+
+        kind = i % 4
+        if kind == 0:
+            queries.append(path_word)
+        elif kind == 1:
+            queries.append(f':{header_word}')
+        elif kind == 2:
+            queries.append(f'{path_word}:{header_word}')
+        else:
+            typo = header_word[:1] + header_word[2:1:-1] + header_word[3:] if len(header_word) > 3 else 'zzq'
+            queries.append(f'{path_word}:{typo}')
+    return queries
+
+def percentile(timings, share):
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(share * len(timings)))]
+
+def search(vault_path, query):
+    ok, _ = call_daemon(vault_path, 'tree_schema', {
+        'query': query, 'limit': default_max_results, 'fuzzy': True, 'previews': True})
+    assert ok, "daemon didn't answer"
+
+def time_typing(vault_path, server, queries, clear_cache=False, rounds=1):
+    """
+    ms per request of typing each query a character at a time, rounds times
+    """
+    timings = []
+    for query in queries * rounds:
+        for i in range(1, len(query) + 1):
+            if clear_cache:
+                with server.state.lock:
+                    server.state.query_cache.entries.clear()
+            start = time.perf_counter()
+            search(vault_path, query[:i])
+            timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+def start_server(vault_path, watch):
+    """
+    watch - `watch` workflow variable value
+    """
+    os.environ['watch'] = watch
+    server = VaultServer(vault_path)
+    server.state.warm_up()
+    # The client shares this process, its garbage isn't the daemon's
+    gc.collect()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def profile_misses(vault_path, queries):
+    server = start_server(vault_path, '1')
+    try:
+        profile = cProfile.Profile()
+        for query in queries:
+            for i in range(1, len(query) + 1):
+                with server.state.lock:
+                    server.state.query_cache.entries.clear()
+                    profile.enable()
+                    server.state.handle({'op': 'tree_schema', 'args': {
+                        'query': query[:i], 'limit': default_max_results, 'fuzzy': True, 'previews': True}})
+                    profile.disable()
+        pstats.Stats(profile).sort_stats('cumulative').print_stats(30)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def run(notes=20_000, profile=False):
+    with tempfile.TemporaryDirectory() as vault_path:
+        vault_path = os.path.join(vault_path, '')
+        start = time.perf_counter()
+        info = generate_vault(vault_path, notes=notes, note_size=1_000, giant_daily_entries=2_000)
+        print(f"{info['notes']} notes, {info['bytes'] / 1e6:.1f}MB generated in {time.perf_counter() - start:.1f}s")
+        queries = make_queries(vault_path)
+        print(f"queries: {queries}")
+
+        if profile:
+            profile_misses(vault_path, queries)
+            return
+
+        failed = []
+        for watch in ['1', 'poll', '0']:
+            server = start_server(vault_path, watch)
+            try:
+                # Some keystrokes to settle, eg a first poll of the vault
+                time_typing(vault_path, server, queries[:2])
+                watcher = type(server.state.watcher).__name__ if server.state.watcher is not None else 'no watcher'
+                for name, clear_cache in [('typing', False), ('cache misses', True)]:
+                    timings = time_typing(vault_path, server, queries, clear_cache=clear_cache, rounds=rounds)
+                    p50, p90, p99 = (percentile(timings, share) for share in (0.5, 0.9, 0.99))
+                    print(f"{watcher:16} {name:13} {len(timings)} requests  "
+                          f"p50 {p50:6.2f}ms  p90 {p90:6.2f}ms  p99 {p99:6.2f}ms  max {max(timings):6.2f}ms")
+                    if p99 > target_p99_ms:
+                        failed.append(f"{watcher} {name} p99 {p99:.1f}ms")
+            finally:
+                server.shutdown()
+                server.server_close()
+
+        assert not failed, f"Over the {target_p99_ms}ms p99 target: {', '.join(failed)}"
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    run(notes=int(args[0]) if args else 20_000, profile='--profile' in sys.argv)
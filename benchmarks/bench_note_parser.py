@@ -0,0 +1,123 @@
+"""
+Compare `note_parser.parse_document` against the regex + line splitting
+implementations it replaced, on generated 1MB+ notes. Fails when one isn't
+at least `min_speedup` times faster than the one it replaced.
+
+Run from the repo root: `python -m benchmarks.bench_note_parser [size_mb]`
+"""
+import re
+import sys
+import time
+import random
+
+from scripts.note_parser import parse_document, get_header_sections, get_headers
+from scripts.utils import find_header_pos
+
+# Best of `time_it`'s runs, so a noisy machine doesn't fail it
+min_speedup = 1.3
+
+#### Previous implementations, kept here as the baseline
+
+def legacy_find_header_pos(note_content, header_str):
+    regex_md_header = r'^#+ .+$'
+    matches = [x.group() for x in re.finditer(regex_md_header, note_content, re.M)]
+    if header_str not in matches:
+        return None, None
+
+    start_line = None
+    end_line = None
+    lines = note_content.split('\n')
+    for i, line in enumerate(lines):
+        if start_line is None:
+            if line == header_str:
+                start_line = i
+                break
+
+    for i, line in enumerate(lines[start_line:]):
+        if line == header_str:
+            pass
+        elif line in matches:
+            break
+        elif line != '':
+            end_line = start_line + i
+    return start_line, end_line
+
+def legacy_get_header_sections(text):
+    lines = text.split('\n')
+    header_sections = []
+    current_header = None
+    current_level = None
+    current_header_start = None
+    for i, line in enumerate(lines):
+        if line.startswith('#'):
+            level = len(re.match('#*', line).group())
+            if current_header is not None and level <= current_level:
+                header_sections.append((current_header, (current_header_start, i - 1)))
+            current_header = line.strip()
+            current_level = level
+            current_header_start = i
+    if current_header is not None:
+        header_sections.append((current_header, (current_header_start, len(lines) - 1)))
+    return dict(header_sections)
+
+def legacy_get_headers(text):
+    return re.findall(r"^#{1,6}\s.+$", text, re.MULTILINE)
+
+#### Benchmark
+
+def make_note(size_bytes, seed=0):
+    rng = random.Random(seed)
+    words = ['python', 'datetime', 'vault', 'note', 'todo', 'idea', 'sql', 'join', 'index', 'cache']
+    parts = []
+    total = 0
+    i = 0
+    while total < size_bytes:
+        block = [f"{'#' * rng.randint(1, 3)} Section {i}", '']
+        for _ in range(rng.randint(10, 60)):
+            block.append('- ' + ' '.join(rng.choice(words) for _ in range(rng.randint(4, 14))))
+        if i % 7 == 0:
+            block += ['```python', '# comment, not a header', 'import os', '```']
+        block.append('')
+        text = '\n'.join(block) + '\n'
+        parts.append(text)
+        total += len(text)
+        i += 1
+    return ''.join(parts)
+
+def time_it(func, *args, repeat=10):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def run(size_mb=1.5):
+    note = make_note(int(size_mb * 1_000_000))
+    # A header near the end is the worst case for the old line scans
+    target = parse_document(note).sections[-2].header
+
+    cases = [
+        ('find_header_pos', legacy_find_header_pos, find_header_pos, (note, target)),
+        ('get_header_sections', legacy_get_header_sections, get_header_sections, (note,)),
+        ('get_headers', legacy_get_headers, get_headers, (note,)),
+        ('parse_document', None, parse_document, (note,)),
+    ]
+
+    print(f"note size {len(note) / 1e6:.2f}MB, {note.count(chr(10))} lines")
+    slower = []
+    for name, legacy, current, args in cases:
+        current_s = time_it(current, *args)
+        if legacy is None:
+            print(f"{name:<22} {current_s * 1000:9.2f}ms")
+        else:
+            legacy_s = time_it(legacy, *args)
+            print(f"{name:<22} {current_s * 1000:9.2f}ms  (was {legacy_s * 1000:9.2f}ms, {legacy_s / current_s:.1f}x)")
+            if legacy_s / current_s < min_speedup:
+                slower.append(f"{name} {legacy_s / current_s:.1f}x")
+
+    assert not slower, f"Under the {min_speedup}x speedup: {', '.join(slower)}"
+
+if __name__ == '__main__':
+    run(float(sys.argv[1]) if len(sys.argv) > 1 else 1.5)
@@ -0,0 +1,117 @@
+"""
+Start up cost of the Alfred entry points. Every keystroke of a script filter
+and every capture runs a fresh `python3`, so imports are paid each time.
+Import times come from `python -X importtime`, over the bare interpreter's
+own start up (`site`, encodings, ...) which no change here can shave off.
+
+`tests/tests_startup.py` enforces `import_budgets_ms` and `forbidden_imports`.
+
+Run from the repo root: `python -m benchmarks.bench_startup`
+"""
+import os
+import sys
+import time
+import subprocess
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# What each entry point has imported before it does any work
+entry_points = {
+    # `python -m scripts.client search|append` with the daemon running
+    'client': 'import scripts.client',
+    # `python -m scripts.client append` without the daemon
+    'capture': 'import scripts.client, scripts.utils',
+    # `python -m scripts.client search` without the daemon
+    'search': 'import scripts.client, scripts.utils, scripts.tree_query',
+    # `python -m scripts.capture_log capture`
+    'capture_log': 'import scripts.capture_log',
+}
+
+# Import ms over the bare interpreter, about twice what a laptop measures so
+# noisy machines pass, below what the entry points took before imports were
+# trimmed (capture 60ms, search 65ms)
+import_budgets_ms = {
+    'client': 40,
+    'capture': 50,
+    'search': 60,
+    'capture_log': 50,
+}
+
+# Heavy modules an entry point has no use for
+forbidden_imports = {
+    'client': ['scripts.utils', 'tempfile', 'hashlib'],
+    'capture': [
+        'scripts.tree_query', 'scripts.trigram_index', 'concurrent.futures', 'multiprocessing',
+        'urllib.parse', 'subprocess', 'typing', 'tempfile', 'hashlib'],
+    'search': ['scripts.trigram_index', 'concurrent.futures', 'multiprocessing', 'subprocess', 'typing'],
+    'capture_log': [
+        'scripts.tree_query', 'scripts.trigram_index', 'concurrent.futures', 'urllib.parse', 'uuid', 'typing'],
+}
+
+def get_env():
+    # Without bytecode caches every run would time compiling our modules
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    return env
+
+def get_import_times(statement):
+    """
+    {module: (self us, cumulative us)} for every module `statement` imports,
+    interpreter start up included
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        capture_output=True, text=True, check=True, cwd=repo_root, env=get_env())
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+def get_import_ms(statement, repeat=5):
+    """
+    Best of `repeat` total import ms, after a first untimed run which writes
+    the bytecode caches
+    """
+    get_import_times(statement)
+    return min(
+        sum(self_us for self_us, _ in get_import_times(statement).values())
+        for _ in range(repeat)) / 1000
+
+def get_entry_import_ms(name, repeat=5):
+    """
+    Import ms of an entry point over the bare interpreter
+    """
+    return get_import_ms(entry_points[name], repeat=repeat) - get_import_ms('pass', repeat=repeat)
+
+def get_wall_ms(statement, repeat=5):
+    """
+    Best of `repeat` wall clock ms for a whole `python -c statement` run
+    """
+    timings = []
+    for _ in range(repeat + 1):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', statement], check=True, cwd=repo_root, env=get_env())
+        timings.append((time.perf_counter() - start) * 1000)
+    # First run writes the bytecode caches
+    return min(timings[1:])
+
+def run():
+    baseline_ms = get_import_ms('pass')
+    print(f"{'interpreter':12} {baseline_ms:7.2f}ms imports  {get_wall_ms('pass'):7.2f}ms wall")
+
+    for name, statement in entry_points.items():
+        import_ms = get_import_ms(statement) - baseline_ms
+        wall_ms = get_wall_ms(statement)
+        print(f"{name:12} {import_ms:7.2f}ms imports  {wall_ms:7.2f}ms wall  budget {import_budgets_ms[name]}ms")
+
+        # Where the time goes
+        times = get_import_times(statement)
+        slowest = sorted(times.items(), key=lambda item: item[1][0], reverse=True)[:5]
+        print('    ' + ', '.join(f'{module} {self_us / 1000:.1f}ms' for module, (self_us, _) in slowest))
+
+if __name__ == '__main__':
+    run()
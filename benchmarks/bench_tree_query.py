@@ -0,0 +1,93 @@
+"""
+Matching `ns` queries against a 200k header index: the compiled
+`tree_query` engine against the previous `filename:header` string list +
+fnmatch regex + split implementation. Reports latency, peak traced memory
+and memory blocks still allocated for the results, then the latency of full
+Alfred output against ranked top-k output, and of typing a query one
+character at a time with and without a `QueryCache`.
+
+Run from the repo root: `python -m benchmarks.bench_tree_query`
+"""
+import os
+import re
+import fnmatch
+import tracemalloc
+
+from scripts.tree_query import TreeQuery, QueryCache, iter_matches
+from scripts.vault_index import make_rel_path
+from scripts.utils import tree_schema
+from benchmarks.bench_note_parser import time_it
+
+vault_path = '/vault/'
+
+def make_headers_index(notes=20_000, headers_per_note=10):
+    topics = ['python', 'sql', 'rust', 'journal', 'recipes']
+    return dict(
+        (f'{vault_path}code.{topics[i % len(topics)]}.note{i}.md',
+         [f'## {topics[(i + j) % len(topics)]} header {j} datetime{i % 7}' for j in range(headers_per_note)])
+        for i in range(notes))
+
+def legacy_match(query, headers_index):
+    path_q, tree_q = query.split(':')
+    path_q = ('*' + path_q.strip('*') + '*') if path_q else path_q
+    tree_q = ('*' + tree_q.strip('*') + '*') if tree_q else tree_q
+
+    if path_q:
+        searched_files = fnmatch.filter(headers_index.keys(), os.path.join(vault_path, path_q))
+        subset_headers = dict((k, headers_index[k]) for k in searched_files)
+    else:
+        subset_headers = headers_index
+
+    combined_strings = [f"{filename}:{item}" for filename, items in subset_headers.items() for item in (items if len(items) > 0 else [''])]
+    if tree_q:
+        reg_expr = re.compile(fnmatch.translate(f'*:{tree_q}'), re.IGNORECASE)
+        matches = [f for f in combined_strings if re.match(reg_expr, f)]
+    else:
+        matches = combined_strings
+
+    return [(match.split(':')[0], ':'.join(match.split(':')[1:])) for match in matches]
+
+def compiled_match(query, headers_index):
+    return list(iter_matches(TreeQuery(query), headers_index.items(), make_rel_path(vault_path)))
+
+def measure_memory(func, *args):
+    tracemalloc.start()
+    result = func(*args)
+    blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return peak, blocks
+
+def run():
+    headers_index = make_headers_index()
+    header_count = sum(len(headers) for headers in headers_index.values())
+    print(f"{header_count} headers in {len(headers_index)} notes")
+
+    for query in ['python:datetime3', '*:datetime3', 'code.sql*:', 'nomatch:datetime']:
+        assert legacy_match(query, headers_index) == compiled_match(query, headers_index)
+        print(f"`{query}`  {len(compiled_match(query, headers_index))} matches")
+
+        for name, func in [('legacy', legacy_match), ('compiled', compiled_match)]:
+            elapsed = time_it(func, query, headers_index, repeat=5)
+            peak, blocks = measure_memory(func, query, headers_index)
+            print(f"    {name:9} {elapsed * 1000:8.2f}ms  peak {peak / 1e6:7.2f}MB  {blocks:8} blocks")
+
+    mtimes = dict((filename, i) for i, filename in enumerate(headers_index))
+    for query in ['python:datetime3', '*:## python header 1 datetime3']:
+        for limit in [None, 50]:
+            elapsed = time_it(lambda: tree_schema(
+                vault_path, query, headers_index=headers_index, mtimes=mtimes, limit=limit), repeat=5)
+            print(f"tree_schema `{query}` limit={limit}  {elapsed * 1000:8.2f}ms")
+
+    typed = 'python:datetime3'
+    keystrokes = [typed[:i] for i in range(1, len(typed) + 1)]
+    for name, cache in [('no cache', None), ('query cache', QueryCache())]:
+        elapsed = time_it(lambda: [
+            tree_schema(vault_path, query, headers_index=headers_index, mtimes=mtimes, limit=50, cache=cache)
+            for query in keystrokes], repeat=1)
+        stats = f"  {cache.stats()}" if cache else ''
+        print(f"typing `{typed}` {name:12} {elapsed * 1000 / len(keystrokes):8.2f}ms per keystroke{stats}")
+
+if __name__ == '__main__':
+    run()
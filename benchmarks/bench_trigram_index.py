@@ -0,0 +1,83 @@
+"""
+Fuzzy `ns` searches on a vault with 120k headers drawn from a Zipf
+distributed vocabulary: trigram index build and cached load time, then latency of queries
+with a typo in every word against a glob scan for the correct query.
+
+Run from the repo root: `python -m benchmarks.bench_trigram_index`
+"""
+import os
+import time
+import random
+import tempfile
+import statistics
+
+from scripts.trigram_index import TrigramIndex, get_cached_index
+from scripts.tree_query import TreeQuery, iter_ranked_matches
+from scripts.vault_index import make_rel_path
+
+vault_path = '/vault/'
+
+def make_headers_index(notes=12_000, headers_per_note=10, vocabulary=5_000, seed=0):
+    rng = random.Random(seed)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    words = [''.join(rng.choice(letters) for _ in range(rng.randint(3, 10))) for _ in range(vocabulary)]
+    weights = [1 / (i + 1) for i in range(vocabulary)]
+
+    def phrase(k):
+        return ' '.join(rng.choices(words, weights, k=k))
+
+    headers_index = {}
+    for i in range(notes):
+        filename = f'{vault_path}folder{i % 50}/{phrase(2).replace(" ", ".")}.{i}.md'
+        headers_index[filename] = [
+            '#' * rng.randint(1, 3) + ' ' + phrase(rng.randint(2, 5)) for _ in range(headers_per_note)]
+    return headers_index, rng
+
+def add_typo(rng, word):
+    if len(word) < 4:
+        return word
+    i = rng.randrange(1, len(word) - 1)
+    return word[:i] + word[i + 1:]
+
+def run(queries=200):
+    headers_index, rng = make_headers_index()
+    headers = [(filename, header) for filename, items in headers_index.items() for header in items]
+    print(f"{len(headers)} headers in {len(headers_index)} notes")
+
+    start = time.perf_counter()
+    index = TrigramIndex.from_headers_index(headers_index)
+    print(f"build {time.perf_counter() - start:.2f}s")
+
+    # What a search without the daemon pays once the cache dir has the index
+    with tempfile.TemporaryDirectory() as cache_dir:
+        os.environ['cache_dir'] = cache_dir
+        get_cached_index(vault_path, headers_index)
+        start = time.perf_counter()
+        get_cached_index(vault_path, headers_index)
+        print(f"load from cache dir {time.perf_counter() - start:.2f}s")
+        del os.environ['cache_dir']
+
+    rel_path = make_rel_path(vault_path)
+    fuzzy_ms = []
+    glob_ms = []
+    found = 0
+    for filename, header in rng.sample(headers, queries):
+        words = header.lstrip('#').split()
+        query = ':' + ' '.join(add_typo(rng, word) for word in words)
+
+        start = time.perf_counter()
+        results = index.search(query, limit=20)
+        fuzzy_ms.append((time.perf_counter() - start) * 1000)
+        found += (filename, header) in results
+
+        start = time.perf_counter()
+        list(iter_ranked_matches(TreeQuery(':' + ' '.join(words)), headers_index, rel_path, limit=20))
+        glob_ms.append((time.perf_counter() - start) * 1000)
+
+    for name, timings in [('fuzzy (typo)', fuzzy_ms), ('glob (exact)', glob_ms)]:
+        timings.sort()
+        print(f"{name:14} p50 {statistics.median(timings):7.2f}ms  p95 {timings[int(len(timings) * 0.95)]:7.2f}ms  max {timings[-1]:7.2f}ms")
+    print(f"intended header in the top 20 for {found}/{queries} typo queries")
+
+if __name__ == '__main__':
+    run()
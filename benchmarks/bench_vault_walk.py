@@ -0,0 +1,66 @@
+"""
+Listing notes in a deep synthetic vault: `walk_vault` against the old
+top level glob (which missed every note in a folder) plus path glob from
+`tree_schema`, and a recursive `**/*.md` glob (which also lists ignored and
+attachment folders).
+
+Run from the repo root: `python -m benchmarks.bench_vault_walk`
+"""
+import os
+import glob
+import json
+import tempfile
+
+from scripts.vault_walk import walk_vault
+from benchmarks.bench_note_parser import time_it
+
+def make_vault(vault_path, depth=4, fan_out=5, notes_per_folder=10, attachments=2_000):
+    def fill(dir_path, level):
+        os.makedirs(dir_path, exist_ok=True)
+        for i in range(notes_per_folder):
+            with open(os.path.join(dir_path, f'note {level}.{i}.md'), 'w') as f:
+                f.write(f'# Note {i}\n')
+        if level < depth:
+            for j in range(fan_out):
+                fill(os.path.join(dir_path, f'folder {j}'), level + 1)
+
+    fill(vault_path, 0)
+
+    # Folders the walker prunes without listing
+    for name in ['Attachments', '.git/objects', 'node_modules/pkg']:
+        dir_path = os.path.join(vault_path, name)
+        os.makedirs(dir_path, exist_ok=True)
+        for i in range(attachments):
+            with open(os.path.join(dir_path, f'file{i}.md' if name == 'node_modules/pkg' else f'file{i}.png'), 'w'):
+                pass
+
+    os.makedirs(os.path.join(vault_path, '.obsidian'), exist_ok=True)
+    with open(os.path.join(vault_path, '.obsidian', 'app.json'), 'w') as f:
+        json.dump({'attachmentFolderPath': 'Attachments'}, f)
+
+def legacy_list(vault_path, path_q='*note*'):
+    filenames = glob.glob(os.path.join(vault_path, '*'), recursive=True)
+    searched_files = glob.glob(os.path.join(vault_path, path_q), recursive=True)
+    return [(f, os.stat(f)) for f in filenames if f.endswith('.md')], searched_files
+
+def recursive_glob_list(vault_path):
+    return [(f, os.stat(f)) for f in glob.glob(os.path.join(vault_path, '**', '*.md'), recursive=True)]
+
+def walk_list(vault_path):
+    return list(walk_vault(vault_path))
+
+def run():
+    with tempfile.TemporaryDirectory() as vault_path:
+        make_vault(vault_path)
+
+        for name, func in [
+                ('top level + path glob', legacy_list),
+                ('recursive glob', recursive_glob_list),
+                ('walk_vault', walk_list)]:
+            elapsed = time_it(func, vault_path)
+            notes = func(vault_path)
+            count = len(notes[0]) if name == 'top level + path glob' else len(notes)
+            print(f"{name:24} {elapsed * 1000:8.2f}ms  {count:6} notes")
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,234 @@
+"""
+Benchmark suite: generates a synthetic vault (see `vault_gen.py`), runs
+timed scenarios against it and writes the results as json, so runs from
+different commits can be compared.
+
+    python -m benchmarks.run [--notes 2000] [--scenarios search,append] [--out results.json]
+    python -m benchmarks.run --compare old.json new.json
+
+Each timing is repeated and reported as min / median / max milliseconds,
+compare on the median.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import datetime
+import platform
+import tempfile
+import statistics
+import subprocess
+
+from benchmarks.vault_gen import generate_vault, daily_note_format
+
+# Median slow downs above this are flagged by --compare
+regression_ratio = 1.2
+
+def time_repeat(func, repeat=5, setup=None):
+    """
+    {'min', 'median', 'max'} milliseconds over `repeat` calls, setup() runs
+    untimed before each call
+    """
+    timings = []
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {'min': min(timings), 'median': statistics.median(timings), 'max': max(timings)}
+
+#### Scenarios, each returns {metric: timing} for a generated vault
+
+def scenario_index(vault_path):
+    from scripts.vault_index import get_cached_index, get_cache_dir, build_index_parallel
+    from scripts.vault_walk import walk_vault
+
+    def clear_cache():
+        shutil.rmtree(get_cache_dir(vault_path), ignore_errors=True)
+
+    filenames = [filename for filename, _ in walk_vault(vault_path)]
+    return {
+        'walk_vault': time_repeat(lambda: list(walk_vault(vault_path))),
+        'cold_index': time_repeat(lambda: get_cached_index(vault_path), repeat=3, setup=clear_cache),
+        'cold_index_parallel': time_repeat(lambda: build_index_parallel(vault_path, filenames), repeat=3),
+        'warm_index': time_repeat(lambda: get_cached_index(vault_path)),
+    }
+
+def scenario_search(vault_path):
+    from scripts.utils import tree_schema
+    from scripts.vault_index import get_cached_index, get_headers_by_path, get_mtimes_by_path
+
+    files = get_cached_index(vault_path)
+    headers_index = get_headers_by_path(vault_path, files)
+    mtimes = get_mtimes_by_path(vault_path, files)
+
+    # The most common header word, matches a large share of the vault
+    common_word = headers_index[next(iter(headers_index))][0].split()[-1]
+    queries = {
+        'path_only': 'a',
+        'header': f':{common_word}',
+        'path_and_header': f'a:{common_word}',
+        'no_match': 'zzzz:zzzz',
+    }
+
+    results = {
+        # Loads and checks the on disk index like a run without the daemon
+        'tree_schema_disk_index': time_repeat(lambda: tree_schema(vault_path, queries['header'], limit=50)),
+    }
+    for name, query in queries.items():
+        results[f'{name}_all'] = time_repeat(
+            lambda: tree_schema(vault_path, query, headers_index=headers_index, mtimes=mtimes))
+        results[f'{name}_top50'] = time_repeat(
+            lambda: tree_schema(vault_path, query, headers_index=headers_index, mtimes=mtimes, limit=50))
+    return results
+
+def scenario_parse(vault_path):
+    from scripts.note_parser import parse_document, get_header_sections, get_headers
+    from scripts.utils import find_header_pos, insert_text, get_insertion, get_daily_note_path
+
+    with open(get_daily_note_path(vault_path), 'r') as f:
+        giant_note = f.read()
+    giant_note_bytes = giant_note.encode('utf-8')
+
+    return {
+        'parse_document': time_repeat(lambda: parse_document(giant_note)),
+        'get_header_sections': time_repeat(lambda: get_header_sections(giant_note)),
+        'get_headers': time_repeat(lambda: get_headers(giant_note)),
+        'find_header_pos': time_repeat(lambda: find_header_pos(giant_note, '## Other')),
+        'get_insertion': time_repeat(lambda: get_insertion(giant_note_bytes, '## Bookmarks', '- new')),
+        # Reads the daily note from disk
+        'insert_text': time_repeat(lambda: insert_text(vault_path, '## Bookmarks', '- new')),
+    }
+
+def scenario_append(vault_path):
+    from scripts.utils import append_to_daily_vault, append_many_to_daily_vault
+    from scripts.capture_log import capture
+
+    entries = [('## Bookmarks', f'- [Tab {i}](https://example.com/tab/{i})') for i in range(20)]
+    return {
+        'append_to_daily_vault': time_repeat(
+            lambda: append_to_daily_vault(vault_path, '## Bookmarks', '- new bookmark'), repeat=10),
+        'append_many_20': time_repeat(lambda: append_many_to_daily_vault(vault_path, entries)),
+        'capture_log': time_repeat(lambda: capture(vault_path, '## Bookmarks', '- logged'), repeat=10),
+    }
+
+def scenario_daily_note(vault_path):
+    from scripts.utils import create_daily_note
+
+    # A day with no daily note yet, moved on for each run
+    note_dates = [datetime.datetime(2000, 1, 1) + datetime.timedelta(days=i) for i in range(100)]
+
+    def next_date():
+        note_dates.pop(0)
+
+    return {
+        'create_daily_note': time_repeat(
+            lambda: create_daily_note(vault_path, note_date=note_dates[0]), repeat=10, setup=next_date),
+        'existing_daily_note': time_repeat(lambda: create_daily_note(vault_path), repeat=10),
+    }
+
+scenarios = {
+    'index': scenario_index,
+    'search': scenario_search,
+    'parse': scenario_parse,
+    'append': scenario_append,
+    'daily_note': scenario_daily_note,
+}
+
+#### Run
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(names, vault_args):
+    os.environ['daily_note_format'] = daily_note_format
+    stderr = sys.stderr
+
+    with tempfile.TemporaryDirectory() as vault_path:
+        vault = generate_vault(vault_path, **vault_args)
+
+        results = {}
+        for name in names:
+            # Each scenario starts from the same vault state on disk
+            scenario_path = os.path.join(vault_path, f'run-{name}')
+            shutil.copytree(vault_path, scenario_path, ignore=shutil.ignore_patterns('run-*'))
+
+            # Library warnings would drown the report
+            sys.stderr = open(os.devnull, 'w')
+            try:
+                results[name] = scenarios[name](scenario_path)
+            finally:
+                sys.stderr.close()
+                sys.stderr = stderr
+
+            shutil.rmtree(scenario_path)
+
+    return {
+        'meta': {
+            'commit': get_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'vault': vault,
+        },
+        'results': results,
+    }
+
+def compare(old, new):
+    """
+    Lines comparing median timings, slow downs over `regression_ratio` marked
+    """
+    lines = [f"{old['meta']['commit']} -> {new['meta']['commit']}"]
+    if old['meta']['vault'] != new['meta']['vault']:
+        lines.append("Warning - the runs used different vaults, timings aren't comparable")
+    for scenario, metrics in new['results'].items():
+        for metric, timing in metrics.items():
+            old_timing = old['results'].get(scenario, {}).get(metric)
+            if old_timing is None:
+                continue
+            ratio = timing['median'] / old_timing['median'] if old_timing['median'] else float('inf')
+            flag = '  REGRESSION' if ratio > regression_ratio else ''
+            lines.append(
+                f"{scenario + '.' + metric:45} {old_timing['median']:9.2f}ms -> {timing['median']:9.2f}ms  x{ratio:.2f}{flag}")
+    return lines
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run benchmark scenarios on a synthetic vault')
+    parser.add_argument('--scenarios', default=','.join(scenarios), help='comma separated, from ' + ', '.join(scenarios))
+    parser.add_argument('--notes', type=int, default=2_000)
+    parser.add_argument('--folder-depth', type=int, default=2)
+    parser.add_argument('--headers-per-note', type=int, default=8)
+    parser.add_argument('--note-size', type=int, default=2_000, help='bytes per note')
+    parser.add_argument('--giant-daily-entries', type=int, default=20_000, help="bookmarks in today's daily note")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='json file to write, stdout if not given')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files instead')
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f_old, open(args.compare[1]) as f_new:
+            print('\n'.join(compare(json.load(f_old), json.load(f_new))))
+        sys.exit(0)
+
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    for name in names:
+        if name not in scenarios:
+            raise ValueError(f"Unknown scenario `{name}`, expected one of {', '.join(scenarios)}")
+
+    report = run(names, {
+        'notes': args.notes, 'folder_depth': args.folder_depth, 'headers_per_note': args.headers_per_note,
+        'note_size': args.note_size, 'giant_daily_entries': args.giant_daily_entries, 'seed': args.seed,
+    })
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
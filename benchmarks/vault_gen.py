@@ -0,0 +1,111 @@
+"""
+Reproducible synthetic vaults for the benchmarks. The same arguments and
+seed always produce byte identical notes, so timings from different commits
+are measured on the same vault.
+
+`python -m benchmarks.vault_gen <dir> [notes]` writes one to look at.
+"""
+import os
+import sys
+import json
+import random
+import itertools
+import datetime
+
+daily_note_format = '%Y-%m-%d'
+daily_sections = ['## Todo', '## Ideas', '## Journal', '## Bookmarks', '## Other']
+
+def make_vocabulary(rng, size=3_000):
+    """
+    Words and cumulative Zipf weights, a few words are in most notes like in
+    a real vault. Pass the weights as `cum_weights`, `rng.choices` would
+    otherwise add them up again on every call.
+    """
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    words = [''.join(rng.choice(letters) for _ in range(rng.randint(3, 10))) for _ in range(size)]
+    cum_weights = list(itertools.accumulate(1 / (i + 1) for i in range(size)))
+    return words, cum_weights
+
+def make_note_text(rng, vocabulary, headers, size_bytes):
+    words, cum_weights = vocabulary
+
+    def phrase(k):
+        return ' '.join(rng.choices(words, cum_weights=cum_weights, k=k))
+
+    lines = []
+    body_size = max(size_bytes // max(headers, 1), 1)
+    for i in range(max(headers, 1)):
+        if headers:
+            lines += [f"{'#' * rng.randint(1, 3)} {phrase(rng.randint(1, 4))}", '']
+        section_size = 0
+        while section_size < body_size:
+            line = '- ' + phrase(rng.randint(4, 12))
+            lines.append(line)
+            section_size += len(line) + 1
+        if i % 5 == 4:
+            lines += ['```', '# not a header', '```']
+        lines.append('')
+    return '\n'.join(lines)
+
+def make_daily_note_text(entries):
+    bookmarks = ''.join(f'- [Bookmark {i}](https://example.com/{i})\n' for i in range(entries))
+    return f'## Todo\n\n- [ ] something\n\n## Ideas\n\n## Journal\n\n## Bookmarks\n\n{bookmarks}\n## Other\n\n- last\n'
+
+def generate_vault(
+        vault_path, notes=1_000, folder_depth=2, folders_per_level=4, headers_per_note=8,
+        note_size=2_000, daily_notes=30, daily_note_entries=20, giant_daily_entries=20_000,
+        today=None, seed=0):
+    """
+    Write a vault to vault_path and return its description.
+
+    notes are spread over a folder tree `folder_depth` levels deep with
+    `folders_per_level` folders per level. The last `daily_notes` days get a
+    daily note in the vault root, today's has `giant_daily_entries`
+    bookmarks, the others `daily_note_entries`.
+    """
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(rng)
+    words, cum_weights = vocabulary
+
+    folders = ['']
+    level = ['']
+    for _ in range(folder_depth):
+        level = [os.path.join(parent, f'{rng.choice(words)} {i}') for parent in level for i in range(folders_per_level)]
+        folders += level
+
+    total_bytes = 0
+    for i in range(notes):
+        folder = folders[i % len(folders)]
+        name = '.'.join(rng.choices(words, cum_weights=cum_weights, k=2)) + f'.{i}.md'
+        text = make_note_text(rng, vocabulary, headers_per_note, note_size)
+        write_note(os.path.join(vault_path, folder, name), text)
+        total_bytes += len(text)
+
+    today = today or datetime.date.today()
+    for days_ago in range(daily_notes):
+        note_date = today - datetime.timedelta(days=days_ago)
+        text = make_daily_note_text(giant_daily_entries if days_ago == 0 else daily_note_entries)
+        write_note(os.path.join(vault_path, note_date.strftime(daily_note_format) + '.md'), text)
+        total_bytes += len(text)
+
+    template = '\n'.join(section + '\n' for section in daily_sections)
+    write_note(os.path.join(vault_path, 'Templates', 'Daily.md'), template)
+    write_note(os.path.join(vault_path, '.obsidian', 'daily-notes.json'), json.dumps({'template': 'Templates/Daily.md'}))
+
+    return {
+        'notes': notes, 'folders': len(folders), 'headers_per_note': headers_per_note,
+        'note_size': note_size, 'daily_notes': daily_notes, 'giant_daily_entries': giant_daily_entries,
+        'seed': seed, 'bytes': total_bytes,
+    }
+
+def write_note(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(text)
+
+#### Run
+
+if __name__ == '__main__':
+    vault_path = sys.argv[1]
+    notes = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000
+    print(json.dumps(generate_vault(vault_path, notes=notes)))
@@ -0,0 +1,297 @@
+"""
+Write-behind capture journal. A capture is one json line appended to
+`<cache dir>/capture_log.jsonl`, which costs the same no matter how big the
+daily note is. `compact` later merges pending captures into the daily note of
+the day they were captured on.
+
+Crash safety:
+- the log is renamed to `capture_log.compacting.jsonl` before it is read, so
+  captures made during compaction go to a fresh log
+- before a note is replaced, the inode of its temp file and the capture ids
+  being written are saved in `capture_log.state.json`. After a crash the note's
+  inode tells whether that write happened, so captures are neither applied
+  twice nor dropped (unless another program also replaced the note before the
+  next compaction).
+
+The `capture` command has the log compacted `compact_delay` seconds after the
+last capture of a burst: by the daemon when it's running, otherwise by one
+detached `compact --wait` process.
+"""
+import os
+import sys
+import json
+import time
+import fcntl
+import datetime
+import contextlib
+
+from scripts.utils import \
+    get_daily_note_path, create_daily_note, get_batch_insertions, modify_note
+from scripts.vault_index import get_cache_dir, write_json_atomic
+
+log_file_name = 'capture_log.jsonl'
+compacting_file_name = 'capture_log.compacting.jsonl'
+state_file_name = 'capture_log.state.json'
+compact_lock_file_name = 'capture_log.compact.lock'
+# Held by a compactor waiting for the captures to stop
+waiting_lock_file_name = 'capture_log.waiting.lock'
+
+# Seconds without a capture before the log is compacted, a burst of
+# captures is written to the daily note at once
+compact_delay = 2.0
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def get_log_path(vault_path, file_name=log_file_name):
+    return os.path.join(get_cache_dir(vault_path), file_name)
+
+def capture(vault_path, header, text, capture_time: datetime.datetime=None):
+    """
+    Append one capture to the log, returns its id
+    """
+    if capture_time is None:
+        capture_time = datetime.datetime.now()
+
+    entry = {
+        # Random like uuid4().hex, `uuid` imports `platform` on every capture
+        'id': os.urandom(16).hex(),
+        'ts': capture_time.isoformat(),
+        'header': header,
+        'text': text,
+    }
+    line = (json.dumps(entry) + '\n').encode('utf-8')
+
+    log_path = get_log_path(vault_path)
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+
+    while True:
+        fd = os.open(log_path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            # The compactor may have renamed the log between open and lock,
+            # the write would then land in a file it has already read
+            try:
+                same_file = os.stat(log_path).st_ino == os.fstat(fd).st_ino
+            except FileNotFoundError:
+                same_file = False
+
+            if same_file:
+                # A capture killed mid write leaves a torn last line, start
+                # on a new line so this one isn't read as part of it
+                size = os.fstat(fd).st_size
+                if size > 0 and os.pread(fd, 1, size - 1) != b'\n':
+                    os.write(fd, b'\n' + line)
+                else:
+                    os.write(fd, line)
+                os.fsync(fd)
+                return entry['id']
+        finally:
+            os.close(fd)
+
+def read_log(path):
+    entries = []
+    with open(path, 'rb') as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # Torn last line from a crash mid write, the capture was never acknowledged
+                sys.stderr.write(f"Warning - skipping unreadable capture log line {line!r}")
+    return entries
+
+def load_state(vault_path):
+    path = get_log_path(vault_path, state_file_name)
+    if not os.path.exists(path):
+        return {'applied': [], 'pending': None}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def save_state(vault_path, state):
+    write_json_atomic(get_log_path(vault_path, state_file_name), state, fsync=True)
+
+def recover(vault_path, state):
+    """
+    Resolve a note write that was in flight when the last compaction crashed
+    """
+    pending = state['pending']
+    if pending is None:
+        return state
+
+    try:
+        applied = os.stat(pending['note']).st_ino == pending['inode']
+    except FileNotFoundError:
+        applied = False
+
+    if applied:
+        state['applied'] += pending['ids']
+    elif os.path.exists(pending['tmp_path']):
+        os.remove(pending['tmp_path'])
+
+    state['pending'] = None
+    save_state(vault_path, state)
+    return state
+
+@contextlib.contextmanager
+def lock_compaction(vault_path):
+    """
+    One compaction at a time, a second one would apply the compacting log
+    and state again
+    """
+    lock_path = get_log_path(vault_path, compact_lock_file_name)
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+def compact(vault_path):
+    """
+    Merge pending captures into their daily notes, returns how many were written
+    """
+    with lock_compaction(vault_path):
+        return compact_locked(vault_path)
+
+def compact_locked(vault_path):
+    """
+    `compact` with the compaction lock held
+    """
+    log_path = get_log_path(vault_path)
+    compacting_path = get_log_path(vault_path, compacting_file_name)
+
+    if not os.path.exists(compacting_path):
+        if not os.path.exists(log_path):
+            return 0
+        # Previous compaction finished, its applied ids are no longer needed
+        save_state(vault_path, {'applied': [], 'pending': None})
+        os.replace(log_path, compacting_path)
+
+    with open(compacting_path, 'rb') as f:
+        # Wait for captures that opened the log before it was renamed
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    state = recover(vault_path, load_state(vault_path))
+    applied = set(state['applied'])
+
+    # Group by the daily note of the capture date, in capture order
+    entries_by_note = {}
+    for entry in read_log(compacting_path):
+        if entry['id'] in applied:
+            continue
+        note_date = datetime.datetime.fromisoformat(entry['ts'])
+        note_path = get_daily_note_path(vault_path, note_date=note_date)
+        entries_by_note.setdefault(note_path, (note_date, []))[1].append(entry)
+
+    written = 0
+    for note_path, (note_date, entries) in entries_by_note.items():
+        create_daily_note(vault_path, note_date=note_date)
+
+        def get_insertions(note_bytes, document):
+            # Captures were already acknowledged, never reject one for a missing header
+            return get_batch_insertions(
+                note_bytes, [(entry['header'], entry['text']) for entry in entries],
+                create_header_if_missing=True, document=document)
+        ids = [entry['id'] for entry in entries]
+
+        def record_pending(tmp_path):
+            state['pending'] = {
+                'note': note_path, 'tmp_path': tmp_path,
+                'inode': os.stat(tmp_path).st_ino, 'ids': ids}
+            save_state(vault_path, state)
+
+        modify_note(vault_path, note_path, get_insertions, before_replace=record_pending, snapshot=True)
+
+        state['applied'] += ids
+        state['pending'] = None
+        save_state(vault_path, state)
+        written += len(ids)
+
+    os.remove(compacting_path)
+    save_state(vault_path, {'applied': [], 'pending': None})
+    return written
+
+def try_lock(path):
+    """
+    fd holding an exclusive lock on path, None if another process holds it
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+def compact_when_quiet(vault_path, delay=compact_delay):
+    """
+    `compact` once no capture came for `delay` seconds, returns how many
+    were written. Does nothing if another compactor is already waiting.
+    """
+    fd = try_lock(get_log_path(vault_path, waiting_lock_file_name))
+    if fd is None:
+        return 0
+    try:
+        log_path = get_log_path(vault_path)
+        while True:
+            try:
+                wait = os.stat(log_path).st_mtime + delay - time.time()
+            except FileNotFoundError:
+                wait = 0
+            if wait <= 0:
+                break
+            time.sleep(wait)
+    finally:
+        # Captures from here on start the next compactor, this one may
+        # already have renamed the log when they're written
+        os.close(fd)
+    return compact(vault_path)
+
+def compact_soon(vault_path):
+    """
+    Have the log compacted `compact_delay` seconds after the last capture,
+    by the daemon if it's running, otherwise by a detached process unless
+    one is already waiting
+    """
+    from scripts.client import call_daemon
+
+    ok, _ = call_daemon(vault_path, 'compact_soon')
+    if ok:
+        return
+
+    fd = try_lock(get_log_path(vault_path, waiting_lock_file_name))
+    if fd is None:
+        # That compactor also gets this capture
+        return
+    os.close(fd)
+
+    import subprocess
+    subprocess.Popen(
+        [sys.executable, '-m', 'scripts.capture_log', 'compact', '--wait'],
+        cwd=repo_root, env=dict(os.environ, config_obsidian_vault=os.path.abspath(vault_path)),
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True)
+
+#### Run
+
+if __name__ == '__main__':
+    # `python -m scripts.capture_log capture <header> <text>` from ji / jj / jt
+    # `python -m scripts.capture_log compact` eg from a hotkey, `--wait` to
+    # wait for a burst of captures to end, see `compact_soon`
+    vault_path = os.path.expanduser(os.environ['config_obsidian_vault'])
+    command = sys.argv[1]
+
+    if command == 'capture':
+        capture(vault_path, sys.argv[2], " ".join(sys.argv[3:]))
+        compact_soon(vault_path)
+    elif command == 'compact':
+        if '--wait' in sys.argv[2:]:
+            written = compact_when_quiet(vault_path)
+        else:
+            written = compact(vault_path)
+        sys.stdout.write(f"Compacted {written} captures")
+    else:
+        raise ValueError(f"Unknown command `{command}`")
@@ -0,0 +1,64 @@
+"""
+Alfred action: append every tab of the front browser window to the daily note
+in one write. `python -m scripts.capture_tabs [header]`, header defaults to
+`## Bookmarks`. The `browser` workflow variable picks the app (default Google Chrome),
+tabs already saved in the vault are handled per `duplicate_urls`, see
+`url_index.dedupe_entries`.
+"""
+import os
+import sys
+import json
+import subprocess
+
+from scripts import client
+
+default_browser = 'Google Chrome'
+
+# Safari calls the tab title `name`, chromium based browsers call it `title`
+jxa_get_tabs = """
+const app = Application(%s);
+const tabs = app.windows[0].tabs();
+JSON.stringify(tabs.map(tab => [tab.url(), %s]));
+"""
+
+def get_front_window_tabs(browser=default_browser):
+    """
+    Returns [(url, title), ...] for the front window of browser
+    """
+    title = 'tab.name()' if browser == 'Safari' else 'tab.title()'
+    script = jxa_get_tabs % (json.dumps(browser), title)
+
+    out = subprocess.check_output(['osascript', '-l', 'JavaScript', '-e', script])
+    return [tuple(tab) for tab in json.loads(out)]
+
+def format_tab(url, title):
+    """
+    Markdown list item linking to url. Brackets in the title would end the
+    link text early, and parentheses or spaces in the url its target.
+    """
+    title = title.replace('\\', '\\\\').replace('[', '\\[').replace(']', '\\]')
+    if any(c in url for c in '() \t'):
+        url = f'<{url}>'
+    return f'- [{title}]({url})'
+
+def capture_tabs(vault_path, tabs, header='## Bookmarks', duplicate_urls=None):
+    """
+    Returns the number of tabs written
+    """
+    client.create_daily_note(vault_path)
+    entries = [(header, format_tab(url, title)) for url, title in tabs]
+    written = client.append_many_to_daily_vault(
+        vault_path, entries, create_header_if_missing=True, duplicate_urls=duplicate_urls)
+    return len(written)
+
+#### Run
+
+if __name__ == '__main__':
+    vault_path = os.path.expanduser(os.environ['config_obsidian_vault'])
+    header = sys.argv[1] if len(sys.argv) > 1 else '## Bookmarks'
+
+    tabs = get_front_window_tabs(os.environ.get('browser') or default_browser)
+    count = capture_tabs(vault_path, tabs, header=header, duplicate_urls=os.environ.get('duplicate_urls'))
+
+    # Shown by Alfred's post notification
+    sys.stdout.write(f"Saved {count} tabs to {header}")
@@ -0,0 +1,197 @@
+"""
+Thin client for `scripts/daemon.py`, kept free of heavy imports so Alfred
+script filters start fast. Falls back to running in process when the daemon
+isn't running.
+"""
+import os
+import sys
+import json
+import zlib
+import socket
+
+from scripts import tracing
+
+# Seconds to wait on a running daemon before giving up
+default_timeout = 5.0
+
+# Alfred only shows a screenful, `max_results` workflow variable overrides
+default_max_results = 50
+
+def get_temp_dir():
+    """
+    Same lookup as `tempfile.gettempdir`, which costs a fresh interpreter
+    more to import (random, shutil, ...) than a search takes
+    """
+    for name in ('TMPDIR', 'TEMP', 'TMP'):
+        if os.environ.get(name):
+            return os.environ[name]
+    return '/tmp'
+
+def path_hash(path):
+    """
+    Short hash of an absolute path, crc32 since hashlib loads openssl
+    """
+    return f"{zlib.crc32(os.path.abspath(path).encode('utf-8')):08x}"
+
+def get_socket_path(vault_path):
+    """
+    Unix socket paths are limited to ~100 chars, so use a short hash of the
+    vault path in the temp dir rather than a path inside the vault
+    """
+    return os.path.join(get_temp_dir(), f'alfred-note-capture-{path_hash(vault_path)}.sock')
+
+def call_daemon(vault_path, op, args=None, timeout=default_timeout, idempotent=True):
+    """
+    Send one request to the daemon. Returns (True, result) or (False, None) if
+    no daemon is listening, or it timed out or hung up before answering.
+    Errors raised in the daemon are raised as ValueError.
+
+    idempotent=False - for ops that write to notes. Once the request is sent
+        the daemon may have applied it, running it again in process could
+        write it twice, so a lost answer raises ValueError instead.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    sent = False
+    chunks = []
+    try:
+        try:
+            sock.connect(get_socket_path(vault_path))
+            sock.sendall(json.dumps({'op': op, 'args': args or {}}).encode('utf-8') + b'\n')
+            sent = True
+
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                if chunk.endswith(b'\n'):
+                    break
+        except OSError as e:
+            # Includes timeouts, the daemon is stuck or went away
+            if sent:
+                sys.stderr.write(f"Warning - daemon didn't answer `{op}`: {e}")
+            chunks = []
+    finally:
+        sock.close()
+
+    buffer = b''.join(chunks)
+    try:
+        response = json.loads(buffer) if buffer.endswith(b'\n') else None
+    except ValueError:
+        response = None
+
+    if response is None:
+        if sent and not idempotent:
+            raise ValueError(f"Daemon didn't answer `{op}`, it may have been applied")
+        if buffer:
+            sys.stderr.write(f"Warning - truncated daemon response to `{op}`, running in process")
+        return False, None
+
+    if not response['ok']:
+        raise ValueError(response['error'])
+    return True, response['result']
+
+def tree_schema(vault_path, query, limit=None, fuzzy=False, previews=False):
+    with tracing.stage('daemon'):
+        ok, result = call_daemon(
+            vault_path, 'tree_schema', {'query': query, 'limit': limit, 'fuzzy': fuzzy, 'previews': previews})
+    if not ok:
+        # The in process fallback's imports are most of a cold run
+        with tracing.stage('import'):
+            from scripts import utils
+        result = utils.tree_schema(vault_path, query, limit=limit, fuzzy=fuzzy, previews=previews)
+    return result
+
+def search_text(vault_path, query, limit=20):
+    ok, result = call_daemon(vault_path, 'search_text', {'query': query, 'limit': limit})
+    if not ok:
+        from scripts import fulltext_index
+        result = fulltext_index.search_vault(vault_path, query, limit=limit)
+    return result
+
+def create_daily_note(vault_path):
+    ok, result = call_daemon(vault_path, 'create_daily_note')
+    if not ok:
+        from scripts import utils
+        result = utils.create_daily_note(vault_path)
+    return result
+
+def find_url(vault_path, url):
+    ok, result = call_daemon(vault_path, 'find_url', {'url': url})
+    if not ok:
+        from scripts import url_index
+        result = url_index.lookup_vault(vault_path, url)
+    return result
+
+def daily_sections(vault_path, header, start, end, max_bytes=None):
+    """
+    Entries of `daily_sections.iter_sections`, read lazily at the offsets of
+    the daemon's header index, or without an index in process
+    """
+    args = {'header': header, 'start': start.isoformat(), 'end': end.isoformat()}
+    ok, locations = call_daemon(vault_path, 'daily_sections', args)
+
+    from scripts import daily_sections
+    if not ok:
+        locations = daily_sections.iter_locations(vault_path, header, start, end)
+    return daily_sections.read_sections(
+        locations, header, workers=daily_sections.get_workers(), max_bytes=max_bytes)
+
+def append_to_daily_vault(vault_path, header, message, create_header_if_missing=False, duplicate_urls=None):
+    """
+    Returns the entries written, see `utils.append_many_to_daily_vault`
+    """
+    args = {
+        'header': header, 'message': message, 'create_header_if_missing': create_header_if_missing,
+        'duplicate_urls': duplicate_urls}
+    ok, result = call_daemon(vault_path, 'append_to_daily_vault', args, idempotent=False)
+    if not ok:
+        from scripts import utils
+        result = utils.append_to_daily_vault(
+            vault_path, header, message,
+            create_header_if_missing=create_header_if_missing, duplicate_urls=duplicate_urls)
+    return [tuple(entry) for entry in result]
+
+def append_many_to_daily_vault(vault_path, entries, create_header_if_missing=False, duplicate_urls=None):
+    args = {'entries': entries, 'create_header_if_missing': create_header_if_missing, 'duplicate_urls': duplicate_urls}
+    ok, result = call_daemon(vault_path, 'append_many_to_daily_vault', args, idempotent=False)
+    if not ok:
+        from scripts import utils
+        result = utils.append_many_to_daily_vault(
+            vault_path, entries,
+            create_header_if_missing=create_header_if_missing, duplicate_urls=duplicate_urls)
+    return [tuple(entry) for entry in result]
+
+#### Run
+
+if __name__ == '__main__':
+    # `python -m scripts.client search <query>` - Alfred script filter output
+    # `python -m scripts.client append <header> <message>`
+    # `python -m scripts.client stats` - daemon counters, eg query cache hits
+    vault_path = os.path.expanduser(os.environ['config_obsidian_vault'])
+    command = sys.argv[1]
+
+    if command == 'search':
+        limit = int(os.environ.get('max_results', default_max_results))
+        # Typos fall back to fuzzy matches unless `fuzzy_search` is 0
+        fuzzy = os.environ.get('fuzzy_search', '1') != '0'
+        # Section text in the subtitle unless `section_previews` is 0
+        previews = os.environ.get('section_previews', '1') != '0'
+        query = " ".join(sys.argv[2:])
+        with tracing.traced('client_search', query=query, limit=limit) as trace:
+            items = tree_schema(vault_path, query, limit=limit, fuzzy=fuzzy, previews=previews)
+            with trace.stage('serialize'):
+                output = json.dumps({'items': items})
+        sys.stdout.write(output)
+    elif command == 'append':
+        create_daily_note(vault_path)
+        # Urls already in the vault are skipped / annotated / linked per `duplicate_urls`
+        append_to_daily_vault(
+            vault_path, sys.argv[2], " ".join(sys.argv[3:]), create_header_if_missing=True,
+            duplicate_urls=os.environ.get('duplicate_urls'))
+    elif command == 'stats':
+        ok, result = call_daemon(vault_path, 'stats')
+        sys.stdout.write(json.dumps(result) if ok else "Daemon isn't running")
+    else:
+        raise ValueError(f"Unknown command `{command}`")
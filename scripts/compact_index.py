@@ -0,0 +1,309 @@
+"""
+Compact in memory header index for very large vaults.
+
+`{filename: [headers]}` holds a full path string per note and a str per
+header, most of them repeats (every daily note has the same `## Todo`).
+`CompactIndex` keeps the same data as columns instead:
+
+- paths are split into an interned folder table and the note's file name
+- header lines are ids into a table of distinct header strings
+- per header level / line / byte offset, and the per note header ranges,
+  are `array` columns of machine ints rather than python objects
+- line / offset columns are left empty when built from header strings,
+  which don't have them, the mtime column holds 0 without mtimes
+
+It reads like the dict (a `Mapping` of filename to header list, in the same
+order) so `tree_schema` and `TrigramIndex` take it in place of one. Header
+lists are built on access, full paths too. It can be kept up to date per
+changed note: a changed note gets a new id at the end and its old id is
+left dead until the index is rebuilt.
+
+Header lookups pay for building those lists, so the daemon, whose index
+also backs `vault_index` entries with their spans and fingerprints, keeps
+the plain dict.
+"""
+import os
+import array
+import collections.abc
+
+from scripts.note_parser import get_header_positions
+from scripts.vault_index import make_rel_path
+
+class CompactIndex(collections.abc.Mapping):
+    """
+    folders - distinct folders as `vault_path/folder/` prefixes, so a
+        filename is one concatenation. `file_folders` indexes it
+    names - file name per note id, None once removed
+    header_starts - note id: its first header id, plus a final end entry
+    texts - distinct header lines, `header_texts` indexes it
+    header_levels / header_lines / header_offsets - per header id, lines
+        and offsets are empty when built from header strings alone
+    file_mtimes - note id: mtime_ns, 0 when built without mtimes
+    """
+    __slots__ = (
+        'vault_path', 'folders', 'file_folders', 'names', 'header_starts',
+        'texts', 'header_texts', 'header_levels', 'header_lines', 'header_offsets', 'file_mtimes',
+        'file_ids', 'folder_ids', 'removed')
+
+    def __init__(self, vault_path):
+        self.vault_path = vault_path
+        self.folders = []
+        self.file_folders = array.array('I')
+        self.names = []
+        self.header_starts = array.array('I', [0])
+        self.texts = []
+        self.header_texts = array.array('I')
+        self.header_levels = array.array('B')
+        self.header_lines = array.array('i')
+        # Notes are well under 2GB
+        self.header_offsets = array.array('i')
+        self.file_mtimes = array.array('q')
+        # filename: note id, only built for lookups by filename
+        self.file_ids = None
+        # folder: id, for adding notes
+        self.folder_ids = {}
+        # Dead note ids
+        self.removed = 0
+
+    @classmethod
+    def from_headers_index(cls, vault_path, headers_index, mtimes=None):
+        """
+        From a {filename: [headers]} index, and {filename: mtime_ns} if given
+        """
+        def notes():
+            for filename, headers in headers_index.items():
+                yield filename, [(header, header_level(header), None, None) for header in headers], \
+                    mtimes[filename] if mtimes is not None else None
+        return cls.build(vault_path, notes())
+
+    @classmethod
+    def from_files(cls, vault_path, files):
+        """
+        From `vault_index` entries {rel_path: {'fp', 'headers'}}, with the
+        notes' mtimes
+        """
+        def notes():
+            for rel_path, entry in files.items():
+                yield os.path.join(vault_path, rel_path), \
+                    [(header, header_level(header), None, None) for header in entry['headers']], entry['fp'][0]
+        return cls.build(vault_path, notes())
+
+    @classmethod
+    def from_notes(cls, vault_path, filenames):
+        """
+        Reads and parses the markdown files in filenames, with line numbers
+        and byte offsets
+        """
+        def notes():
+            for filename in filenames:
+                if not filename.endswith('.md'):
+                    continue
+                try:
+                    with open(filename, 'rb') as f:
+                        data = f.read()
+                except OSError:
+                    continue
+                yield filename, get_header_positions(data), None
+        return cls.build(vault_path, notes())
+
+    @classmethod
+    def build(cls, vault_path, notes):
+        """
+        notes - (filename, [(header, level, line, offset)], mtime_ns or None) triples
+        """
+        index = cls(vault_path)
+        rel_path = make_rel_path(vault_path)
+        # Only needed while building
+        text_ids = {}
+        for filename, positions, mtime in notes:
+            index.add_note(filename, positions, mtime, rel_path=rel_path, text_ids=text_ids)
+        return index
+
+    def add_note(self, filename, positions, mtime=None, rel_path=None, text_ids=None):
+        """
+        Append a note not in the index yet, returns its id
+
+        text_ids - {header: text id} of texts, headers are stored once when
+            given. Notes added after `build` store their own, a dict of
+            every distinct header would outweigh the repeats.
+        """
+        folder, name = os.path.split((rel_path or make_rel_path(self.vault_path))(filename))
+        folder = os.path.join(self.vault_path, folder, '')
+        folder_id = self.folder_ids.get(folder)
+        if folder_id is None:
+            folder_id = self.folder_ids[folder] = len(self.folders)
+            self.folders.append(folder)
+
+        file_id = len(self.names)
+        self.file_folders.append(folder_id)
+        self.names.append(name)
+        # Always one entry per note id, so ids keep lining up with mtimes
+        self.file_mtimes.append(mtime or 0)
+
+        for header, level, line, offset in positions:
+            text_id = text_ids.get(header) if text_ids is not None else None
+            if text_id is None:
+                text_id = len(self.texts)
+                self.texts.append(header)
+                if text_ids is not None:
+                    text_ids[header] = text_id
+            self.header_texts.append(text_id)
+            self.header_levels.append(level)
+            if line is not None:
+                self.header_lines.append(line)
+                self.header_offsets.append(offset)
+        self.header_starts.append(len(self.header_texts))
+
+        if self.file_ids is not None:
+            self.file_ids[filename] = file_id
+        return file_id
+
+    def remove_note(self, filename):
+        file_id = self.get_file_id(filename)
+        del self.file_ids[filename]
+        self.names[file_id] = None
+        self.removed += 1
+
+    def set_note(self, filename, headers, mtime=None):
+        """
+        Add or replace a note from its header strings, like assigning to the dict
+        """
+        if filename in self:
+            self.remove_note(filename)
+        self.add_note(filename, [(header, header_level(header), None, None) for header in headers], mtime)
+
+    def needs_rebuild(self):
+        """
+        True once dead note ids outnumber the live ones
+        """
+        return self.removed > max(len(self), 1000)
+
+    def filename(self, file_id):
+        return self.folders[self.file_folders[file_id]] + self.names[file_id]
+
+    def headers(self, file_id):
+        texts = self.texts
+        return [texts[text_id] for text_id in
+                self.header_texts[self.header_starts[file_id]:self.header_starts[file_id + 1]]]
+
+    def has_positions(self):
+        return len(self.header_lines) == len(self.header_texts)
+
+    def positions(self, filename):
+        """
+        [(header, level, line, offset), ...] of a note, line and offset are
+        None without `has_positions`
+        """
+        file_id = self.get_file_id(filename)
+        has_positions = self.has_positions()
+        return [
+            (self.texts[self.header_texts[i]], self.header_levels[i],
+             self.header_lines[i] if has_positions else None,
+             self.header_offsets[i] if has_positions else None)
+            for i in range(self.header_starts[file_id], self.header_starts[file_id + 1])]
+
+    def get_file_id(self, filename):
+        if self.file_ids is None:
+            self.file_ids = dict(
+                (self.filename(file_id), file_id) for file_id, name in enumerate(self.names) if name is not None)
+        return self.file_ids[filename]
+
+    def __getitem__(self, filename):
+        return self.headers(self.get_file_id(filename))
+
+    def __contains__(self, filename):
+        try:
+            self.get_file_id(filename)
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        folders, file_folders = self.folders, self.file_folders
+        for file_id, name in enumerate(self.names):
+            if name is not None:
+                yield folders[file_folders[file_id]] + name
+
+    def __len__(self):
+        return len(self.names) - self.removed
+
+    def items(self):
+        return CompactItems(self)
+
+    def mtimes(self):
+        """
+        {filename: mtime_ns} view of the mtime column
+        """
+        return CompactMtimes(self)
+
+    def header_count(self):
+        return len(self.header_texts)
+
+class CompactItems(collections.abc.ItemsView):
+    """
+    Iterates notes in order without the filename lookup
+    """
+    def __iter__(self):
+        index = self._mapping
+        folders, file_folders, texts = index.folders, index.file_folders, index.texts
+        header_starts, header_texts = index.header_starts, index.header_texts
+
+        for file_id, name in enumerate(index.names):
+            if name is not None:
+                yield folders[file_folders[file_id]] + name, \
+                    [texts[text_id] for text_id in header_texts[header_starts[file_id]:header_starts[file_id + 1]]]
+
+class CompactMtimes(collections.abc.Mapping):
+    """
+    mtimes of a `CompactIndex` by filename, for `tree_query.iter_scan_order`
+    which takes the newest first order from `newest_first` directly
+    """
+    __slots__ = ('index',)
+
+    def __init__(self, index):
+        self.index = index
+
+    def __getitem__(self, filename):
+        return self.index.file_mtimes[self.index.get_file_id(filename)]
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def newest_first(self):
+        """
+        (filename, headers) newest note first, ties in index order. headers
+        is a `HeaderView`, only iterated for notes whose path matches.
+        """
+        index = self.index
+        folders, file_folders, names, texts = index.folders, index.file_folders, index.names, index.texts
+        header_starts, header_texts = index.header_starts, index.header_texts
+
+        file_ids = [file_id for file_id, name in enumerate(names) if name is not None]
+        file_ids.sort(key=index.file_mtimes.__getitem__, reverse=True)
+        for file_id in file_ids:
+            # Most notes are skipped on their path, their headers never read
+            yield folders[file_folders[file_id]] + names[file_id], \
+                HeaderView(texts, header_texts[header_starts[file_id]:header_starts[file_id + 1]])
+
+class HeaderView:
+    """
+    A note's header list without building it: its length and an iterator
+    over the header strings
+    """
+    __slots__ = ('texts', 'text_ids')
+
+    def __init__(self, texts, text_ids):
+        self.texts = texts
+        self.text_ids = text_ids
+
+    def __len__(self):
+        return len(self.text_ids)
+
+    def __iter__(self):
+        return map(self.texts.__getitem__, self.text_ids)
+
+def header_level(header):
+    return len(header) - len(header.lstrip('#'))
@@ -0,0 +1,463 @@
+"""
+Optional resident process for the Alfred script filters.
+
+Holds the header index, daily note template and config in memory and answers
+requests from `scripts/client.py` over a unix socket, one json line per
+request and per response. Start it with `python -m scripts.daemon <vault>`.
+
+Unless the `watch` workflow variable is `0`, a thread applies note changes
+from `vault_watch` to the indexes as they happen, requests then skip the
+stat of every note. With `0`, a background thread sweeps the vault after
+requests instead, at most every `watch_interval` seconds. It also rebuilds
+the search's `ScanIndex` whenever the header index changes.
+"""
+import gc
+import os
+import sys
+import json
+import time
+import socket
+import datetime
+import threading
+import socketserver
+
+from scripts.utils import \
+    tree_schema, append_to_daily_vault, append_many_to_daily_vault, create_daily_note
+from scripts.vault_index import \
+    update_index, apply_changes, load_index, save_index, get_headers_by_path, get_mtimes_by_path, make_rel_path
+from scripts.vault_walk import walk_vault, get_ignore_rules
+from scripts.tree_query import QueryCache, ScanIndex
+from scripts.trigram_index import TrigramIndex
+from scripts.client import get_socket_path
+from scripts import fulltext_index, url_index, task_index, daily_sections, vault_watch, tracing, capture_log
+
+
+class VaultState:
+    """
+    Everything the daemon keeps warm between requests
+    """
+    def __init__(self, vault_path):
+        self.vault_path = vault_path
+        self.files = load_index(vault_path)
+        # Bumped whenever the header index changes, keys the query cache
+        self.generation = 0
+        self.headers_index = None
+        self.mtimes = None
+        self.query_cache = QueryCache()
+        # Rebuilt for each generation by the background thread, searches scan
+        # headers_index directly until it's ready
+        self.scan_index = None
+        self.scan_generation = None
+        # Built on the first fuzzy search, then updated per changed note
+        self.trigram_index = None
+        self.trigram_generation = None
+        # Opened on first use
+        self.fulltext_conn = None
+        self.url_conn = None
+        self.task_conn = None
+        # Requests and watcher batches take turns
+        self.lock = threading.Lock()
+        self.watcher = None
+        self.watch_thread = None
+        self.stop_watching = threading.Event()
+        # Sweeps without a watcher and index rebuilds, woken by `wake`
+        self.background_thread = None
+        self.wake = threading.Event()
+        self.last_sweep = None
+        # Restarted by each capture, see `compact_soon`
+        self.compact_timer = None
+        # Cleared while a request is handled, background walks wait for it
+        self.idle = threading.Event()
+        self.idle.set()
+        # The watcher keeps the header / full text index up to date, set by
+        # a full sweep while watching and cleared if a batch fails
+        self.in_sync = False
+        self.fulltext_in_sync = False
+        self.urls_in_sync = False
+        self.tasks_in_sync = False
+
+    def get_headers_index(self):
+        if self.headers_index is not None:
+            if self.in_sync:
+                return self.headers_index
+            if self.watcher is None and self.background_thread is not None:
+                # Swept in the background, changes show from the next request on
+                self.wake.set()
+                return self.headers_index
+
+        self.files, changed = update_index(self.vault_path, walk_vault(self.vault_path), files=self.files)
+        if changed:
+            # Keep the on disk index fresh for in-process fallback runs
+            save_index(self.vault_path, self.files)
+            self.bump_generation()
+
+        if changed or self.headers_index is None:
+            self.headers_index = get_headers_by_path(self.vault_path, self.files)
+            self.mtimes = get_mtimes_by_path(self.vault_path, self.files)
+        self.in_sync = self.watcher is not None
+        return self.headers_index
+
+    def bump_generation(self):
+        self.generation += 1
+        self.wake.set()
+
+    def get_scan_index(self):
+        return self.scan_index if self.scan_generation == self.generation else None
+
+    def warm_up(self):
+        """
+        Build everything before the first keystroke
+        """
+        with self.lock:
+            self.get_headers_index()
+            self.get_trigram_index()
+        self.refresh_scan_index()
+        self.freeze()
+
+    def freeze(self):
+        """
+        Leaves the indexes built so far out of the garbage collector's
+        passes, a full one over them blocked requests for most of a second.
+        They hold no reference cycles, replaced ones are still freed.
+        """
+        gc.freeze()
+
+    def start_background(self):
+        self.background_thread = threading.Thread(target=self.run_background, daemon=True)
+        self.background_thread.start()
+
+    def run_background(self):
+        interval = vault_watch.get_poll_interval()
+        while True:
+            self.wake.wait()
+            if self.stop_watching.is_set():
+                return
+            self.wake.clear()
+
+            try:
+                if self.watcher is None:
+                    # Woken by requests, at most one sweep per interval
+                    if self.last_sweep is not None:
+                        wait = self.last_sweep + interval - time.monotonic()
+                        if wait > 0 and self.stop_watching.wait(wait):
+                            return
+                    self.sweep()
+                    self.last_sweep = time.monotonic()
+                self.refresh_scan_index()
+                self.freeze()
+            except Exception as e:
+                sys.stderr.write(f"Warning - could not update the vault indexes in the background: {e}")
+
+    def sweep(self):
+        """
+        `get_headers_index`'s sweep, walking the vault and re-reading notes
+        without holding `lock`
+        """
+        with self.lock:
+            files = self.files
+        new_files, changed = update_index(
+            self.vault_path, vault_watch.between_requests(walk_vault(self.vault_path), self.idle), files=files)
+        if not changed:
+            return
+        headers_index = get_headers_by_path(self.vault_path, new_files)
+        mtimes = get_mtimes_by_path(self.vault_path, new_files)
+
+        with self.lock:
+            if self.files is not files:
+                # Swept by a request in between
+                return
+            self.files, self.headers_index, self.mtimes = new_files, headers_index, mtimes
+            self.bump_generation()
+        save_index(self.vault_path, new_files)
+
+    def refresh_scan_index(self):
+        """
+        Build the `ScanIndex` of the current generation from a copy of the
+        header index, without holding `lock`
+        """
+        with self.lock:
+            if self.headers_index is None or self.scan_generation == self.generation:
+                return
+            generation = self.generation
+            headers_index, mtimes = dict(self.headers_index), dict(self.mtimes)
+
+        with tracing.traced('scan_index', notes=len(headers_index)):
+            scan_index = ScanIndex(headers_index, make_rel_path(self.vault_path), mtimes)
+
+        with self.lock:
+            if self.generation == generation:
+                self.scan_index, self.scan_generation = scan_index, generation
+            if self.trigram_index is not None:
+                self.get_trigram_index()
+
+    def compact_soon(self):
+        """
+        Compact the capture log `capture_log.compact_delay` seconds after the
+        last capture, in a thread of its own so requests don't wait for the
+        note writes
+        """
+        if self.compact_timer is not None:
+            self.compact_timer.cancel()
+        self.compact_timer = threading.Timer(capture_log.compact_delay, self.compact_captures)
+        self.compact_timer.daemon = True
+        self.compact_timer.start()
+
+    def compact_captures(self):
+        try:
+            capture_log.compact(self.vault_path)
+        except Exception as e:
+            sys.stderr.write(f"Warning - could not compact the capture log: {e}")
+
+    def start_watching(self, mode='auto'):
+        """
+        Start the watcher thread, before the first sweep so no change falls
+        between the two
+        """
+        self.watcher = vault_watch.open_watcher(self.vault_path, get_ignore_rules(self.vault_path), mode=mode)
+        self.watcher.idle = self.idle
+        self.watch_thread = threading.Thread(target=self.watch, daemon=True)
+        self.watch_thread.start()
+
+    def watch(self):
+        while True:
+            batch = vault_watch.next_batch(self.watcher, self.stop_watching)
+            if batch is None:
+                self.watcher.close()
+                return
+            with self.lock:
+                self.apply_batch(batch)
+
+    def apply_pending(self):
+        """
+        Apply changes the watcher hasn't handed over yet, so a note written
+        right before a request is in its results
+        """
+        self.watcher.collect_pending()
+        self.apply_batch(self.watcher.take())
+
+    def apply_batch(self, batch):
+        """
+        Apply a `vault_watch.ChangeBatch` to the indexes, with `lock` held
+        """
+        if not batch:
+            return
+        try:
+            with tracing.traced('watch_batch', paths=len(batch.paths), dirs=len(batch.dirs), rescan=batch.rescan):
+                self.apply_changes(batch)
+        except Exception as e:
+            sys.stderr.write(f"Warning - could not apply vault changes, sweeping on next request: {e}")
+            self.in_sync = self.fulltext_in_sync = self.urls_in_sync = self.tasks_in_sync = False
+
+    def apply_changes(self, batch):
+        if batch.rescan or self.headers_index is None:
+            self.in_sync = self.fulltext_in_sync = self.urls_in_sync = self.tasks_in_sync = False
+            self.get_headers_index()
+            return
+
+        notes, removed = vault_watch.resolve_batch(
+            self.vault_path, batch, self.headers_index, self.watcher.ignore_rules)
+        tracing.count('notes', len(notes))
+        changes = apply_changes(self.vault_path, self.files, notes, removed)
+        if changes:
+            for filename, entry in changes.items():
+                if entry is None:
+                    del self.headers_index[filename]
+                    del self.mtimes[filename]
+                else:
+                    self.headers_index[filename] = entry['headers']
+                    self.mtimes[filename] = entry['fp'][0]
+            with tracing.stage('save'):
+                save_index(self.vault_path, self.files)
+            self.bump_generation()
+
+        if self.fulltext_in_sync:
+            with tracing.stage('fulltext'):
+                fulltext_index.update_index(self.fulltext_conn, self.vault_path, notes, removed=removed)
+        if self.urls_in_sync:
+            with tracing.stage('urls'):
+                url_index.update_index(self.url_conn, self.vault_path, notes, removed=removed)
+        if self.tasks_in_sync:
+            with tracing.stage('tasks'):
+                task_index.update_index(self.task_conn, self.vault_path, notes, removed=removed)
+
+    def find_url(self, url):
+        if self.url_conn is None:
+            # Also used by the watcher thread, `lock` keeps them apart
+            self.url_conn = url_index.open_index(self.vault_path, check_same_thread=False)
+        if not (self.in_sync and self.urls_in_sync):
+            url_index.update_index(self.url_conn, self.vault_path, walk_vault(self.vault_path))
+            self.urls_in_sync = self.watcher is not None
+        return url_index.lookup(self.url_conn, self.vault_path, url)
+
+    def find_open_tasks(self, since, before):
+        if self.task_conn is None:
+            # Also used by the watcher thread, `lock` keeps them apart
+            self.task_conn = task_index.open_index(self.vault_path, check_same_thread=False)
+        if not (self.in_sync and self.tasks_in_sync):
+            task_index.update_index(self.task_conn, self.vault_path, walk_vault(self.vault_path))
+            self.tasks_in_sync = self.watcher is not None
+        return task_index.get_open_tasks(self.task_conn, self.vault_path, before=before, since=since)
+
+    def get_trigram_index(self):
+        if self.trigram_index is None or self.trigram_index.needs_rebuild():
+            self.trigram_index = TrigramIndex()
+            self.trigram_generation = None
+        if self.trigram_generation != self.generation:
+            self.trigram_index.update(self.headers_index)
+            self.trigram_generation = self.generation
+        return self.trigram_index
+
+    def handle(self, request):
+        op = request.get('op')
+        args = request.get('args', {})
+
+        if self.in_sync:
+            self.apply_pending()
+
+        if op == 'ping':
+            return True
+        elif op == 'tree_schema':
+            with tracing.stage('index'):
+                headers_index = self.get_headers_index()
+            fuzzy = args.get('fuzzy', False)
+            return tree_schema(
+                self.vault_path, args['query'], headers_index=headers_index, mtimes=self.mtimes,
+                limit=args.get('limit'), cache=self.query_cache, generation=self.generation,
+                fuzzy=fuzzy, fuzzy_index=self.get_trigram_index() if fuzzy else None,
+                previews=args.get('previews', False), files=self.files, scan_index=self.get_scan_index())
+        elif op == 'stats':
+            return {
+                'generation': self.generation, 'query_cache': self.query_cache.stats(),
+                'watcher': type(self.watcher).__name__ if self.watcher is not None else None}
+        elif op == 'search_text':
+            if self.fulltext_conn is None:
+                # Also used by the watcher thread, `lock` keeps them apart
+                self.fulltext_conn = fulltext_index.open_index(self.vault_path, check_same_thread=False)
+            if not (self.in_sync and self.fulltext_in_sync):
+                fulltext_index.update_index(self.fulltext_conn, self.vault_path, walk_vault(self.vault_path))
+                self.fulltext_in_sync = self.watcher is not None
+            return fulltext_index.search(self.fulltext_conn, self.vault_path, args['query'], limit=args.get('limit', 20))
+        elif op == 'daily_sections':
+            # Only where the sections are, a date range can be years of
+            # sections which the client reads as it goes
+            return list(daily_sections.iter_locations(
+                self.vault_path, args['header'],
+                datetime.date.fromisoformat(args['start']), datetime.date.fromisoformat(args['end']),
+                files=self.files))
+        elif op == 'create_daily_note':
+            # The template and config stay cached in process, see `utils.get_daily_config`
+            return create_daily_note(self.vault_path, find_open_tasks=self.find_open_tasks)
+        elif op == 'compact_soon':
+            return self.compact_soon()
+        elif op == 'find_url':
+            return self.find_url(args['url'])
+        elif op == 'append_to_daily_vault':
+            return append_to_daily_vault(
+                self.vault_path, args['header'], args['message'],
+                create_header_if_missing=args.get('create_header_if_missing', False),
+                duplicate_urls=args.get('duplicate_urls'), find_url=self.find_url)
+        elif op == 'append_many_to_daily_vault':
+            return append_many_to_daily_vault(
+                self.vault_path, [tuple(entry) for entry in args['entries']],
+                create_header_if_missing=args.get('create_header_if_missing', False),
+                duplicate_urls=args.get('duplicate_urls'), find_url=self.find_url)
+        else:
+            raise ValueError(f"Unknown daemon op `{op}`")
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            state = self.server.state
+            state.idle.clear()
+            try:
+                # The op handled shows up as a stage, eg `tree_schema`. Locked
+                # first so traces of watcher batches don't nest in it.
+                with state.lock, tracing.traced('daemon_request') as trace:
+                    try:
+                        result = {'ok': True, 'result': state.handle(json.loads(line))}
+                    except Exception as e:
+                        result = {'ok': False, 'error': f'{type(e).__name__}: {e}'}
+
+                    with trace.stage('serialize'):
+                        response = json.dumps(result).encode('utf-8') + b'\n'
+
+                self.wfile.write(response)
+            finally:
+                state.idle.set()
+
+
+def is_listening(socket_path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        return False
+    finally:
+        sock.close()
+    return True
+
+
+# Seconds, see `sys.setswitchinterval`
+request_switch_interval = 0.0005
+
+class VaultServer(socketserver.UnixStreamServer):
+    # Requests are handled one at a time, which also serializes note writes
+
+    def __init__(self, vault_path, socket_path=None, watch=None):
+        """
+        watch - `vault_watch.get_watch_mode` value, defaults to the `watch`
+            workflow variable
+        """
+        self.socket_path = socket_path or get_socket_path(vault_path)
+        if os.path.exists(self.socket_path):
+            if is_listening(self.socket_path):
+                raise ValueError(f"A daemon is already serving {vault_path} on {self.socket_path}")
+            # Left behind by a daemon that didn't shut down cleanly
+            os.remove(self.socket_path)
+
+        # The watcher and background sweeps hold the GIL for stretches of
+        # walking the vault, every blocking read of a request then waited out
+        # the default 5ms switch interval to get it back
+        sys.setswitchinterval(request_switch_interval)
+
+        self.state = VaultState(vault_path)
+        if watch is None:
+            watch = vault_watch.get_watch_mode()
+        if watch is not None:
+            self.state.start_watching(watch)
+        self.state.start_background()
+
+        super().__init__(self.socket_path, RequestHandler)
+
+    def server_close(self):
+        super().server_close()
+        self.state.stop_watching.set()
+        self.state.wake.set()
+        for thread in (self.state.watch_thread, self.state.background_thread):
+            if thread is not None:
+                thread.join()
+        if self.state.compact_timer is not None:
+            # Captures still waiting for their compaction get it now
+            self.state.compact_timer.cancel()
+            self.state.compact_timer.join()
+            self.state.compact_captures()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+
+def serve(vault_path):
+    vault_path = os.path.expanduser(vault_path)
+
+    with VaultServer(vault_path) as server:
+        server.state.warm_up()
+        sys.stderr.write(f"Serving {vault_path} on {server.socket_path}\n")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+#### Run
+
+if __name__ == '__main__':
+    serve(sys.argv[1] if len(sys.argv) > 1 else os.environ['config_obsidian_vault'])
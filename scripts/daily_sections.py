@@ -0,0 +1,198 @@
+"""
+One header's section from every daily note in a date range, eg all
+`## Journal` entries of the last 90 days, as a single Alfred result or
+exported markdown.
+
+Daily notes are found with `utils.get_daily_note_path` for each day of the
+range instead of walking the vault. Only the section's bytes are read, at
+the offsets the header index recorded (`'spans'`) when an index is given,
+see `section_preview.read_section`. The daemon only locates the sections,
+its clients read them. Entries are yielded one note at a time
+so memory doesn't grow with the range, `workers` > 1 reads a few notes
+ahead on a thread pool.
+"""
+import os
+import sys
+import json
+import datetime
+import collections
+
+from scripts.utils import get_daily_note_path
+from scripts.vault_index import make_rel_path, file_fingerprint
+from scripts.section_preview import read_section, get_span
+from scripts import tracing
+
+# Notes read ahead per worker with `workers` > 1
+read_ahead = 2
+
+def get_workers():
+    """
+    Notes read in parallel, `section_workers` workflow variable. One by
+    default, section reads are too small for threads to pay off unless the
+    vault is on slow storage (eg not yet downloaded from a sync service).
+    """
+    return max(1, int(os.environ.get('section_workers') or 1))
+
+def iter_daily_notes(vault_path, start: datetime.date, end: datetime.date):
+    """
+    Yields (date, path) of the existing daily notes from start to end
+    (inclusive), oldest first. Formats naming several days the same note, eg
+    weekly notes, yield it once.
+    """
+    last_path = None
+    day = start
+    while day <= end:
+        path = get_daily_note_path(vault_path, note_date=datetime.datetime.combine(day, datetime.time()))
+        if path != last_path and os.path.exists(path):
+            yield day, path
+        last_path = path
+        day += datetime.timedelta(days=1)
+
+def locate_entry(note, header, files=None, rel_path=None):
+    """
+    (date, path, rel_path, span, fingerprint) to read header's section of a
+    daily note at, None when the index says the note has no such section.
+    span / fingerprint are None for notes without an index entry.
+    """
+    day, path = note
+    key = rel_path(path)
+    entry = files.get(key) if files is not None else None
+
+    if entry is not None and header not in entry['headers']:
+        # Indexed without the header, no need to look unless it changed since
+        try:
+            if file_fingerprint(os.stat(path)) == entry['fp']:
+                return None
+        except OSError:
+            return None
+
+    return (
+        day.isoformat(), path, key,
+        get_span(entry, header), entry['fp'] if entry is not None else None)
+
+def read_entry(location, header, max_bytes=None):
+    """
+    {'date', 'path', 'rel_path', 'text'} of the section at a `locate_entry`
+    location, None when it's missing or empty
+    """
+    date, path, key, span, fingerprint = location
+    text = read_section(path, header, span=span, fingerprint=fingerprint, max_bytes=max_bytes)
+    if not text:
+        return None
+    return {'date': date, 'path': path, 'rel_path': key, 'text': text}
+
+def map_bounded(fn, items, workers):
+    """
+    Ordered `map` over a thread pool with at most `read_ahead` items per
+    worker in flight, instead of `Executor.map` queueing every item up front
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = collections.deque()
+        for item in items:
+            pending.append(pool.submit(fn, item))
+            if len(pending) >= workers * read_ahead:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def iter_locations(vault_path, header, start, end, files=None):
+    """
+    Yields the `locate_entry` of every daily note from start to end that may
+    have the section
+
+    files - header index entries by vault relative path (`vault_index.load_index`),
+        their spans skip parsing the notes
+    """
+    rel_path = make_rel_path(vault_path)
+    for note in iter_daily_notes(vault_path, start, end):
+        location = locate_entry(note, header, files=files, rel_path=rel_path)
+        if location is not None:
+            yield location
+
+def read_sections(locations, header, workers=1, max_bytes=None):
+    """
+    Yields the non empty `read_entry` of each location
+
+    max_bytes - most bytes read per section, None for whole sections
+    """
+    def read(location):
+        return read_entry(location, header, max_bytes=max_bytes)
+
+    entries = map(read, locations) if workers <= 1 else map_bounded(read, locations, workers)
+    for entry in entries:
+        if entry is not None:
+            yield entry
+
+def iter_sections(vault_path, header, start, end, files=None, workers=1, max_bytes=None):
+    """
+    Yields the non empty `read_entry` of every daily note from start to end,
+    see `iter_locations` and `read_sections`
+    """
+    return read_sections(
+        iter_locations(vault_path, header, start, end, files=files), header, workers=workers, max_bytes=max_bytes)
+
+def get_note_link(rel_path):
+    return '[[' + (rel_path[:-len('.md')] if rel_path.endswith('.md') else rel_path) + ']]'
+
+def iter_markdown(entries, header):
+    """
+    Markdown export of entries, one chunk per entry: a sub header linking
+    each daily note followed by its section
+    """
+    level = len(header) - len(header.lstrip('#'))
+    sub_header = '#' * min(level + 1, 6)
+    for entry in entries:
+        yield f"{sub_header} {get_note_link(entry['rel_path'])}\n{entry['text']}\n\n"
+
+def parse_date_range(text, today: datetime.date):
+    """
+    (start, end) dates from `90` (the last 90 days, today included), `week`,
+    `month`, `year`, or `2023-01-01..2023-03-31`
+    """
+    text = text.strip()
+    if '..' in text:
+        start, end = text.split('..', 1)
+        return datetime.date.fromisoformat(start), datetime.date.fromisoformat(end)
+    if text.isdigit():
+        return today - datetime.timedelta(days=max(1, int(text)) - 1), today
+    if text == 'week':
+        return today - datetime.timedelta(days=today.weekday()), today
+    if text == 'month':
+        return today.replace(day=1), today
+    if text == 'year':
+        return today.replace(month=1, day=1), today
+    raise ValueError(f"Unknown date range `{text}`, expected a number of days, week, month, year or start..end")
+
+#### Run
+
+if __name__ == '__main__':
+    # `python -m scripts.daily_sections <header> [range] [markdown]` - one
+    # Alfred item with every entry (`cmd+L` / copy), or the markdown export
+    # on stdout. Range defaults to the last 30 days, see `parse_date_range`.
+    from scripts import client
+
+    vault_path = os.path.expanduser(os.environ['config_obsidian_vault'])
+    header = sys.argv[1]
+    start, end = parse_date_range(sys.argv[2] if len(sys.argv) > 2 else '30', datetime.date.today())
+
+    with tracing.traced('daily_sections', header=header, start=start.isoformat(), end=end.isoformat()) as trace:
+        entries = client.daily_sections(vault_path, header, start, end)
+        if len(sys.argv) > 3 and sys.argv[3] == 'markdown':
+            # Written as read, the range can be years of notes
+            for chunk in iter_markdown(entries, header):
+                sys.stdout.write(chunk)
+                trace.count('entries')
+        else:
+            chunks = list(iter_markdown(entries, header))
+            trace.count('entries', len(chunks))
+            markdown = ''.join(chunks).strip()
+            item = {
+                'title': f"{len(chunks)} {header} entries",
+                'subtitle': f"{start.isoformat()} to {end.isoformat()}",
+                'arg': markdown,
+                'text': {'largetype': markdown, 'copy': markdown},
+                'valid': bool(chunks),
+            }
+            sys.stdout.write(json.dumps({'items': [item]}))
@@ -0,0 +1,285 @@
+"""
+Full text search over note contents, replaces `mdfind` for `nf` / `f` and
+works on any OS.
+
+The inverted index (token -> notes containing it, with term counts and line
+numbers) is kept in a sqlite file in the cache dir, so a search only loads
+the postings of the query tokens instead of the whole index. Notes are
+re-indexed when their mtime/size/inode fingerprint changes. Results are
+ranked with BM25 and carry the best matching line for
+`create_obsidian_url(..., line_num=...)`.
+"""
+import os
+import re
+import sys
+import json
+import math
+import heapq
+import sqlite3
+import itertools
+
+from scripts.vault_index import get_cache_dir, file_fingerprint, make_rel_path
+from scripts.vault_walk import walk_vault
+
+index_file_name = 'fulltext_index.sqlite'
+
+regex_token = re.compile(r'\w+')
+
+# Most tokens the last (partially typed) query token expands to, shortest first
+prefix_expansions = 16
+
+# BM25 parameters, the usual defaults
+bm25_k1 = 1.2
+bm25_b = 0.75
+
+schema = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    fp TEXT NOT NULL,
+    length INTEGER NOT NULL,
+    tokens TEXT NOT NULL -- unique tokens in the note, to remove its postings
+);
+CREATE TABLE IF NOT EXISTS terms (
+    token TEXT PRIMARY KEY,
+    df INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS postings (
+    token TEXT NOT NULL,
+    file_id INTEGER NOT NULL,
+    tf INTEGER NOT NULL,
+    lines TEXT NOT NULL,
+    PRIMARY KEY (token, file_id)
+) WITHOUT ROWID;
+"""
+
+def tokenize(text):
+    return regex_token.findall(text.lower())
+
+def get_postings(content):
+    """
+    Returns ({token: [term count, [line numbers]]}, token count) for a note
+    """
+    postings = {}
+    length = 0
+    for line_num, line in enumerate(content.lower().split('\n')):
+        for token in regex_token.findall(line):
+            length += 1
+            entry = postings.get(token)
+            if entry is None:
+                postings[token] = [1, [line_num]]
+            else:
+                entry[0] += 1
+                if entry[1][-1] != line_num:
+                    entry[1].append(line_num)
+    return postings, length
+
+def open_index(vault_path, check_same_thread=True):
+    """
+    check_same_thread=False lets other threads use the connection, the
+    caller has to serialize them
+    """
+    cache_dir = get_cache_dir(vault_path)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    conn = sqlite3.connect(os.path.join(cache_dir, index_file_name), check_same_thread=check_same_thread)
+    # The index can always be rebuilt from the notes, trade durability for speed
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(schema)
+    return conn
+
+def update_index(conn, vault_path, notes, removed=None):
+    """
+    Re-index notes, (filename, stat_result) pairs, whose fingerprint changed
+    and drop notes no longer listed. Returns the number of notes (re)indexed
+    or removed.
+
+    removed - when given, `notes` are only the notes that changed (eg from
+        `vault_watch`) and just these filenames are dropped
+    """
+    rel_path = make_rel_path(vault_path)
+    known = dict((path, (file_id, fp)) for file_id, path, fp in conn.execute('SELECT id, path, fp FROM files'))
+
+    changed_files = [] # (file_id or None, rel path, fingerprint, filename)
+    seen = set()
+    for filename, stat_result in notes:
+        key = rel_path(filename)
+        seen.add(key)
+        fp = json.dumps(file_fingerprint(stat_result))
+
+        file_id, known_fp = known.get(key, (None, None))
+        if known_fp != fp:
+            changed_files.append((file_id, key, fp, filename))
+
+    if removed is None:
+        removed_ids = [file_id for key, (file_id, _) in known.items() if key not in seen]
+    else:
+        removed_keys = set(rel_path(filename) for filename in removed) - seen
+        removed_ids = [known[key][0] for key in removed_keys if key in known]
+
+    with conn:
+        removed_tokens = set() # terms whose df may have dropped to 0
+        for file_id in removed_ids:
+            removed_tokens.update(remove_file(conn, file_id))
+        conn.executemany('DELETE FROM files WHERE id = ?', ((file_id,) for file_id in removed_ids))
+
+        # Postings rows are collected and inserted in key order, much faster
+        # than inserting note by note on a cold build
+        posting_rows = []
+        df_changes = {}
+        for file_id, key, fp, filename in changed_files:
+            try:
+                # A stray non utf-8 byte shouldn't keep the rest of the note out
+                with open(filename, 'r', encoding='utf-8', errors='replace') as f:
+                    postings, length = get_postings(f.read())
+            except OSError:
+                continue
+
+            tokens = ' '.join(postings.keys())
+            if file_id is None:
+                file_id = conn.execute(
+                    'INSERT INTO files (path, fp, length, tokens) VALUES (?, ?, ?, ?)',
+                    (key, fp, length, tokens)).lastrowid
+            else:
+                removed_tokens.update(remove_file(conn, file_id))
+                conn.execute(
+                    'UPDATE files SET fp = ?, length = ?, tokens = ? WHERE id = ?',
+                    (fp, length, tokens, file_id))
+
+            for token, (tf, lines) in postings.items():
+                posting_rows.append((token, file_id, tf, ','.join(map(str, lines))))
+                df_changes[token] = df_changes.get(token, 0) + 1
+
+        posting_rows.sort(key=lambda row: row[0])
+        conn.executemany('INSERT INTO postings (token, file_id, tf, lines) VALUES (?, ?, ?, ?)', posting_rows)
+        conn.executemany(
+            'INSERT INTO terms (token, df) VALUES (?, ?) ON CONFLICT (token) DO UPDATE SET df = df + excluded.df',
+            sorted(df_changes.items()))
+        conn.executemany(
+            'DELETE FROM terms WHERE token = ? AND df <= 0', ((token,) for token in sorted(removed_tokens)))
+
+    return len(changed_files) + len(removed_ids)
+
+def remove_file(conn, file_id):
+    """
+    Drop a note's postings and returns its tokens. Its row in `files` and
+    terms left with a df of 0 are left to the caller.
+    """
+    (tokens,) = conn.execute('SELECT tokens FROM files WHERE id = ?', (file_id,)).fetchone()
+    tokens = tokens.split()
+
+    conn.executemany('DELETE FROM postings WHERE token = ? AND file_id = ?', ((token, file_id) for token in tokens))
+    conn.executemany('UPDATE terms SET df = df - 1 WHERE token = ?', ((token,) for token in tokens))
+    return tokens
+
+def read_line(filename, line_num):
+    try:
+        with open(filename, 'r', encoding='utf-8', errors='replace') as f:
+            line = next(itertools.islice(f, line_num, None), '')
+    except OSError:
+        return ''
+    return line.rstrip('\n')
+
+def search(conn, vault_path, query, limit=20):
+    """
+    BM25 ranked notes for query, best first:
+    [{'path', 'rel_path', 'score', 'line_num', 'line'}, ...]
+
+    The last query token also matches as a prefix, since Alfred searches as
+    you type. line_num is the 0 based line with the most query tokens.
+    """
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+
+    file_count, total_length = conn.execute('SELECT COUNT(*), SUM(length) FROM files').fetchone()
+    if not file_count:
+        return []
+    avg_length = total_length / file_count
+
+    scores = {}
+    lines_by_file = {}
+
+    def add_postings(rows):
+        rows = rows.fetchall()
+        if not rows:
+            return
+        idf = math.log(1 + (file_count - len(rows) + 0.5) / (len(rows) + 0.5))
+        for file_id, tf, lines, length in rows:
+            norm = tf + bm25_k1 * (1 - bm25_b + bm25_b * length / avg_length)
+            scores[file_id] = scores.get(file_id, 0.0) + idf * tf * (bm25_k1 + 1) / norm
+            lines_by_file.setdefault(file_id, []).append(lines)
+
+    select_postings = '''
+        SELECT p.file_id, p.tf, p.lines, f.length
+        FROM postings p JOIN files f ON f.id = p.file_id
+        WHERE p.token {}'''
+
+    *whole_tokens, last_token = tokens
+    for token in set(whole_tokens):
+        add_postings(conn.execute(select_postings.format('= ?'), (token,)))
+
+    # Each token matching the prefix is scored as its own term
+    prefix_tokens = conn.execute(
+        'SELECT token FROM terms WHERE token >= ? AND token < ? ORDER BY length(token), token LIMIT ?',
+        (last_token, last_token + '\U0010ffff', prefix_expansions)).fetchall()
+    for (token,) in prefix_tokens:
+        if token not in whole_tokens:
+            add_postings(conn.execute(select_postings.format('= ?'), (token,)))
+
+    top = heapq.nlargest(limit, scores.items(), key=lambda x: x[1])
+    if not top:
+        return []
+
+    paths = dict(conn.execute(
+        f"SELECT id, path FROM files WHERE id IN ({','.join('?' * len(top))})",
+        [file_id for file_id, _ in top]).fetchall())
+
+    out = []
+    for file_id, score in top:
+        # Line hit by the most query tokens, earliest first
+        line_hits = {}
+        for lines in lines_by_file[file_id]:
+            for line_num in lines.split(','):
+                line_hits[int(line_num)] = line_hits.get(int(line_num), 0) + 1
+        line_num = min(line_hits, key=lambda x: (-line_hits[x], x))
+
+        path = os.path.join(vault_path, paths[file_id])
+        out.append({
+            'path': path,
+            'rel_path': paths[file_id],
+            'score': score,
+            'line_num': line_num,
+            'line': read_line(path, line_num),
+        })
+    return out
+
+def search_vault(vault_path, query, limit=20):
+    """
+    Bring the index up to date with the vault then search it
+    """
+    conn = open_index(vault_path)
+    try:
+        update_index(conn, vault_path, walk_vault(vault_path))
+        return search(conn, vault_path, query, limit=limit)
+    finally:
+        conn.close()
+
+#### Run
+
+if __name__ == '__main__':
+    # `python -m scripts.fulltext_index <query>` - Alfred script filter output
+    from scripts.utils import create_obsidian_url
+    from scripts import client
+
+    vault_path = os.path.expanduser(os.environ['config_obsidian_vault'])
+    results = client.search_text(vault_path, " ".join(sys.argv[1:]))
+
+    items = [{
+        'title': result['rel_path'],
+        'subtitle': result['line'].strip(),
+        # Advanced URI lines are 1 based
+        'arg': create_obsidian_url(vault_path, result['rel_path'], line_num=result['line_num'] + 1),
+    } for result in results]
+    sys.stdout.write(json.dumps({'items': items}))
@@ -1,4 +1,275 @@
 import re
+import bisect
+import itertools
+
+# Headers and code fence lines are the only lines the parser needs to look at.
+# Lines that can be one are found with `bytes.find` (see `iter_candidate_lines`),
+# which skips the others far faster than the regex engine stepping through
+# every line, and only those are matched.
+md_line = rb'((#{1,6})[ \t][^\n]+|[ ]{0,3}(`{3,}|~{3,})[^\n]*)'
+regex_md_first_line = re.compile(md_line)
+regex_md_line = re.compile(rb'\n' + md_line)
+
+class Section:
+    """
+    One markdown header and the lines under it. Line numbers index into
+    `text.split('\\n')`, offsets are byte offsets into the utf-8 encoded note.
+
+    line / offset - the header line itself
+    last_line - last non empty line before the next header, None if there is no content
+    last_offset - just after `last_line` (or the header line), where appended text goes
+    body_end_line / body_end_offset - up to the next header of any level
+    end_line / end_offset - up to the next header of the same or higher level, ie including sub headers
+    """
+    __slots__ = (
+        'header', 'level', 'line', 'offset', 'last_line', 'last_offset',
+        'body_end_line', 'body_end_offset', 'end_line', 'end_offset',
+        'parent', 'children')
+
+    def __init__(self, header, level, line, offset):
+        self.header = header
+        self.level = level
+        self.line = line
+        self.offset = offset
+        self.last_line = None
+        self.last_offset = None
+        self.body_end_line = None
+        self.body_end_offset = None
+        self.end_line = None
+        self.end_offset = None
+        self.parent = None
+        self.children = []
+
+    def __repr__(self):
+        return f'Section({self.header!r}, line={self.line}, last_line={self.last_line}, end_line={self.end_line})'
+
+class Document:
+    """
+    Header tree of a note, `sections` is every header in order and `roots` the
+    top level ones. open_fence - the opening fence (eg '```') of a code block
+    left unclosed at the end of the note, None if there is none
+    """
+    __slots__ = ('sections', 'roots', 'line_count', 'size', 'open_fence')
+
+    def __init__(self, sections, roots, line_count, size, open_fence=None):
+        self.sections = sections
+        self.roots = roots
+        self.line_count = line_count
+        self.size = size
+        self.open_fence = open_fence
+
+    @property
+    def headers(self):
+        return [section.header for section in self.sections]
+
+    def find(self, header):
+        """
+        First section with exactly this header line, or None
+        """
+        for section in self.sections:
+            if section.header == header:
+                return section
+        return None
+
+def iter_candidate_lines(data):
+    """
+    Offsets of the lines of `data` that may be headers or code fences, in
+    order: lines starting with `#` and lines with a ``` / ~~~ run after up
+    to 3 spaces. Single byte `find`s are memchr, the bytes in between are
+    never looked at from Python.
+    """
+    starts = []
+    pos = data.find(b'#')
+    while pos != -1:
+        if pos == 0 or data[pos - 1] == 10:
+            starts.append(pos)
+            pos = data.find(b'\n', pos)
+            if pos == -1:
+                break
+        pos = data.find(b'#', pos + 1)
+
+    fenced = False
+    for char in (b'`', b'~'):
+        run = char * 3
+        pos = data.find(char)
+        while pos != -1:
+            if data[pos:pos + 3] == run:
+                newline = data.rfind(b'\n', max(pos - 4, 0), pos)
+                if newline != -1 or pos <= 3:
+                    starts.append(newline + 1)
+                    fenced = True
+                # Only the first run of a line can open or close a block
+                pos = data.find(b'\n', pos)
+                if pos == -1:
+                    break
+            pos = data.find(char, pos + 1)
+
+    return sorted(set(starts)) if fenced else starts
+
+def iter_header_lines(data, open_fence=None):
+    """
+    Yields (offset, header line, level) for every header in utf-8 bytes `data`,
+    skipping fenced code blocks
+
+    open_fence - optional list, the opening fence of a code block left
+    unclosed at the end of data is appended to it
+    """
+    match_line = regex_md_first_line.match
+
+    fence = None # opening fence chars while inside a code block
+    for line_start in iter_candidate_lines(data):
+        match = match_line(data, line_start)
+        if match is None:
+            continue
+        md_line, hashes, fence_chars = match.groups()
+        if fence_chars is not None:
+            if fence is None:
+                fence = fence_chars
+            elif fence_chars[0] == fence[0] and len(fence_chars) >= len(fence) \
+                    and md_line.strip() == fence_chars:
+                fence = None
+        elif fence is None:
+            yield line_start, md_line, len(hashes)
+
+    if fence is not None and open_fence is not None:
+        open_fence.append(fence)
+
+def parse_document(text):
+    """
+    Single linear pass over a note (str or utf-8 bytes) building its header
+    tree. `#` lines inside fenced code blocks are not headers.
+    """
+    data = text.encode('utf-8') if isinstance(text, str) else text
+    size = len(data)
+
+    sections = []
+    roots = []
+    stack = [] # open sections, outer to inner
+    current = None # last header seen, its body ends at the next header
+    current_header_end = None
+
+    line = 0
+    pos = 0 # offset `line` was counted up to
+    open_fence = []
+
+    for start, md_line, level in iter_header_lines(data, open_fence):
+        line += data.count(b'\n', pos, start)
+        pos = start
+
+        section = Section(md_line.rstrip(b'\r').decode('utf-8'), level, line, start)
+
+        if current is not None:
+            close_body(current, data, current_header_end, start, line - 1)
+        current = section
+        current_header_end = start + len(md_line)
+
+        while stack and stack[-1].level >= level:
+            closed = stack.pop()
+            closed.end_offset = start
+            closed.end_line = line - 1
+
+        if stack:
+            section.parent = stack[-1]
+            stack[-1].children.append(section)
+        else:
+            roots.append(section)
+
+        stack.append(section)
+        sections.append(section)
+
+    line_count = line + data.count(b'\n', pos) + 1
+
+    if current is not None:
+        close_body(current, data, current_header_end, size, line_count - 1)
+    for section in stack:
+        section.end_offset = size
+        section.end_line = line_count - 1
+
+    return Document(sections, roots, line_count, size, open_fence[0].decode('utf-8') if open_fence else None)
+
+def close_body(section, data, header_end, next_offset, body_end_line):
+    """
+    Set the body fields of a section whose header line ends at header_end and
+    whose body ends at next_offset. Only looks at the trailing blank lines.
+    """
+    size = len(data)
+    section.body_end_offset = next_offset
+    section.body_end_line = body_end_line
+    section.last_line = None
+
+    # Walk back over trailing blank lines
+    content_end = next_offset
+    while content_end > header_end and data[content_end - 1] == 10:
+        content_end -= 1
+
+    if content_end == header_end:
+        section.last_offset = min(header_end + 1, size)
+    else:
+        # next_offset is the start of the following line, or the end of the last line at EOF
+        blank = next_offset - content_end
+        section.last_line = body_end_line - blank + (1 if next_offset < size else 0)
+        section.last_offset = min(content_end + 1, size)
+
+def patch_document(document, insertions, data):
+    """
+    Parse of `data`, the note `document` was parsed from with
+    [(offset, bytes), ...] inserted, without parsing it again: offsets and
+    line numbers after an insertion are shifted, and sections with an
+    insertion have their body re-measured from its end. Only the bytes
+    around those ends are read.
+
+    Returns None when inserted text has header or code fence lines, which can
+    change the header tree (or close a code block), parse the note again then.
+    """
+    for _, inserted in insertions:
+        # Insertions start at line starts, or with a newline
+        if regex_md_line.search(b'\n' + inserted) is not None:
+            return None
+
+    insertions = sorted(insertions, key=lambda x: x[0])
+    offsets = [offset for offset, _ in insertions]
+    # Bytes and lines inserted up to and including each insertion
+    added_bytes = list(itertools.accumulate(len(inserted) for _, inserted in insertions))
+    added_lines = list(itertools.accumulate(inserted.count(b'\n') for _, inserted in insertions))
+
+    def shift(offset):
+        # Text inserted at an offset goes before what was there
+        i = bisect.bisect_right(offsets, offset)
+        return (added_bytes[i - 1], added_lines[i - 1]) if i else (0, 0)
+
+    sections = []
+    roots = []
+    new_sections = {} # id(old section): new section
+    for old in document.sections:
+        section = Section(old.header, old.level, old.line, old.offset)
+        for offset_name, line_name in [
+                ('offset', 'line'), ('body_end_offset', 'body_end_line'), ('end_offset', 'end_line')]:
+            added, lines = shift(getattr(old, offset_name))
+            setattr(section, offset_name, getattr(old, offset_name) + added)
+            setattr(section, line_name, getattr(old, line_name) + lines)
+
+        i = bisect.bisect_left(offsets, old.offset)
+        if i < len(offsets) and offsets[i] <= old.body_end_offset:
+            header_end = data.find(b'\n', section.offset, section.body_end_offset)
+            if header_end == -1:
+                header_end = section.body_end_offset
+            close_body(section, data, header_end, section.body_end_offset, section.body_end_line)
+        else:
+            # Nothing inserted in the body, it moved as a whole
+            added, lines = shift(old.offset)
+            section.last_offset = old.last_offset + added
+            section.last_line = old.last_line + lines if old.last_line is not None else None
+
+        if old.parent is not None:
+            section.parent = new_sections[id(old.parent)]
+            section.parent.children.append(section)
+        else:
+            roots.append(section)
+        sections.append(section)
+        new_sections[id(old)] = section
+
+    added, lines = shift(document.size)
+    return Document(sections, roots, document.line_count + lines, document.size + added, document.open_fence)
 
 def get_header_sections(text):
     """ Given markdown text, return:
@@ -12,40 +283,63 @@ def get_header_sections(text):
     Notes:
     Sub header's lines wont be included in parent header.
     For now that's fine, but requirements could be changed later
-    
-    Generated with LLM from Phind.com v9 model
     """
+    data = text.encode('utf-8') if isinstance(text, str) else text
 
-    # Split the text into lines
-    lines = text.split('\n')
+    # parse_document's line / body_end_line, without building the tree
+    out = {}
+    header = None
+    line = 0
+    pos = 0
+    for start, md_line, _ in iter_header_lines(data):
+        line += data.count(b'\n', pos, start)
+        pos = start
+        if header is not None:
+            out[header] = (header_line, line - 1)
+        header = md_line.rstrip(b'\r').decode('utf-8')
+        header_line = line
+    if header is not None:
+        out[header] = (header_line, line + data.count(b'\n', pos))
+    return out
 
-    # Initialize a list to store the header sections
-    header_sections = []
-
-    # Initialize variables to keep track of the current header section and its level
-    current_header = None
-    current_level = None
-    current_header_start = None
-
-    # Iterate over each line
-    for i, line in enumerate(lines):
-        # Check if the line starts with a hash sign
-        if line.startswith('#'):
-            # Extract the level of the header (i.e., the number of '#' signs)
-            level = len(re.match('#*', line).group())
+def get_headers(text):
+    """ Given markdown text, return list of header lines in order of appearance
+    """
+    # Same rules as parse_document, without building the tree
+    data = text.encode('utf-8') if isinstance(text, str) else text
+    return [md_line.rstrip(b'\r').decode('utf-8') for _, md_line, _ in iter_header_lines(data)]
 
-            # If it does, and there is a current header section, add it to the list
-            if current_header is not None and level <= current_level:
-                header_sections.append((current_header, (current_header_start, i - 1)))
+def get_header_positions(text):
+    """
+    [(header line, level, line number, byte offset), ...] in order of
+    appearance, the headers `get_headers` returns
+    """
+    data = text.encode('utf-8') if isinstance(text, str) else text
 
-            # Start a new header section
-            current_header = line.strip()
-            current_level = level
-            current_header_start = i
+    out = []
+    line = 0
+    pos = 0
+    for start, md_line, level in iter_header_lines(data):
+        line += data.count(b'\n', pos, start)
+        pos = start
+        out.append((md_line.rstrip(b'\r').decode('utf-8'), level, line, start))
+    return out
 
-    # Add the last header section to the list
-    if current_header is not None:
-        header_sections.append((current_header, (current_header_start, len(lines) - 1)))
+def get_header_spans(text):
+    """
+    (headers, spans) - the headers `get_headers` returns and per header its
+    [byte offset, body end offset], the body going up to the next header of
+    any level. Also takes an mmap.
+    """
+    data = text.encode('utf-8') if isinstance(text, str) else text
 
-    return dict(header_sections)
-        
\ No newline at end of file
+    headers = []
+    spans = []
+    for start, md_line, _ in iter_header_lines(data):
+        if spans:
+            spans[-1][1] = start
+        headers.append(md_line.rstrip(b'\r').decode('utf-8'))
+        spans.append([start, None])
+    if spans:
+        spans[-1][1] = len(data)
+    return headers, spans
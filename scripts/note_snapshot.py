@@ -0,0 +1,150 @@
+"""
+Persisted parse of the daily note, so a capture doesn't re-read and re-parse
+a note whose only change since the last capture is what that capture
+inserted.
+
+The snapshot is the note's header tree (`note_parser.Document`, offsets and
+line numbers of every section) and the mtime / size / inode fingerprint of
+the note it describes, kept in `<cache dir>/note_snapshot.json` and in
+process. A snapshot saved while the note's mtime is recent enough for a same
+size edit to keep it (`snapshot_racy_ns`) also has the note's crc32, checked
+before the snapshot is used. After a capture the tree is patched for the insertions
+(`note_parser.patch_document`) instead of parsed again. When the note's
+fingerprint no longer matches, eg it was edited in Obsidian, the note is
+parsed from scratch.
+"""
+import os
+import sys
+import json
+import mmap
+import time
+import zlib
+
+from scripts.note_parser import Section, Document, parse_document, patch_document
+from scripts.vault_index import get_cache_dir, file_fingerprint, make_rel_path, write_json_atomic
+
+SNAPSHOT_VERSION = 2
+snapshot_file_name = 'note_snapshot.json'
+
+# Smaller notes parse faster than the snapshot is loaded and saved
+snapshot_min_bytes = 64_000
+
+# Same window as `utils.daily_config_racy_ns`, a note modified this recently
+# may be modified again within the same mtime tick
+snapshot_racy_ns = 2_000_000_000
+
+# vault_path: snapshot content, the last one saved or loaded by this process
+snapshot_cache = {}
+
+section_fields = [
+    'header', 'level', 'line', 'offset', 'last_line', 'last_offset',
+    'body_end_line', 'body_end_offset', 'end_line', 'end_offset']
+
+def get_snapshot_path(vault_path):
+    return os.path.join(get_cache_dir(vault_path), snapshot_file_name)
+
+def document_to_json(document):
+    index = dict((id(section), i) for i, section in enumerate(document.sections))
+    return {
+        'line_count': document.line_count,
+        'size': document.size,
+        'open_fence': document.open_fence,
+        # Fields in `section_fields` order, then the parent's position
+        'sections': [
+            [getattr(section, name) for name in section_fields] +
+            [index[id(section.parent)] if section.parent is not None else None]
+            for section in document.sections],
+    }
+
+def document_from_json(content):
+    sections = []
+    roots = []
+    for values in content['sections']:
+        section = Section(*values[:4])
+        for name, value in zip(section_fields[4:], values[4:-1]):
+            setattr(section, name, value)
+
+        parent = values[-1]
+        if parent is not None:
+            section.parent = sections[parent]
+            section.parent.children.append(section)
+        else:
+            roots.append(section)
+        sections.append(section)
+    return Document(sections, roots, content['line_count'], content['size'], content['open_fence'])
+
+def get_crc(data):
+    return zlib.crc32(data)
+
+def load_snapshot(vault_path, note_path, fingerprint):
+    """
+    The note's Document if the snapshot is of this note at this fingerprint
+    (and content, for snapshots saved in the racy window), else None
+    """
+    rel_path = make_rel_path(vault_path)(note_path)
+
+    def matches(content):
+        return content['path'] == rel_path and content['fp'] == fingerprint
+
+    content = snapshot_cache.get(vault_path)
+    if content is None or not matches(content):
+        # Another process may have written the note since
+        try:
+            with open(get_snapshot_path(vault_path), 'r') as f:
+                content = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if content.get('version') != SNAPSHOT_VERSION or not matches(content):
+            return None
+        snapshot_cache[vault_path] = content
+
+    if content.get('crc') is not None:
+        # An edit in the same mtime tick keeps the fingerprint
+        try:
+            with open(note_path, 'rb') as f:
+                if get_crc(f.read()) != content['crc']:
+                    return None
+        except OSError:
+            return None
+
+    return document_from_json(content['document'])
+
+def save_snapshot(vault_path, note_path, fingerprint, document, crc=None):
+    """
+    crc - `get_crc` of the note, needed while its mtime is in the racy
+        window, the snapshot isn't saved without it
+    """
+    racy = time.time_ns() - fingerprint[0] <= snapshot_racy_ns
+    if racy and crc is None:
+        snapshot_cache.pop(vault_path, None)
+        return
+
+    content = {
+        'version': SNAPSHOT_VERSION,
+        'path': make_rel_path(vault_path)(note_path),
+        'fp': fingerprint,
+        'crc': crc if racy else None,
+        'document': document_to_json(document),
+    }
+    snapshot_cache[vault_path] = content
+    try:
+        write_json_atomic(get_snapshot_path(vault_path), content)
+    except OSError as e:
+        sys.stderr.write(f"Warning - could not save note snapshot: {e}")
+
+def get_written_snapshot(document, insertions, path):
+    """
+    (fingerprint, Document, crc) of the note at path, written with
+    insertions into the note `document` describes
+    """
+    with open(path, 'rb') as f:
+        fingerprint = file_fingerprint(os.fstat(f.fileno()))
+        if not fingerprint[1]:
+            return fingerprint, parse_document(b''), get_crc(b'')
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            patched = patch_document(document, insertions, data)
+            if patched is None:
+                # Insertions added headers
+                patched = parse_document(data[:])
+            crc = get_crc(data)
+    return fingerprint, patched, crc
@@ -0,0 +1,88 @@
+"""
+Previews of the text under a header, for the subtitle / large type of search
+results without opening Obsidian.
+
+The header index records each header's byte range (`'spans'`, see
+`note_parser.get_header_spans`), so a preview memory maps the note and only
+touches the pages of that range, the rest of a long note is never read.
+Notes that changed since they were indexed are parsed again instead.
+"""
+import os
+import mmap
+
+from scripts.note_parser import get_header_spans
+from scripts.vault_index import file_fingerprint
+
+# Most bytes of a section read for a preview
+preview_bytes = 500
+
+def get_span(entry, header):
+    """
+    [start, end] of header's first occurrence from an index entry, None if
+    the entry has no spans or not this header
+    """
+    if entry is None or 'spans' not in entry:
+        return None
+    try:
+        return entry['spans'][entry['headers'].index(header)]
+    except ValueError:
+        return None
+
+def find_span(data, header):
+    """
+    Parse the note for header's [start, end], whole note before the first
+    header for an empty header
+    """
+    headers, spans = get_header_spans(data)
+    if not header:
+        return [0, spans[0][0] if spans else len(data)]
+    try:
+        return spans[headers.index(header)]
+    except ValueError:
+        return None
+
+def read_section(filename, header, span=None, fingerprint=None, max_bytes=preview_bytes):
+    """
+    Text under `header` up to the next header, at most max_bytes of it
+    (cut at a character boundary, None for all of it). An empty header
+    previews the start of the note.
+
+    span / fingerprint - from the note's index entry, the note is parsed
+    again when it no longer matches them
+    Returns '' for missing sections and unreadable notes
+    """
+    try:
+        with open(filename, 'rb') as f:
+            stat_result = os.fstat(f.fileno())
+            if not stat_result.st_size:
+                return ''
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                header_bytes = header.encode('utf-8')
+                if span is None or span[1] > len(data) \
+                        or (fingerprint is not None and file_fingerprint(stat_result) != fingerprint) \
+                        or data[span[0]:span[0] + len(header_bytes)] != header_bytes:
+                    span = find_span(data, header)
+                    if span is None:
+                        return ''
+
+                start, end = span
+                if header:
+                    # Skip the header line itself
+                    start = data.find(b'\n', start, end)
+                    start = end if start == -1 else start + 1
+                if max_bytes is None:
+                    max_bytes = end - start
+                section = data[start:min(end, start + max_bytes)]
+    except (OSError, ValueError):
+        return ''
+
+    truncated = end - start > max_bytes
+    # A cut in the middle of a character drops it
+    text = section.decode('utf-8', errors='ignore').strip()
+    return text + '…' if truncated and text else text
+
+def get_summary(text):
+    """
+    Non empty lines of a preview joined into one line, for a subtitle
+    """
+    return ' '.join(line.strip() for line in text.split('\n') if line.strip())
@@ -0,0 +1,247 @@
+"""
+Vault wide index of the tasks (`- [ ]` / `- [x]` lines) under each note's
+`## Todo` header, with the date of the daily note they are in. Lets
+`utils.create_daily_note` carry open todos into a new daily note with one
+indexed query instead of reading years of old daily notes.
+
+Kept in a sqlite file in the cache dir like `fulltext_index`, notes are
+re-read when their mtime/size/inode fingerprint changes. Carried over tasks
+are copied, so the same task shows up in every daily note until it's
+checked off: a task is open when its latest daily note has it unchecked.
+"""
+import os
+import re
+import sys
+import json
+import sqlite3
+import datetime
+
+from scripts.note_parser import parse_document
+from scripts.vault_index import get_cache_dir, file_fingerprint, make_rel_path
+from scripts.vault_walk import walk_vault
+
+index_file_name = 'task_index.sqlite'
+
+todo_header = '## Todo'
+
+regex_task = re.compile(r'^\s*[-*+] \[([ xX])\] (.*)$')
+
+# Open tasks of daily notes older than this aren't carried over, unless the
+# `carry_over_days` workflow variable says otherwise (0 for no limit)
+default_carry_over_days = 30
+
+schema = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    fp TEXT NOT NULL,
+    date TEXT -- iso date of a daily note, NULL for other notes
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    file_id INTEGER NOT NULL,
+    line INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    done INTEGER NOT NULL,
+    date TEXT,
+    PRIMARY KEY (file_id, line)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS tasks_open ON tasks (done, date);
+CREATE INDEX IF NOT EXISTS tasks_text ON tasks (text, date, done);
+"""
+
+def get_tasks(data, header=todo_header):
+    """
+    Returns [(line number, text, done)] of the tasks in the body of header
+    (utf-8 bytes of a note), checked with `x` or `X`
+    """
+    if header.encode('utf-8') not in data:
+        return []
+
+    section = parse_document(data).find(header)
+    if section is None or section.last_line is None:
+        return []
+
+    body = data[section.offset:section.last_offset].decode('utf-8', errors='replace').split('\n')
+    tasks = []
+    for line_num, line in enumerate(body[1:], section.line + 1):
+        match = regex_task.match(line)
+        if match is not None and match.group(2).strip():
+            tasks.append((line_num, match.group(2).strip(), match.group(1) != ' '))
+    return tasks
+
+def get_note_date(rel_path, daily_note_format):
+    """
+    Iso date of the daily note at rel_path, None for other notes
+    """
+    name = rel_path[:-len('.md')] if rel_path.endswith('.md') else rel_path
+    if daily_note_format.endswith('.md'):
+        daily_note_format = daily_note_format[:-len('.md')]
+    try:
+        return datetime.datetime.strptime(name, daily_note_format).date().isoformat()
+    except ValueError:
+        return None
+
+def get_carry_over_days():
+    return int(os.environ.get('carry_over_days') or default_carry_over_days)
+
+def open_index(vault_path, check_same_thread=True):
+    """
+    check_same_thread=False lets other threads use the connection, the
+    caller has to serialize them
+    """
+    cache_dir = get_cache_dir(vault_path)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    conn = sqlite3.connect(os.path.join(cache_dir, index_file_name), check_same_thread=check_same_thread)
+    # The index can always be rebuilt from the notes, trade durability for speed
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(schema)
+    return conn
+
+def update_index(conn, vault_path, notes, removed=None):
+    """
+    Re-index notes, (filename, stat_result) pairs, whose fingerprint changed
+    and drop notes no longer listed. Returns the number of notes (re)indexed
+    or removed.
+
+    removed - when given, `notes` are only the notes that changed (eg from
+        `vault_watch`) and just these filenames are dropped
+    """
+    daily_note_format = os.environ.get('daily_note_format') or ''
+    rel_path = make_rel_path(vault_path)
+
+    with conn:
+        # Note dates come from the daily note format, changing it re-indexes
+        row = conn.execute("SELECT value FROM meta WHERE key = 'daily_note_format'").fetchone()
+        if row is None or row[0] != daily_note_format:
+            conn.execute('DELETE FROM tasks')
+            conn.execute('DELETE FROM files')
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('daily_note_format', ?)", (daily_note_format,))
+
+    known = dict((path, (file_id, fp)) for file_id, path, fp in conn.execute('SELECT id, path, fp FROM files'))
+
+    changed_files = [] # (file_id or None, rel path, fingerprint, filename)
+    seen = set()
+    for filename, stat_result in notes:
+        key = rel_path(filename)
+        seen.add(key)
+        fp = json.dumps(file_fingerprint(stat_result))
+
+        file_id, known_fp = known.get(key, (None, None))
+        if known_fp != fp:
+            changed_files.append((file_id, key, fp, filename))
+
+    if removed is None:
+        removed_ids = [file_id for key, (file_id, _) in known.items() if key not in seen]
+    else:
+        removed_keys = set(rel_path(filename) for filename in removed) - seen
+        removed_ids = [known[key][0] for key in removed_keys if key in known]
+
+    with conn:
+        conn.executemany('DELETE FROM tasks WHERE file_id = ?', ((file_id,) for file_id in removed_ids))
+        conn.executemany('DELETE FROM files WHERE id = ?', ((file_id,) for file_id in removed_ids))
+
+        task_rows = []
+        for file_id, key, fp, filename in changed_files:
+            try:
+                with open(filename, 'rb') as f:
+                    tasks = get_tasks(f.read())
+            except OSError:
+                continue
+
+            date = get_note_date(key, daily_note_format)
+            if file_id is None:
+                file_id = conn.execute(
+                    'INSERT INTO files (path, fp, date) VALUES (?, ?, ?)', (key, fp, date)).lastrowid
+            else:
+                conn.execute('DELETE FROM tasks WHERE file_id = ?', (file_id,))
+                conn.execute('UPDATE files SET fp = ?, date = ? WHERE id = ?', (fp, date, file_id))
+            task_rows.extend((file_id, line_num, text, done, date) for line_num, text, done in tasks)
+
+        conn.executemany('INSERT INTO tasks (file_id, line, text, done, date) VALUES (?, ?, ?, ?, ?)', task_rows)
+
+    return len(changed_files) + len(removed_ids)
+
+def get_open_tasks(conn, vault_path, before=None, since=None):
+    """
+    Open tasks of daily notes, once per task text, oldest first:
+    [{'path', 'rel_path', 'line_num', 'text', 'date'}, ...]
+
+    A task is open when the latest daily note with it (before `before`) has
+    it unchecked. Only tasks open in daily notes from `since` on are listed,
+    dates are iso strings.
+    """
+    before = before or '9999-12-31'
+    # Open rows in the date range, each checked with two `tasks_text` seeks.
+    # Without `since` that's every carried copy of every open task.
+    rows = conn.execute(
+        '''SELECT f.path, t.line, t.text, t.date FROM tasks t JOIN files f ON f.id = t.file_id
+        WHERE t.done = 0 AND t.date >= ? AND t.date < ?
+        AND t.date = (SELECT MAX(later.date) FROM tasks later WHERE later.text = t.text AND later.date < ?)
+        AND NOT EXISTS (SELECT 1 FROM tasks same WHERE same.text = t.text AND same.date = t.date AND same.done = 1)
+        ORDER BY t.date, f.path, t.line''', (since or '', before, before))
+
+    out = []
+    texts = set()
+    for path, line_num, text, date in rows:
+        if text in texts:
+            continue
+        texts.add(text)
+        out.append({
+            'path': os.path.join(vault_path, path), 'rel_path': path,
+            'line_num': line_num, 'text': text, 'date': date})
+    return out
+
+def get_carry_over_range(note_date: datetime.datetime):
+    """
+    (since, before) iso dates of the daily notes a new daily note for
+    note_date carries open tasks over from
+    """
+    days = get_carry_over_days()
+    since = (note_date - datetime.timedelta(days=days)).date().isoformat() if days > 0 else None
+    return since, note_date.date().isoformat()
+
+def get_carry_over_vault(vault_path, note_date: datetime.datetime):
+    """
+    Bring the index up to date with the vault then return the open tasks
+    to carry into the daily note of note_date
+    """
+    conn = open_index(vault_path)
+    try:
+        update_index(conn, vault_path, walk_vault(vault_path))
+        since, before = get_carry_over_range(note_date)
+        return get_open_tasks(conn, vault_path, before=before, since=since)
+    finally:
+        conn.close()
+
+def format_tasks(tasks):
+    return '\n'.join(f"- [ ] {task['text']}" for task in tasks)
+
+#### Run
+
+if __name__ == '__main__':
+    # `python -m scripts.task_index` - Alfred script filter output, the open
+    # tasks of every daily note, oldest first
+    from scripts.utils import create_obsidian_url
+
+    vault_path = os.path.expanduser(os.environ['config_obsidian_vault'])
+    conn = open_index(vault_path)
+    try:
+        update_index(conn, vault_path, walk_vault(vault_path))
+        tasks = get_open_tasks(conn, vault_path)
+    finally:
+        conn.close()
+
+    items = [{
+        'title': task['text'],
+        'subtitle': task['rel_path'],
+        # Advanced URI lines are 1 based
+        'arg': create_obsidian_url(vault_path, task['rel_path'], line_num=task['line_num'] + 1),
+    } for task in tasks]
+    sys.stdout.write(json.dumps({'items': items}))
@@ -0,0 +1,182 @@
+"""
+Opt-in timing traces for the hot paths, to tell whether a slow search goes
+to walking the vault, reading notes, matching or serializing.
+
+Set the `trace` workflow variable to `1` to get one json line per traced
+call on stderr (Alfred's debugger), or to a file path to append them to a
+log there instead, rotated at `trace_max_bytes`:
+
+    {"op": "tree_schema", "ms": 12.4, "stages": {"index": 8.1, "match": 3.9, "items": 0.3},
+     "counters": {"notes": 2000, "reread": 1, "bytes_read": 2048, "results": 50}, ...}
+
+Stage times are milliseconds and add up over repeated stages, eg the
+`read` of every changed note. A traced call made inside another one is
+recorded as a stage of the outer call, its counters go to the outer call.
+
+Disabled, `traced` hands out a shared no-op trace, instrumented code only
+pays an env lookup per call and a no-op method call per stage.
+"""
+import os
+import sys
+import json
+import time
+import contextlib
+
+# Trace log files are rotated to `<path>.1` ... `<path>.<trace_backups>`
+trace_max_bytes = 1_000_000
+trace_backups = 3
+
+class Trace:
+    def __init__(self, op, args):
+        self.op = op
+        self.args = args
+        self.start = time.perf_counter()
+        self.stages = {} # name: ms
+        self.counters = {} # name: count
+
+    def __bool__(self):
+        return True
+
+    def stage(self, name):
+        return Stage(self, name)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def record(self, error=None):
+        record = {
+            'op': self.op,
+            'ts': round(time.time(), 3),
+            'pid': os.getpid(),
+            'ms': round((time.perf_counter() - self.start) * 1000, 3),
+            'stages': dict((name, round(ms, 3)) for name, ms in self.stages.items()),
+            'counters': self.counters,
+            'args': self.args,
+        }
+        if error is not None:
+            record['error'] = error
+        return record
+
+class Stage:
+    __slots__ = ('trace', 'name', 'start')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        stages = self.trace.stages
+        stages[self.name] = stages.get(self.name, 0.0) + (time.perf_counter() - self.start) * 1000
+        return False
+
+class NullTrace:
+    """
+    Stands in for a Trace when tracing is off, `if trace:` is False
+    """
+    def __bool__(self):
+        return False
+
+    def stage(self, name):
+        return null_stage
+
+    def count(self, name, n=1):
+        pass
+
+null_trace = NullTrace()
+null_stage = contextlib.nullcontext()
+
+# Trace of the outermost traced call in progress
+current = null_trace
+
+def get_trace_target():
+    """
+    None (off), 'stderr' or a log file path, from the `trace` workflow variable
+    """
+    target = os.environ.get('trace', '').strip()
+    if not target or target == '0':
+        return None
+    if target in ('1', 'stderr'):
+        return 'stderr'
+    return os.path.expanduser(target)
+
+@contextlib.contextmanager
+def traced(op, **args):
+    """
+    Trace the block as `op`, yields the Trace to add stages and counters to.
+    args are json values recorded with the trace, eg the query.
+    """
+    global current
+
+    if current:
+        # Nested in another traced call
+        with current.stage(op):
+            yield current
+        return
+
+    target = get_trace_target()
+    if target is None:
+        yield null_trace
+        return
+
+    trace = current = Trace(op, args)
+    error = None
+    try:
+        yield trace
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        current = null_trace
+        emit(trace.record(error=error), target)
+
+def stage(name):
+    """
+    Time a stage of the traced call in progress, if any
+    """
+    return current.stage(name)
+
+def count(name, n=1):
+    """
+    Add to a counter of the traced call in progress, if any
+    """
+    current.count(name, n)
+
+def emit(record, target):
+    line = json.dumps(record) + '\n'
+    if target == 'stderr':
+        # Warnings written to stderr don't end their line
+        sys.stderr.write('\n' + line)
+        return
+
+    try:
+        rotate_log(target)
+        with open(target, 'a') as f:
+            f.write(line)
+    except OSError as e:
+        sys.stderr.write(f"Warning - could not write trace to {target}: {e}")
+
+def rotate_log(path, max_bytes=None, backups=None):
+    max_bytes = trace_max_bytes if max_bytes is None else max_bytes
+    backups = trace_backups if backups is None else backups
+
+    try:
+        if os.path.getsize(path) < max_bytes:
+            return
+    except OSError:
+        # No log yet
+        parent_dir = os.path.dirname(path)
+        if parent_dir:
+            os.makedirs(parent_dir, exist_ok=True)
+        return
+
+    for i in range(backups - 1, 0, -1):
+        if os.path.exists(f'{path}.{i}'):
+            os.replace(f'{path}.{i}', f'{path}.{i + 1}')
+    if backups:
+        os.replace(path, f'{path}.1')
+    else:
+        os.remove(path)
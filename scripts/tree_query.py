@@ -0,0 +1,652 @@
+"""
+Query engine behind `ns` / `tree_schema`.
+
+A query `<path glob>:<header glob>` is compiled once into a path matcher and a
+header matcher which run directly against the header index: the path is
+checked once per note, headers only for notes whose path matched. No
+`filename:header` strings are built and split back apart.
+
+Ranked searches keep only the best `limit` matches while scanning, best
+being an exact header (or note name) match, then a prefix match, then any
+other glob match, each from the most recently modified note first.
+
+`QueryCache` keeps the ranked matches of recent queries, so a query typed one
+more character filters the previous query's matches instead of scanning the
+whole index, when that query's scan saw all of them.
+"""
+import os
+import re
+import sys
+import array
+import bisect
+import heapq
+import itertools
+import fnmatch
+import collections
+
+from scripts.vault_walk import compile_path_glob
+
+def pad_glob(pattern):
+    """
+    `foo` -> `*foo*`, queries match anywhere in the name / header
+    """
+    if pattern[0] != '*':
+        pattern = '*' + pattern
+    if pattern[-1] != '*':
+        pattern = pattern + '*'
+    return pattern
+
+def compile_header_glob(pattern):
+    """
+    Case insensitive regex for an fnmatch glob, to be used with `.search`.
+    Leading / trailing `*` become missing anchors instead of `.*`, which
+    saves the regex engine from backtracking over every header.
+    """
+    core = pattern.strip('*')
+    # fnmatch.translate returns `(?s:...)\Z`
+    regex = fnmatch.translate(core)[:-2]
+    if not pattern.startswith('*'):
+        regex = r'\A' + regex
+    if core and not pattern.endswith('*'):
+        regex += r'\Z'
+    return re.compile(regex, re.IGNORECASE)
+
+class TreeQuery:
+    """
+    Compiled `<path glob>:<header glob>` query
+
+    path_regex - None matches every note. Globs without a `/` match the
+        note name in any folder, others the path relative to the vault
+    header_regex - None matches every header
+    rank_regex - literal part of the header query (or of the path query
+        when there is no header query) that matches are ranked on
+    """
+    __slots__ = (
+        'query', 'path_part', 'tree_part', 'path_q', 'tree_q',
+        'path_regex', 'match_name', 'header_regex', 'rank_regex')
+
+    def __init__(self, query):
+        self.query = query
+
+        if ':' not in query:
+            sys.stderr.write("no `:` found in query str, treating as path glob search")
+            path_q, tree_q = query, None
+        else:
+            # Only the first `:` splits, headers may contain more
+            path_q, tree_q = query.split(':', 1)
+        self.path_part = path_q
+        self.tree_part = tree_q or ''
+
+        self.path_q = pad_glob(path_q) if path_q else None
+        self.tree_q = pad_glob(tree_q) if tree_q else None
+
+        self.path_regex = compile_path_glob(self.path_q) if self.path_q else None
+        self.match_name = self.path_q is not None and '/' not in self.path_q
+        self.header_regex = compile_header_glob(self.tree_q) if self.tree_q else None
+
+        ranked_q = self.tree_q or self.path_q
+        needle = ranked_q.strip('*') if ranked_q else None
+        if not needle:
+            self.rank_regex = None
+        elif self.tree_q:
+            # With or without the header's `#`s
+            self.rank_regex = re.compile(r'(?:#*[ \t]*)?' + re.escape(needle), re.IGNORECASE)
+        else:
+            self.rank_regex = re.compile(re.escape(needle), re.IGNORECASE)
+
+    def match_path(self, filename, rel_path):
+        if self.path_regex is None:
+            return True
+        if self.match_name:
+            # Match the name in place instead of slicing it out
+            return self.path_regex.fullmatch(filename, filename.rfind(os.sep) + 1) is not None
+        return self.path_regex.fullmatch(rel_path(filename)) is not None
+
+    def refines(self, other):
+        """
+        True if every match of this query is also a match of `other`, ie
+        this query is `other` typed further. Globs are padded with `*`, so a
+        longer glob can only match where the shorter one already did.
+        """
+        return refines_glob(other.path_part, self.path_part, path=True) and \
+            refines_glob(other.tree_part, self.tree_part)
+
+    def rank(self, filename, header):
+        """
+        0 - exact match, 1 - prefix match, 2 - any other match. Headers are
+        compared with and without their `#`s, note names without `.md`.
+        """
+        if self.rank_regex is None:
+            return 0
+
+        if self.tree_q:
+            match = self.rank_regex.match(header)
+            if match is None:
+                return 2
+            return 1 if header[match.end():].strip() else 0
+
+        match = self.rank_regex.match(filename, filename.rfind(os.sep) + 1)
+        if match is None:
+            return 2
+        return 0 if filename[match.end():].lower() in ('', '.md') else 1
+
+def refines_glob(old, new, path=False):
+    if not old.strip('*'):
+        # Matches everything
+        return True
+    if '[' in old or (path and ('/' in old or '/' in new)):
+        # An unclosed `[` can become a character class, and a `/` switches
+        # path globs from note names to relative paths
+        return old == new
+    return new.startswith(old)
+
+def iter_matches(tree_query, notes, rel_path):
+    """
+    Yields (filename, header) for every match in notes, (filename, [headers])
+    pairs eg `headers_index.items()`, in order. A note without headers is
+    matched as one empty header.
+    """
+    header_search = tree_query.header_regex.search if tree_query.header_regex is not None else None
+    match_path = tree_query.match_path
+
+    for filename, headers in notes:
+        if not match_path(filename, rel_path):
+            continue
+
+        if not headers:
+            if header_search is None or header_search(''):
+                yield filename, ''
+        elif header_search is None:
+            for header in headers:
+                yield filename, header
+        else:
+            for header in headers:
+                if header_search(header):
+                    yield filename, header
+
+def filter_matches(tree_query, matches, rel_path):
+    """
+    Yields the (filename, header) pairs of matches, eg from a query
+    `tree_query` refines, that tree_query also matches
+    """
+    header_search = tree_query.header_regex.search if tree_query.header_regex is not None else None
+    match_path = tree_query.match_path
+
+    last_filename = None
+    for filename, header in matches:
+        # A note's headers are next to each other, check its path once
+        if filename is not last_filename:
+            last_filename = filename
+            path_matched = match_path(filename, rel_path)
+
+        if path_matched and (header_search is None or header_search(header)):
+            yield filename, header
+
+def iter_scan_order(headers_index, mtimes=None):
+    """
+    (filename, [headers]) newest note first, in index order without mtimes
+    """
+    if mtimes is None:
+        return iter(headers_index.items())
+    if hasattr(mtimes, 'newest_first'):
+        # A `compact_index.CompactMtimes`, sorted on its mtime column
+        return mtimes.newest_first()
+    return ((filename, headers_index[filename]) for filename in
+            sorted(headers_index, key=lambda filename: mtimes.get(filename, 0), reverse=True))
+
+class QueryCache:
+    """
+    LRU of query -> its ranked top `limit` matches, for one index
+    generation: entries of an older index are dropped as soon as a new
+    generation is seen. The owner bumps the generation whenever the index
+    changes.
+
+    An entry whose scan ran to the end also keeps every match in scan
+    order, a query refining it is ranked from those. A scan stopped early
+    (or that had to drop matches) only answers the same query again.
+
+    hits - same query again, refined - filtered from a cached query the new
+    one refines, misses - early exit index scan
+    """
+    def __init__(self, max_size=64):
+        self.max_size = max_size
+        self.generation = None
+        self.entries = collections.OrderedDict() # query: (TreeQuery, limit, ranked, every match or None)
+        self.hits = 0
+        self.refined = 0
+        self.misses = 0
+
+    def get_ranked(self, tree_query, generation, limit, search, rel_path):
+        """
+        Best `limit` matches, best first. search() - the query's
+        `rank_matches` result, only called on a miss
+        """
+        if generation != self.generation:
+            # Their match lists would otherwise stay alive until evicted
+            self.entries.clear()
+            self.generation = generation
+
+        key = tree_query.query
+        entry = self.entries.get(key)
+        if entry is not None:
+            _, cached_limit, ranked, matches = entry
+            if matches is not None:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return ranked if limit == cached_limit else rank_matches(tree_query, matches, limit)[0]
+            if limit is not None and cached_limit is not None and limit <= cached_limit:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return ranked[:limit]
+
+        # Smallest complete match list this query can be filtered from
+        base = None
+        for cached_query, _, _, matches in self.entries.values():
+            if matches is not None and tree_query.refines(cached_query) and (base is None or len(matches) < len(base)):
+                base = matches
+
+        if base is not None:
+            self.refined += 1
+            ranked, matches = rank_matches(tree_query, filter_matches(tree_query, base, rel_path), limit)
+        else:
+            self.misses += 1
+            ranked, matches = search()
+
+        self.entries[key] = (tree_query, limit, ranked, matches)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        return ranked
+
+    def stats(self):
+        return {'hits': self.hits, 'refined': self.refined, 'misses': self.misses, 'size': len(self.entries)}
+
+def rank_matches(tree_query, matches, limit=None):
+    """
+    (best `limit` (all if None) of matches best first, every match in order
+    or None if the scan stopped early or dropped any). matches come newest
+    first, so once `limit` exact matches are kept no later match can
+    replace one and the scan stops.
+    """
+    if limit is not None and limit <= 0:
+        return [], None
+
+    rank = tree_query.rank
+    # Path only queries rank on the note name, same for all its headers
+    rank_headers = tree_query.tree_q is not None
+
+    # Matches come newest first, so each rank's list is already in order
+    ranked = ([], [], [])
+    kept = []
+    last_filename = None
+    for filename, header in matches:
+        if rank_headers or filename is not last_filename:
+            match_rank = rank(filename, header)
+            last_filename = filename
+
+        bucket = ranked[match_rank]
+        if limit is None or len(bucket) < limit:
+            bucket.append((filename, header))
+            if kept is not None:
+                kept.append((filename, header))
+            if match_rank == 0 and len(bucket) == limit:
+                # `limit` exact matches, newer than anything left
+                kept = None
+                break
+        else:
+            kept = None
+
+    return list(itertools.islice(itertools.chain(*ranked), limit)), kept
+
+def iter_ranked_matches(
+        tree_query, headers_index, rel_path, limit=None, mtimes=None, cache=None, generation=0, scan_index=None):
+    """
+    Yields the best `limit` (all if None) (filename, header) matches in
+    {filename: [headers]}, best first. mtimes - {filename: mtime}, without
+    it notes keep index order.
+
+    Notes are scanned newest first and the scan stops early, see
+    `rank_matches`, with or without a `QueryCache`. scan_index - optional
+    `ScanIndex` of headers_index and mtimes to search instead.
+    """
+    def search():
+        if scan_index is not None:
+            return scan_index.search(tree_query, limit)
+        return rank_matches(tree_query, iter_matches(tree_query, iter_scan_order(headers_index, mtimes), rel_path), limit)
+
+    if cache is not None:
+        ranked = cache.get_ranked(tree_query, generation, limit, search, rel_path)
+    else:
+        ranked, _ = search()
+    yield from ranked
+
+# Lower cased like re.IGNORECASE compares, without the one character lower()
+# lengthens (`İ`) and with the two re also matches to `i` / `s`
+fold_table = str.maketrans({'\u0130': 'i', '\u0131': 'i', '\u017f': 's'})
+
+def fold(text):
+    return text.translate(fold_table).lower()
+
+# Lower case letters re.IGNORECASE also matches to another lower case letter,
+# eg `σ` and `ς`, see re's `_casefix.py`. `fold` doesn't bring those together.
+ambiguous_case_chars = frozenset(map(chr, [
+    0xb5, 0x345, 0x390, 0x3b0, 0x3b2, 0x3b5, 0x3b8, 0x3b9, 0x3ba, 0x3bc, 0x3c0, 0x3c1, 0x3c2, 0x3c3,
+    0x3c6, 0x3d0, 0x3d1, 0x3d5, 0x3d6, 0x3f0, 0x3f1, 0x3f5, 0x432, 0x434, 0x43e, 0x441, 0x442, 0x44a,
+    0x463, 0x1c80, 0x1c81, 0x1c82, 0x1c83, 0x1c84, 0x1c85, 0x1c86, 0x1c87, 0x1c88, 0x1e61, 0x1e9b,
+    0x1fbe, 0x1fd3, 0x1fe3, 0xa64b, 0xfb05, 0xfb06]))
+
+def literal_runs(pattern, glob=True, path=False):
+    """
+    Runs of characters a glob (or literal text without glob) matches
+    literally, split at `*`, `?` and `[...]` classes
+    (`vault_walk.compile_path_glob` classes with path, fnmatch ones
+    otherwise) and at characters `fold` can't compare
+    """
+    runs = [[]]
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        end = None
+        if not glob:
+            pass
+        elif c == '[':
+            if path:
+                end = pattern.find(']', i + 1)
+            else:
+                # Same bracket rules as fnmatch.translate
+                end = i + 1
+                if pattern[end:end + 1] == '!':
+                    end += 1
+                if pattern[end:end + 1] == ']':
+                    end += 1
+                end = pattern.find(']', end)
+            end = end if end != -1 else None
+
+        if (glob and c in '*?') or c == '\n' or end is not None or fold(c) in ambiguous_case_chars:
+            runs.append([])
+            i = end + 1 if end is not None else i + 1
+        else:
+            runs[-1].append(c)
+            i += 1
+    return [''.join(run) for run in runs if run]
+
+def longest_run(pattern, glob=True, path=False):
+    """
+    Folded text every match of the glob contains, '' if none
+    """
+    return fold(max(literal_runs(pattern, glob=glob, path=path), key=len, default=''))
+
+def is_foldable(text):
+    return not any(fold(c) in ambiguous_case_chars for c in text)
+
+def header_key(header):
+    """
+    A header as its exact / prefix rank compares it, without the `#`s and
+    spaces in front and trailing white space
+    """
+    return header.lstrip('# \t').rstrip()
+
+class LineText:
+    """
+    Lines joined into one folded text to `str.find` in, with each line's
+    offset to tell which line a match is in
+    """
+    __slots__ = ('text', 'starts')
+
+    def __init__(self, lines):
+        # Between new lines, so a line can be matched whole or by its start
+        self.text = '\n' + fold('\n'.join(lines)) + '\n'
+        # Offset of each line, then the end of the text
+        self.starts = array.array('q', itertools.accumulate((len(line) + 1 for line in lines), initial=1))
+
+    def is_aligned(self):
+        return len(self.text) == self.starts[-1]
+
+    def iter_lines(self, needle):
+        """
+        Ids of the lines containing folded needle in order, needle starts
+        with `\\n` to match line starts, also ends with one for whole lines
+        """
+        text, starts = self.text, self.starts
+        anchor = 1 if needle.startswith('\n') else 0
+        line_count = len(starts) - 1
+        pos = starts[0] - anchor
+        while True:
+            pos = text.find(needle, pos)
+            if pos == -1:
+                return
+            line = bisect.bisect_right(starts, pos + anchor) - 1
+            if line >= line_count:
+                return
+            yield line
+            # Each line once, however often it contains needle
+            pos = starts[line + 1] - anchor
+
+def iter_ascending(ids):
+    """
+    ids in order, sorting only as far as they're consumed
+    """
+    heap = list(ids)
+    heapq.heapify(heap)
+    while heap:
+        yield heapq.heappop(heap)
+
+def group_lines(keys):
+    """
+    {key: [ids of its lines in order]}
+    """
+    lines = {}
+    for line, key in enumerate(keys):
+        lines.setdefault(key, []).append(line)
+    return lines
+
+class ScanIndex:
+    """
+    {filename: [headers]} flattened in scan order (newest note first) for
+    searches that touch a few hundred notes rather than all of them: header
+    lines, note names and relative paths are each joined into one folded
+    text, so finding the lines a query can match is a C level `str.find`
+    over the whole vault. Only those lines are then checked against the
+    query's regexes, see `search`. Rebuilt when the index changes, eg by
+    the daemon per index generation.
+    """
+    # Path queries matching notes with fewer headers than this scan them directly
+    narrow_path_lines = 4_000
+
+    def __init__(self, headers_index, rel_path, mtimes=None):
+        self.rel_path = rel_path
+        self.filenames = []
+        self.headers = [] # line id: header, '' for a note without headers
+        self.line_notes = array.array('i') # line id: note id
+        self.note_lines = array.array('i') # note id: first line id, then the line count
+
+        for note_id, (filename, headers) in enumerate(iter_scan_order(headers_index, mtimes)):
+            headers = list(headers) or ['']
+            self.filenames.append(filename)
+            self.note_lines.append(len(self.headers))
+            self.headers.extend(headers)
+            self.line_notes.extend(itertools.repeat(note_id, len(headers)))
+        self.note_lines.append(len(self.headers))
+
+        self.header_text = LineText(self.headers)
+        self.name_text = LineText([os.path.basename(filename) for filename in self.filenames])
+
+        # Exact and prefix ranked lines are looked up rather than searched for,
+        # a `str.find` that matches nothing reads the whole text
+        keys = [fold(header_key(header)) for header in self.headers]
+        self.key_lines = group_lines(keys)
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        self.sorted_keys = [keys[line] for line in order]
+        self.sorted_key_lines = array.array('i', order)
+        names = [fold(os.path.basename(filename)) for filename in self.filenames]
+        # Names with and without `.md`, both rank exact
+        self.name_notes = group_lines(names)
+        for note_id, name in enumerate(names):
+            if name.endswith('.md'):
+                self.name_notes.setdefault(name[:-3], []).append(note_id)
+        for note_ids in self.name_notes.values():
+            note_ids.sort()
+        # Built on the first query with a `/`
+        self.path_text = None
+
+        # Folding keeps every line its length, or the offsets would be off
+        self.usable = all(
+            line_text.is_aligned() for line_text in (self.header_text, self.name_text))
+
+    def get_path_text(self):
+        if self.path_text is None:
+            self.path_text = LineText([self.rel_path(filename) for filename in self.filenames])
+        return self.path_text
+
+    def note_headers(self, note_id):
+        return self.headers[self.note_lines[note_id]:self.note_lines[note_id + 1]]
+
+    def iter_path_candidates(self, tree_query):
+        """
+        Ids of the notes whose name / relative path can match the path glob
+        """
+        needle = longest_run(tree_query.path_q, path=True)
+        line_text = self.name_text if tree_query.match_name else self.get_path_text()
+        if not line_text.is_aligned():
+            return iter(range(len(self.filenames)))
+        return line_text.iter_lines(needle)
+
+    def match_narrow_path(self, tree_query):
+        """
+        Ids of the notes matching the path glob in order, None once they
+        have more than `narrow_path_lines` headers
+        """
+        match_path, filenames, note_lines = tree_query.match_path, self.filenames, self.note_lines
+        note_ids = []
+        lines = 0
+        for note_id in self.iter_path_candidates(tree_query):
+            if match_path(filenames[note_id], self.rel_path):
+                note_ids.append(note_id)
+                lines += note_lines[note_id + 1] - note_lines[note_id]
+                if lines > self.narrow_path_lines:
+                    return None
+        return note_ids
+
+    def search(self, tree_query, limit=None):
+        """
+        Same result as `rank_matches` over the whole index
+        """
+        if limit is not None and limit <= 0:
+            return [], None
+        if not self.usable:
+            notes = zip(self.filenames, map(self.note_headers, range(len(self.filenames))))
+            return rank_matches(tree_query, iter_matches(tree_query, notes, self.rel_path), limit)
+
+        if tree_query.path_regex is not None and tree_query.tree_q is not None:
+            note_ids = self.match_narrow_path(tree_query)
+            if note_ids is not None:
+                notes = ((self.filenames[note_id], self.note_headers(note_id)) for note_id in note_ids)
+                return rank_matches(tree_query, iter_matches(tree_query, notes, self.rel_path), limit)
+
+        if tree_query.tree_q is not None:
+            return self.search_headers(tree_query, limit)
+        return self.search_notes(tree_query, limit)
+
+    def get_path_check(self, tree_query):
+        """
+        note id -> whether its path matches, None without a path glob
+        """
+        if tree_query.path_regex is None:
+            return None
+        match_path, filenames, rel_path = tree_query.match_path, self.filenames, self.rel_path
+        matched = {}
+
+        def check(note_id):
+            ok = matched.get(note_id)
+            if ok is None:
+                ok = matched[note_id] = match_path(filenames[note_id], rel_path)
+            return ok
+        return check
+
+    def collect(self, passes, limit, expand):
+        """
+        Runs (candidate ids, accept(id)) passes in rank order until `limit`
+        lines are kept. expand(id) - its line ids. Returns the
+        `rank_matches` result.
+        """
+        kept = []
+        complete = True
+        for candidates, accept in passes:
+            for candidate in candidates:
+                if accept(candidate):
+                    kept.extend(expand(candidate))
+                    if limit is not None and len(kept) >= limit:
+                        break
+            else:
+                continue
+            complete = False
+            break
+
+        filenames, headers, line_notes = self.filenames, self.headers, self.line_notes
+        ranked = [(filenames[line_notes[line]], headers[line]) for line in kept[:limit]]
+        if not complete or (limit is not None and len(kept) > limit):
+            return ranked, None
+        return ranked, [(filenames[line_notes[line]], headers[line]) for line in sorted(kept)]
+
+    def search_headers(self, tree_query, limit):
+        filenames, headers, line_notes = self.filenames, self.headers, self.line_notes
+        header_search = tree_query.header_regex.search
+        rank = tree_query.rank
+        path_check = self.get_path_check(tree_query)
+
+        def accepts(want_rank):
+            def accept(line):
+                note_id = line_notes[line]
+                header = headers[line]
+                return (path_check is None or path_check(note_id)) and header_search(header) is not None \
+                    and rank(filenames[note_id], header) == want_rank
+            return accept
+
+        glob_lines = self.header_text.iter_lines(longest_run(tree_query.tree_q))
+        if tree_query.rank_regex is None:
+            passes = [(glob_lines, accepts(0))]
+        else:
+            needle = tree_query.tree_q.strip('*')
+            if not is_foldable(needle):
+                # Lines containing part of it
+                run = longest_run(needle, glob=False)
+                exact_lines, prefix_lines = self.header_text.iter_lines(run), self.header_text.iter_lines(run)
+            else:
+                key = fold(header_key(needle))
+                exact_lines = self.key_lines.get(key, ())
+                start = bisect.bisect_left(self.sorted_keys, key)
+                end = bisect.bisect_left(self.sorted_keys, key + '\U0010ffff', start)
+                prefix_lines = iter_ascending(self.sorted_key_lines[start:end])
+            passes = [(exact_lines, accepts(0)), (prefix_lines, accepts(1)), (glob_lines, accepts(2))]
+
+        return self.collect(passes, limit, lambda line: (line,))
+
+    def search_notes(self, tree_query, limit):
+        """
+        Path only queries, each matching note gives all its headers
+        """
+        note_lines = self.note_lines
+        expand = lambda note_id: range(note_lines[note_id], note_lines[note_id + 1])
+
+        if tree_query.path_regex is None:
+            return self.collect([(range(len(self.filenames)), lambda note_id: True)], limit, expand)
+
+        filenames = self.filenames
+        path_check = self.get_path_check(tree_query)
+        rank = tree_query.rank
+
+        def accepts(want_rank):
+            return lambda note_id: path_check(note_id) and rank(filenames[note_id], '') == want_rank
+
+        path_notes = self.iter_path_candidates(tree_query)
+        if tree_query.rank_regex is None:
+            passes = [(path_notes, accepts(0))]
+        else:
+            needle = tree_query.path_q.strip('*')
+            if not is_foldable(needle):
+                exact_notes = prefix_notes = list(self.name_text.iter_lines(longest_run(needle, glob=False)))
+            else:
+                exact_notes = self.name_notes.get(fold(needle), ())
+                prefix_notes = self.name_text.iter_lines(f'\n{fold(needle)}')
+            passes = [(exact_notes, accepts(0)), (prefix_notes, accepts(1)), (path_notes, accepts(2))]
+
+        return self.collect(passes, limit, expand)
@@ -0,0 +1,395 @@
+"""
+Trigram index over note names and headers, for fuzzy `ns` searches that
+still find `datetmie` or `pyhton:datetime`.
+
+Text is split into words and each word padded as ` word ` before taking
+its 3 character grams, like postgres' pg_trgm without its low selectivity
+`  w` grams. A document scores the share
+of the query's trigrams it contains, so a query typed as a substring of a
+long header still scores high. Only documents that can reach the threshold
+are scored: one with at least `need` of the query's `n` trigrams must be in
+one of the `n - need + 1` rarest trigram posting sets, so candidates are
+collected from those alone.
+"""
+import os
+import re
+import sys
+import math
+import heapq
+import json
+import array
+import collections
+
+from scripts.tree_query import TreeQuery
+from scripts.vault_index import get_cache_dir
+
+regex_word = re.compile(r'\w+')
+
+# Bump when the saved layout changes, older caches are rebuilt from scratch
+INDEX_VERSION = 2
+
+# A json header line then raw id arrays, never pickle: the cache dir sits in
+# the vault, which may be synced from other machines
+index_file_name = 'trigram_index.bin'
+
+# Share of the query's trigrams a note name / header must contain
+default_threshold = 0.3
+
+# Vaults reuse a small vocabulary, cache each word's trigrams
+word_trigrams = {}
+word_trigrams_max_size = 200_000
+
+def get_word_trigrams(word):
+    grams = word_trigrams.get(word)
+    if grams is None:
+        padded = f' {word} '
+        grams = frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+        if len(word_trigrams) < word_trigrams_max_size:
+            word_trigrams[word] = grams
+    return grams
+
+def get_trigrams(text):
+    words = regex_word.findall(text.lower())
+    if len(words) == 1:
+        return get_word_trigrams(words[0])
+    return frozenset().union(*map(get_word_trigrams, words))
+
+def note_name(filename):
+    name = os.path.basename(filename)
+    return name[:-3] if name.endswith('.md') else name
+
+def add_postings(postings, doc_id, grams):
+    for gram in grams:
+        docs = postings.get(gram)
+        if docs is None:
+            postings[gram] = docs = set()
+        docs.add(doc_id)
+
+def remove_postings(postings, doc_id, grams):
+    for gram in grams:
+        docs = postings[gram]
+        docs.discard(doc_id)
+        if not docs:
+            del postings[gram]
+
+def match_postings(postings, query_grams, threshold, allowed=None, limit=None):
+    """
+    {doc id: share of query_grams it contains} for documents with at least
+    `threshold` of them, limited to `allowed` doc ids if given.
+
+    With `limit`, stops at the highest share that at least `limit`
+    documents reach, every document at or above it is returned
+    """
+    n = len(query_grams)
+    if not n:
+        return {}
+    need = max(1, math.ceil(threshold * n))
+
+    doc_sets = sorted((postings.get(gram, frozenset()) for gram in query_grams), key=len)
+
+    # Docs with `n - i` hits or more are all in the `i + 1` rarest sets, so
+    # widen the candidates one set at a time from full matches down to `need`
+    hits = collections.Counter()
+    candidates = set()
+    for i in range(n - need + 1):
+        new_candidates = doc_sets[i] - candidates
+        if allowed is not None:
+            new_candidates &= allowed
+        candidates |= new_candidates
+
+        # Set intersections and Counter.update run in C, no per doc python loop
+        for doc_set in doc_sets:
+            hits.update(new_candidates & doc_set)
+
+        if limit is not None and i < n - need:
+            at_least = n - i
+            if sum(1 for count in hits.values() if count >= at_least) >= limit:
+                return dict((doc_id, count / n) for doc_id, count in hits.items() if count >= at_least)
+
+    return dict((doc_id, count / n) for doc_id, count in hits.items() if count >= need)
+
+class PackedPostings(dict):
+    """
+    {trigram: {ids}} as saved by `TrigramIndex`, each set is kept as the bytes
+    of an id array until first used so loading doesn't build every set
+    """
+    def __getitem__(self, gram):
+        docs = dict.__getitem__(self, gram)
+        if isinstance(docs, bytes):
+            ids = array.array('i')
+            ids.frombytes(docs)
+            docs = set(ids)
+            dict.__setitem__(self, gram, docs)
+        return docs
+
+    def get(self, gram, default=None):
+        return self[gram] if gram in self else default
+
+def pack_postings(postings):
+    """
+    ([trigrams], offsets, ids) with the ids of trigram i at ids[offsets[i]:offsets[i + 1]]
+    """
+    grams = list(postings)
+    offsets = array.array('i', [0])
+    ids = array.array('i')
+    for gram in grams:
+        docs = dict.__getitem__(postings, gram)
+        if isinstance(docs, bytes):
+            ids.frombytes(docs)
+        else:
+            ids.extend(docs)
+        offsets.append(len(ids))
+    return grams, offsets, ids
+
+def unpack_postings(grams, offsets, ids):
+    blob = ids.tobytes()
+    size = ids.itemsize
+    return PackedPostings(
+        (gram, blob[offsets[i] * size:offsets[i + 1] * size]) for i, gram in enumerate(grams))
+
+class TrigramIndex:
+    """
+    Kept up to date with a {filename: [headers]} header index by `update`,
+    which only re-indexes notes whose header list changed. Saved compactly,
+    see `save_index`.
+    """
+    def __init__(self):
+        self.notes = {} # filename: (note id, first header id, header count)
+        self.note_names = [] # note id: filename, None once removed
+        self.name_postings = {} # trigram: {note ids}
+        self.header_texts = [] # header id: header, None once removed
+        self.header_notes = array.array('i') # header id: note id
+        self.header_postings = {} # trigram: {header ids}
+        # Text lengths by id, shorter texts win ties
+        self.name_lengths = array.array('i')
+        self.header_lengths = array.array('i')
+
+    @classmethod
+    def from_headers_index(cls, headers_index):
+        index = cls()
+        index.update(headers_index)
+        return index
+
+    def needs_rebuild(self):
+        """
+        Removed notes leave their ids behind, start over once they outnumber the live ones
+        """
+        return len(self.note_names) - len(self.notes) > max(len(self.notes), 1000)
+
+    def get_headers(self, filename):
+        _, first, count = self.notes[filename]
+        return self.header_texts[first:first + count]
+
+    def get_header_doc(self, header_id):
+        """
+        (filename, header) of a header id
+        """
+        return self.note_names[self.header_notes[header_id]], self.header_texts[header_id]
+
+    def add_note(self, filename, headers):
+        note_id = len(self.note_names)
+        self.note_names.append(filename)
+        self.name_lengths.append(len(filename))
+        add_postings(self.name_postings, note_id, get_trigrams(note_name(filename)))
+
+        first = len(self.header_texts)
+        for header_id, header in enumerate(headers, first):
+            self.header_texts.append(header)
+            self.header_notes.append(note_id)
+            self.header_lengths.append(len(header))
+            add_postings(self.header_postings, header_id, get_trigrams(header))
+
+        self.notes[filename] = (note_id, first, len(headers))
+
+    def remove_note(self, filename):
+        headers = self.get_headers(filename)
+        note_id, first, _ = self.notes.pop(filename)
+        self.note_names[note_id] = None
+        remove_postings(self.name_postings, note_id, get_trigrams(note_name(filename)))
+
+        for header_id, header in enumerate(headers, first):
+            self.header_texts[header_id] = None
+            remove_postings(self.header_postings, header_id, get_trigrams(header))
+
+    def update(self, headers_index):
+        """
+        Returns how many notes were (re)indexed or removed
+        """
+        changed = 0
+        for filename in [filename for filename in self.notes if filename not in headers_index]:
+            self.remove_note(filename)
+            changed += 1
+
+        for filename, headers in headers_index.items():
+            entry = self.notes.get(filename)
+            if entry is not None and self.get_headers(filename) == headers:
+                continue
+            if entry is not None:
+                self.remove_note(filename)
+            self.add_note(filename, headers)
+            changed += 1
+        return changed
+
+    def search(self, query, limit=20, threshold=default_threshold, mtimes=None):
+        """
+        Best `limit` (filename, header) fuzzy matches for a `path:header`
+        query, best first. Ties go to the shorter text, then the newer note.
+        A path only query yields every header of the matching notes.
+        """
+        tree_query = TreeQuery(query)
+        path_grams = get_trigrams(tree_query.path_part.replace('*', ' '))
+        header_grams = get_trigrams(tree_query.tree_part.replace('*', ' '))
+        mtimes = mtimes or {}
+
+        note_scores = None
+        if path_grams:
+            # Every matching note is needed to filter headers on
+            note_scores = match_postings(
+                self.name_postings, path_grams, threshold, limit=None if header_grams else limit)
+
+        if not header_grams:
+            if note_scores is None:
+                return []
+
+            note_ids = top_ids(note_scores, limit, self.name_lengths.__getitem__)
+            note_ids.sort(key=lambda note_id: (
+                -note_scores[note_id], self.name_lengths[note_id], -mtimes.get(self.note_names[note_id], 0)))
+
+            out = []
+            for note_id in note_ids:
+                filename = self.note_names[note_id]
+                out.extend((filename, header) for header in (self.get_headers(filename) or ['']))
+                if len(out) >= limit:
+                    break
+            return out[:limit]
+
+        allowed = None
+        if note_scores is not None:
+            allowed = set()
+            for note_id in note_scores:
+                _, first, count = self.notes[self.note_names[note_id]]
+                allowed.update(range(first, first + count))
+
+        header_scores = match_postings(self.header_postings, header_grams, threshold, allowed=allowed, limit=limit)
+
+        def note_score(header_id):
+            if note_scores is None:
+                return 0
+            return note_scores[self.header_notes[header_id]]
+
+        if note_scores is None:
+            tie_key = self.header_lengths.__getitem__
+        else:
+            tie_key = lambda header_id: (-note_score(header_id), self.header_lengths[header_id])
+
+        header_ids = top_ids(header_scores, limit, tie_key)
+        header_ids.sort(key=lambda header_id: (
+            -header_scores[header_id], -note_score(header_id), self.header_lengths[header_id],
+            -mtimes.get(self.note_names[self.header_notes[header_id]], 0)))
+        return [self.get_header_doc(header_id) for header_id in header_ids]
+
+def top_ids(scores, limit, tie_key):
+    """
+    Ids of the `limit` best {id: score}, ties on the lowest score kept broken
+    by `tie_key`. Scores are a handful of distinct values shared by many
+    ids, so only the ids tied at the cut off need a python sort key.
+    """
+    if len(scores) <= limit:
+        return list(scores)
+
+    cutoff = heapq.nlargest(limit, scores.values())[-1]
+    above = [doc_id for doc_id, score in scores.items() if score > cutoff]
+    tied = [doc_id for doc_id, score in scores.items() if score == cutoff]
+    return above + heapq.nsmallest(limit - len(above), tied, key=tie_key)
+
+def get_index_path(vault_path):
+    return os.path.join(get_cache_dir(vault_path), index_file_name)
+
+def load_index(vault_path):
+    """
+    The saved index, None when missing, unreadable, or out of date
+    """
+    index_path = get_index_path(vault_path)
+    if not os.path.exists(index_path):
+        return None
+
+    try:
+        with open(index_path, 'rb') as f:
+            header = json.loads(f.readline())
+            if (header.get('version') != INDEX_VERSION or header['byteorder'] != sys.byteorder
+                    or header['itemsize'] != array.array('i').itemsize):
+                return None
+
+            arrays = {}
+            for name, length in header['arrays']:
+                arrays[name] = array.array('i')
+                arrays[name].fromfile(f, length)
+    except Exception as e:
+        sys.stderr.write(f"Warning - could not read trigram index {index_path}, rebuilding: {e}")
+        return None
+
+    index = TrigramIndex()
+    index.note_names = header['note_names']
+    index.header_texts = header['header_texts']
+    index.header_notes = arrays['header_notes']
+    index.name_lengths = arrays['name_lengths']
+    index.header_lengths = arrays['header_lengths']
+    index.notes = dict(
+        (filename, (note_id, arrays['note_firsts'][note_id], arrays['note_counts'][note_id]))
+        for note_id, filename in enumerate(index.note_names) if filename is not None)
+    index.name_postings = unpack_postings(header['name_grams'], arrays['name_offsets'], arrays['name_ids'])
+    index.header_postings = unpack_postings(header['header_grams'], arrays['header_offsets'], arrays['header_ids'])
+    return index
+
+def save_index(vault_path, index):
+    """
+    A json line with the texts and array lengths, then the arrays' raw bytes.
+    Temp file then rename, like `vault_index.write_json_atomic`
+    """
+    index_path = get_index_path(vault_path)
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+
+    note_firsts = array.array('i', [0]) * len(index.note_names)
+    note_counts = array.array('i', [0]) * len(index.note_names)
+    for note_id, first, count in index.notes.values():
+        note_firsts[note_id] = first
+        note_counts[note_id] = count
+    name_grams, name_offsets, name_ids = pack_postings(index.name_postings)
+    header_grams, header_offsets, header_ids = pack_postings(index.header_postings)
+
+    arrays = [
+        ('header_notes', index.header_notes), ('name_lengths', index.name_lengths),
+        ('header_lengths', index.header_lengths), ('note_firsts', note_firsts), ('note_counts', note_counts),
+        ('name_offsets', name_offsets), ('name_ids', name_ids),
+        ('header_offsets', header_offsets), ('header_ids', header_ids),
+    ]
+    header = {
+        'version': INDEX_VERSION, 'byteorder': sys.byteorder, 'itemsize': array.array('i').itemsize,
+        'note_names': index.note_names, 'header_texts': index.header_texts,
+        'name_grams': name_grams, 'header_grams': header_grams,
+        'arrays': [(name, len(values)) for name, values in arrays],
+    }
+
+    tmp_path = f'{index_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(json.dumps(header).encode('utf-8') + b'\n')
+        for _, values in arrays:
+            values.tofile(f)
+    os.replace(tmp_path, index_path)
+
+def get_cached_index(vault_path, headers_index):
+    """
+    Index of headers_index for processes without the daemon: the one saved in
+    the cache dir brought up to date, re-indexing only the notes that changed
+    since, instead of building it on every search
+    """
+    index = load_index(vault_path)
+    if index is None or index.needs_rebuild():
+        index = TrigramIndex()
+
+    if index.update(headers_index):
+        try:
+            save_index(vault_path, index)
+        except OSError as e:
+            sys.stderr.write(f"Warning - could not save trigram index: {e}")
+    return index
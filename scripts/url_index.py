@@ -0,0 +1,255 @@
+"""
+Vault wide index of the links in notes, normalized url -> (note, line) of
+every occurrence. Bookmark captures look the url up before appending it
+(see `dedupe_entries`) and "search current browser tab in your notes"
+queries it instead of `mdfind`.
+
+Kept in a sqlite file in the cache dir next to the full text index, so a
+lookup is one primary key read instead of loading every link. Notes are
+re-read when their mtime/size/inode fingerprint changes, like
+`fulltext_index`.
+"""
+import os
+import re
+import sys
+import json
+import sqlite3
+
+from scripts.vault_index import get_cache_dir, file_fingerprint, make_rel_path
+from scripts.vault_walk import walk_vault
+
+index_file_name = 'url_index.sqlite'
+
+# Markdown links, autolinks and bare urls. Parentheses end a url, the
+# closing one of `[title](url)` would be taken for part of it otherwise.
+regex_url = re.compile(r'https?://[^\s<>()\[\]"\'`]+', re.IGNORECASE)
+regex_url_parts = re.compile(r'^(?:https?://)([^/?#]*)([^?#]*)(?:\?([^#]*))?', re.IGNORECASE)
+
+# Query parameters that don't change the page, dropped when normalizing
+tracking_params = ('utm_', 'fbclid', 'gclid', 'mc_cid', 'mc_eid', 'ref_src')
+
+duplicate_modes = ('skip', 'annotate', 'link')
+
+schema = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    fp TEXT NOT NULL,
+    mtime INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS links (
+    url TEXT NOT NULL,
+    file_id INTEGER NOT NULL,
+    line INTEGER NOT NULL,
+    PRIMARY KEY (url, file_id, line)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS links_file ON links (file_id);
+"""
+
+def find_urls(text):
+    # Sentence punctuation right after a bare url isn't part of it
+    return [url.rstrip('.,;:!?') for url in regex_url.findall(text)]
+
+def normalize_url(url):
+    """
+    Key for urls pointing to the same page: no scheme, `www.`, default port,
+    fragment, trailing slash or tracking parameters, lower case host
+
+    >>> normalize_url('HTTPS://www.Example.com/Path/?utm_source=x&id=1#top')
+    'example.com/Path?id=1'
+    """
+    match = regex_url_parts.match(url)
+    if match is None:
+        return url
+    host, path, query = match.groups()
+
+    host = host.lower()
+    if host.startswith('www.'):
+        host = host[len('www.'):]
+    if host.endswith(':80') or host.endswith(':443'):
+        host = host.rsplit(':', 1)[0]
+
+    params = [param for param in (query or '').split('&') if param and not param.lower().startswith(tracking_params)]
+    path = path.rstrip('/')
+    return host + path + ('?' + '&'.join(params) if params else '')
+
+def get_links(content):
+    """
+    Returns [(normalized url, line number)] for a note, once per line
+    """
+    links = []
+    for line_num, line in enumerate(content.split('\n')):
+        if '://' not in line:
+            continue
+        for url in set(normalize_url(url) for url in find_urls(line)):
+            links.append((url, line_num))
+    return links
+
+def open_index(vault_path, check_same_thread=True):
+    """
+    check_same_thread=False lets other threads use the connection, the
+    caller has to serialize them
+    """
+    cache_dir = get_cache_dir(vault_path)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    conn = sqlite3.connect(os.path.join(cache_dir, index_file_name), check_same_thread=check_same_thread)
+    # The index can always be rebuilt from the notes, trade durability for speed
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(schema)
+    return conn
+
+def update_index(conn, vault_path, notes, removed=None):
+    """
+    Re-index notes, (filename, stat_result) pairs, whose fingerprint changed
+    and drop notes no longer listed. Returns the number of notes (re)indexed
+    or removed.
+
+    removed - when given, `notes` are only the notes that changed (eg from
+        `vault_watch`) and just these filenames are dropped
+    """
+    rel_path = make_rel_path(vault_path)
+    known = dict((path, (file_id, fp)) for file_id, path, fp in conn.execute('SELECT id, path, fp FROM files'))
+
+    changed_files = [] # (file_id or None, rel path, fingerprint, mtime, filename)
+    seen = set()
+    for filename, stat_result in notes:
+        key = rel_path(filename)
+        seen.add(key)
+        fp = json.dumps(file_fingerprint(stat_result))
+
+        file_id, known_fp = known.get(key, (None, None))
+        if known_fp != fp:
+            changed_files.append((file_id, key, fp, stat_result.st_mtime_ns, filename))
+
+    if removed is None:
+        removed_ids = [file_id for key, (file_id, _) in known.items() if key not in seen]
+    else:
+        removed_keys = set(rel_path(filename) for filename in removed) - seen
+        removed_ids = [known[key][0] for key in removed_keys if key in known]
+
+    with conn:
+        conn.executemany('DELETE FROM links WHERE file_id = ?', ((file_id,) for file_id in removed_ids))
+        conn.executemany('DELETE FROM files WHERE id = ?', ((file_id,) for file_id in removed_ids))
+
+        link_rows = []
+        for file_id, key, fp, mtime, filename in changed_files:
+            try:
+                # A stray invalid byte shouldn't drop the note's links
+                with open(filename, 'r', encoding='utf-8', errors='replace') as f:
+                    links = get_links(f.read())
+            except OSError as e:
+                # Its old links are gone either way, the fingerprint keeps it
+                # from being retried until it changes again
+                sys.stderr.write(f"Warning - could not read {filename} for the url index: {e}")
+                links = []
+
+            if file_id is None:
+                file_id = conn.execute(
+                    'INSERT INTO files (path, fp, mtime) VALUES (?, ?, ?)', (key, fp, mtime)).lastrowid
+            else:
+                conn.execute('DELETE FROM links WHERE file_id = ?', (file_id,))
+                conn.execute('UPDATE files SET fp = ?, mtime = ? WHERE id = ?', (fp, mtime, file_id))
+            link_rows.extend((url, file_id, line_num) for url, line_num in links)
+
+        link_rows.sort()
+        conn.executemany('INSERT OR IGNORE INTO links (url, file_id, line) VALUES (?, ?, ?)', link_rows)
+
+    return len(changed_files) + len(removed_ids)
+
+def lookup(conn, vault_path, url):
+    """
+    Every occurrence of url (any form normalizing to the same key), oldest
+    note first: [{'path', 'rel_path', 'line_num'}, ...]
+    """
+    rows = conn.execute(
+        '''SELECT f.path, l.line FROM links l JOIN files f ON f.id = l.file_id
+        WHERE l.url = ? ORDER BY f.mtime, f.path, l.line''', (normalize_url(url),))
+    return [{'path': os.path.join(vault_path, path), 'rel_path': path, 'line_num': line_num}
+            for path, line_num in rows]
+
+def lookup_vault(vault_path, url):
+    """
+    Bring the index up to date with the vault then look url up
+    """
+    conn = open_index(vault_path)
+    try:
+        update_index(conn, vault_path, walk_vault(vault_path))
+        return lookup(conn, vault_path, url)
+    finally:
+        conn.close()
+
+def get_duplicate_mode(value):
+    """
+    What a capture does with a url already in the vault, from the
+    `duplicate_urls` workflow variable. None (empty or `0`) appends it as is.
+    """
+    mode = (value or '').strip().lower()
+    if mode in ('', '0'):
+        return None
+    if mode not in duplicate_modes:
+        raise ValueError(f"`duplicate_urls` must be one of {', '.join(duplicate_modes)} or 0, not `{mode}`")
+    return mode
+
+def get_note_link(rel_path):
+    """
+    Obsidian wiki link to a note
+    """
+    if rel_path.endswith('.md'):
+        rel_path = rel_path[:-len('.md')]
+    return f'[[{rel_path}]]'
+
+def dedupe_entries(entries, mode, find):
+    """
+    (header, text) capture entries with urls already in the vault handled
+    per mode:
+    skip - the entry is dropped
+    annotate - ` (saved N times before)` is added
+    link - a link to the oldest note with the url is added
+
+    find - url -> occurrences, eg `lookup` with an open index. Urls repeated
+        within entries count as saved by the earlier entry.
+    """
+    out = []
+    captured = {} # normalized url: entries with it so far
+    for header, text in entries:
+        urls = sorted(set(normalize_url(url) for url in find_urls(text)))
+        occurrences = [occurrence for url in urls for occurrence in find(url)]
+        repeats = sum(captured.get(url, 0) for url in urls)
+        for url in urls:
+            captured[url] = captured.get(url, 0) + 1
+
+        if occurrences or repeats:
+            if mode == 'skip':
+                continue
+            if mode == 'annotate':
+                count = len(occurrences) + repeats
+                text = f"{text} (saved {count} {'time' if count == 1 else 'times'} before)"
+            elif occurrences:
+                text = f"{text} (first saved in {get_note_link(occurrences[0]['rel_path'])})"
+        out.append((header, text))
+    return out
+
+#### Run
+
+if __name__ == '__main__':
+    # `python -m scripts.url_index <url>` - Alfred script filter output, notes
+    # linking the url. Same items as the `mdfind` filter it replaces,
+    # including its `$$Append$$` item when no note has it.
+    from scripts.utils import create_obsidian_url
+    from scripts import client
+
+    vault_path = os.path.expanduser(os.environ['config_obsidian_vault'])
+    url = " ".join(sys.argv[1:])
+
+    items = [{
+        'title': occurrence['rel_path'],
+        'subtitle': f"line {occurrence['line_num'] + 1}",
+        # Advanced URI lines are 1 based
+        'arg': create_obsidian_url(vault_path, occurrence['rel_path'], line_num=occurrence['line_num'] + 1),
+    } for occurrence in client.find_url(vault_path, url)]
+
+    if not items:
+        items.append({'title': 'Append to Bookmarks', 'arg': f'$$Append$${url}'})
+    sys.stdout.write(json.dumps({'items': items}))
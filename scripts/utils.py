@@ -1,13 +1,22 @@
 import os
 import datetime
-from typing import Optional
 import json
-import re
 import sys
-import glob
-import fnmatch
-import subprocess
-from urllib.parse import quote
+import time
+import zlib
+import mmap
+import fcntl
+import contextlib
+
+from scripts.note_parser import get_headers, parse_document
+from scripts.vault_index import \
+    get_cached_index, get_headers_by_path, get_mtimes_by_path, parse_notes_parallel, \
+    get_cache_dir, file_fingerprint, make_rel_path, write_json_atomic
+from scripts.vault_walk import walk_vault
+from scripts import note_snapshot, tracing
+
+# Every capture is a fresh interpreter, search only modules (`tree_query`,
+# `trigram_index`, `urllib.parse`) are imported by the functions using them
 
 ## Default values
 default_daily_template = """
@@ -22,9 +31,19 @@ default_daily_template = """
 ## Other
 """
 
+# Fuzzy `ns` results shown when no limit is given
+fuzzy_limit = 50
+
+daily_config_file_name = 'daily_config.json'
+# A file modified this recently may be modified again within the same mtime
+# tick, its mtime can't tell the two versions apart yet
+daily_config_racy_ns = 2_000_000_000
+# vault_path: snapshot, see `get_daily_config`
+daily_config_cache = {}
+
 ## Methods
 
-def get_daily_note_path(vault_path, note_date: Optional[datetime.datetime]=None):
+def get_daily_note_path(vault_path, note_date: datetime.datetime=None):
 
     if note_date is None:
         note_date = datetime.datetime.now()
@@ -47,36 +66,153 @@ def write_to_path(note_path, content):
         f_daily.writelines(content)
         f_daily.close()
 
-def create_daily_note(vault_path, note_date: Optional[datetime.datetime]=None):
+def create_daily_note(
+        vault_path, note_date: datetime.datetime=None, template_text=None, carry_over=None, find_open_tasks=None):
+    """
+    template_text skips the template lookup
+
+    carry_over - copy open tasks of earlier daily notes under `## Todo`,
+        defaults to the `carry_over_todos` workflow variable, see `task_index`
+    find_open_tasks - (since, before) -> open tasks, defaults to
+        `task_index.get_carry_over_vault`
+    """
 
     if note_date is None:
         note_date = datetime.datetime.now()
+    if carry_over is None:
+        carry_over = os.environ.get('carry_over_todos', '0') != '0'
 
-    daily_path = get_daily_note_path(vault_path, note_date=note_date)
+    with tracing.traced('create_daily_note') as trace:
+        daily_path = get_daily_note_path(vault_path, note_date=note_date)
 
-    if not os.path.exists(daily_path):
-        template_location = get_daily_template(vault_path)
+        if not os.path.exists(daily_path):
+            with lock_note(vault_path, daily_path):
+                # Another capture may have created it while we waited
+                if not os.path.exists(daily_path):
+                    if template_text is None:
+                        with trace.stage('template'):
+                            template_text = read_daily_template(vault_path)
 
-        if template_location and os.path.exists(template_location):
-            with open(template_location, 'r') as f:
-                template_text = f.read()
-        else:
-            sys.stderr.write(f"Warning - could not find daily template location: {template_location} using default daily template")
-            template_text = default_daily_template
-        
-        # Write to file daily_path
-        write_to_path(daily_path, template_text)
+                    if carry_over:
+                        with trace.stage('carry_over'):
+                            template_text = carry_over_tasks(vault_path, note_date, template_text, find_open_tasks)
+
+                    # Write to file daily_path
+                    with trace.stage('write'):
+                        write_to_path(daily_path, template_text)
+                    trace.count('created')
 
     # Returns daily_path it created
     return daily_path
 
+def carry_over_tasks(vault_path, note_date, template_text, find_open_tasks=None):
+    """
+    template_text with the open tasks of earlier daily notes appended under
+    `## Todo` (added at the end if the template has no such header)
+    """
+    from scripts import task_index
+
+    if find_open_tasks is None:
+        tasks = task_index.get_carry_over_vault(vault_path, note_date)
+    else:
+        tasks = find_open_tasks(*task_index.get_carry_over_range(note_date))
+    tracing.count('carried_over', len(tasks))
+    if not tasks:
+        return template_text
+
+    template_bytes = template_text.encode('utf-8')
+    insertion = get_insertion(
+        template_bytes, task_index.todo_header, task_index.format_tasks(tasks), create_header_if_missing=True)
+    return apply_insertions(template_bytes, [insertion]).decode('utf-8')
+
+def read_daily_template(vault_path):
+    """
+    Text of the daily note template, falls back to `default_daily_template`.
+    Cached, see `get_daily_config`
+    """
+    return get_daily_config(vault_path)['template_text']
+
+def get_daily_config(vault_path):
+    """
+    {'template': location or None, 'template_text'} of the daily note config.
+
+    Kept in process and as a snapshot in the cache dir for short lived
+    processes, both checked against the fingerprints of `daily-notes.json`
+    and the template, so a repeated capture costs two stats instead of a
+    json parse and a template read. Editing either file invalidates it.
+    """
+    config_path = os.path.join(vault_path, '.obsidian/daily-notes.json')
+    config_fp = get_file_fingerprint(config_path)
+
+    snapshot = daily_config_cache.get(vault_path)
+    if snapshot is None:
+        snapshot = load_daily_config_snapshot(vault_path)
+
+    if snapshot is not None and snapshot.get('vault') == os.path.abspath(vault_path) and \
+            snapshot.get('config_fp') == config_fp and \
+            snapshot.get('template_fp') == get_file_fingerprint(snapshot.get('template')):
+        daily_config_cache[vault_path] = snapshot
+        return snapshot
+
+    # Fingerprints are taken before reading, a file changing in between is
+    # read again next time
+    template_location = get_daily_template(vault_path)
+    template_fp = get_file_fingerprint(template_location)
+    snapshot = {
+        'vault': os.path.abspath(vault_path),
+        'config_fp': config_fp,
+        'template': template_location,
+        'template_fp': template_fp,
+        'template_text': load_daily_template(template_location),
+    }
+
+    now_ns = time.time_ns()
+    if all(fp is None or now_ns - fp[0] > daily_config_racy_ns for fp in (config_fp, template_fp)):
+        daily_config_cache[vault_path] = snapshot
+        try:
+            write_json_atomic(os.path.join(get_cache_dir(vault_path), daily_config_file_name), snapshot)
+        except OSError as e:
+            sys.stderr.write(f"Warning - could not save daily note config snapshot: {e}")
+    else:
+        daily_config_cache.pop(vault_path, None)
+
+    return snapshot
+
+def get_file_fingerprint(path):
+    """
+    `file_fingerprint` of path, None if there is no such file
+    """
+    if not path:
+        return None
+    try:
+        return file_fingerprint(os.stat(path))
+    except OSError:
+        return None
+
+def load_daily_config_snapshot(vault_path):
+    path = os.path.join(get_cache_dir(vault_path), daily_config_file_name)
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def load_daily_template(template_location):
+    if template_location and os.path.exists(template_location):
+        with open(template_location, 'r') as f:
+            template_text = f.read()
+    else:
+        sys.stderr.write(f"Warning - could not find daily template location: {template_location} using default daily template")
+        template_text = default_daily_template
+
+    return template_text
+
 def get_daily_template(vault_path):
     path = os.path.join(vault_path, '.obsidian/daily-notes.json')
 
     if not os.path.exists(path):
         sys.stderr.write(
-            f"Warning couldn't find daily note config `daily-notes.json` file at {path}",
-            file=sys.stderr)
+            f"Warning couldn't find daily note config `daily-notes.json` file at {path}")
         return None
     else:
         with open(path, 'rb') as f:
@@ -102,192 +238,464 @@ def read_daily_note(vault_path):
 
     return daily_content
 
-# TODO will replace this with alternative method in note_parser.py
 def find_header_pos(note_content, header_str):
-    
-    # Find headers
-    regex_md_header = r'^#+ .+$'
-
-    matches = [x.group() for x in re.finditer(regex_md_header, note_content, re.M)]
+    """
+    Returns (header line, last non empty line under the header before the next
+    header) or (None, None) if header_str isn't in the note. The last line is
+    None when the header has no content yet.
+    """
+    document = parse_document(note_content)
+    section = document.find(header_str)
 
-    if header_str not in matches:
-        sys.stderr.write(f"Warning: Could not find header `{header_str}` in {matches}")
+    if section is None:
+        sys.stderr.write(f"Warning: Could not find header `{header_str}` in {document.headers}")
         return None, None
 
-    start_line = None
-    end_line = None
-
-    lines = note_content.split('\n')
-
-    for i, line in enumerate(lines):
-        if start_line is None:
-            if line == header_str:
-                start_line = i
-                break
-
-    # Last non empty
-    for i, line in enumerate(lines[start_line:]):
-        if line == header_str:
-            pass
-        elif line in matches:
-            #end_line = (start_line + i)
-            break
-        elif line != '':
-            end_line = start_line + i
-
-    if start_line is None:
-        raise ValueError(f"Unexpected edge case - Could not find already matched header {header_str}")
-    
-    return start_line, end_line
-    
+    return section.line, section.last_line
 
-def insert_text(vault_path, header, inserted_text, create_header_if_missing=False):
+def get_insertion(note_bytes, header, inserted_text, create_header_if_missing=False, document=None, close_fence=True):
     """
-    Python implementation of https://github.com/chrisgrieser/shimmering-obsidian/blob/main/scripts/append-to-note.js
+    Where `insert_text` puts inserted_text, as (offset, bytes to insert) into the
+    utf-8 encoded note (bytes or an mmap). Pass `document` to reuse an existing
+    parse of note_bytes.
 
-    Returns new text as string, does not modify the file
+    close_fence - a new header after a code block left open at the end of
+    the note closes it first, or the header would be part of the code and
+    never found again. False when an earlier insertion already closes it.
+
+    Insertions always land inside the header's own section (or at the end of
+    the note for a new header), so insertions for different headers never
+    overlap and can be applied together.
     """
-    note_content = read_daily_note(vault_path)
+    if document is None:
+        document = parse_document(note_bytes)
 
-    start_line, end_line = find_header_pos(note_content, header)
-    lines = note_content.split('\n')
+    section = document.find(header)
+    size = len(note_bytes)
+    inserted = inserted_text.encode('utf-8')
 
-    if start_line is None:
+    if section is None:
         if create_header_if_missing:
             sys.stderr.write(f"Could not find header {header} in daily note, creating it at end of note")
 
-            ## Add desired header to end of document
-            lines.insert(len(lines), header)
-            # Update header
-            start_line = len(lines)
+            ## Add desired header to end of document, with the text below it
+            before = b'\n'
+            if close_fence and document.open_fence is not None:
+                before = (b'' if note_bytes[-1:] == b'\n' else b'\n') + document.open_fence.encode('utf-8') + b'\n\n'
+            return size, before + header.encode('utf-8') + b'\n\n' + inserted + b'\n'
         else:
             raise ValueError(f"Header {header} not found in daily note")
 
-    def ensure_empty_line(line_num, lines):
-        if line_num >= len(lines) or lines[line_num] != '':
-            lines.insert(line_num, '')
+    if section.last_line is not None:
+        # After the last non empty line under the header
+        if section.last_offset == size and note_bytes[-1:] != b'\n':
+            return size, b'\n' + inserted
+        return section.last_offset, inserted + b'\n'
 
-    if end_line is None:
-        ensure_empty_line(start_line + 1, lines)
-        lines.insert(start_line + 2, inserted_text)
-        ensure_empty_line(start_line + 3, lines)
-    else:
-        lines.insert(end_line + 1, inserted_text)
+    # Header with no content yet, only newlines until the next header / end of
+    # note. The text goes after one blank line and is followed by a blank line.
+    header_end = note_bytes.find(b'\n', section.offset, section.body_end_offset)
+    if header_end == -1:
+        header_end = section.body_end_offset
+    newlines = section.body_end_offset - header_end
+    offset = header_end + min(newlines, 2)
 
-    return '\n'.join(lines)
+    inserted = b'\n' * (2 - min(newlines, 2)) + inserted + b'\n'
+    if section.body_end_offset < size and newlines <= 2:
+        # Keep a blank line before the next header
+        inserted += b'\n'
 
-def append_to_daily_vault(vault_path, header, message, create_header_if_missing=False):
-    new_text = insert_text(
-        vault_path, header, message,
-        create_header_if_missing=create_header_if_missing)
-    daily_path = get_daily_note_path(vault_path)
-    write_to_path(daily_path, new_text)
+    return offset, inserted
 
-def get_headers_index(filenames):
+def apply_insertions(note_bytes, insertions):
     """
-    Given a list of markdown files, return dict with list of headers in each file
+    Returns the note as bytes with [(offset, bytes), ...] inserted
     """
-    pattern = r"^(#{1,6})\s(.+)$"
+    chunks = []
+    pos = 0
+    for offset, inserted in sorted(insertions, key=lambda x: x[0]):
+        chunks.append(note_bytes[pos:offset])
+        chunks.append(inserted)
+        pos = offset
+    chunks.append(note_bytes[pos:])
+    return b''.join(chunks)
 
-    pattern = r"^#{1,6}\s.+$"
+def insert_text(vault_path, header, inserted_text, create_header_if_missing=False):
+    """
+    Python implementation of https://github.com/chrisgrieser/shimmering-obsidian/blob/main/scripts/append-to-note.js
 
-    out = {} # fname: [headers]
-    for filename in filenames:
-        if filename.endswith('.md'):
-            with open(filename, 'r') as f:
-                content = f.read()
-            matches = re.findall(pattern, content, re.MULTILINE)
+    Returns new text as string, does not modify the file
+    """
+    note_bytes = read_daily_note(vault_path).encode('utf-8')
 
-            out[filename] = matches
-    return out
+    insertion = get_insertion(
+        note_bytes, header, inserted_text,
+        create_header_if_missing=create_header_if_missing)
 
-# TODO - rename this
-# Meant to handle 'note.name.*.cheat:## Foobar
-# note.path:# *python*
-def tree_schema(vault_path, query):
-
-    ## Function split 1 - convert query to glob strings
-    if ':' not in query:
-        #raise ValueError("Must contain a `:`")
-        sys.stderr.write("no `:` found in query str, treating as path glob search")
-        path_q = query
-        tree_q = None
-    else:
-        # Path query is glob searching on filename
-        # tree query is glob searching on headers
-        path_q, tree_q = query.split(':')
-
-    ## Pad each of path/tree query str with a `*` for easier clob usage
-    if path_q:
-        if path_q[0] != '*':
-            path_q = '*' + path_q
-        if path_q[-1] != '*':
-            path_q =  path_q + '*'
-
-    if tree_q:
-        # Pad tree query
-        if tree_q[0] != '*':
-            tree_q = '*' + tree_q
-        if tree_q[-1] != '*':
-            tree_q =  tree_q + '*'
-
-    # Find path_q
-
-    # Step 0 - get index of 
-    # TODO - cache this result eventually, will be slow for big vaults
-    headers_index = get_headers_index(glob.glob(os.path.join(vault_path, '*'), recursive=True))
-
-    ## Step 1 - Filter out files that match fname part of glob query
-    if path_q:
-        path_glob = os.path.join(vault_path, path_q)
-        searched_files = glob.glob(path_glob, recursive=True)
-        # Only get items from headers based on filenames (keys) in searched_files
-        subset_headers = dict((k, headers_index[k]) for k in searched_files if k in headers_index)
-    else:
-        # No file related search query given, use all files for search canidates
-        subset_headers = headers_index
-
-    #combined_strings = [item for filename, items in subset_headers.items() for item in items]
-    # Format out: `/path/to/vault/note-name.md:# Header In markdown file`
-    # Kindof insane long one liner - last if statement block is to handle edge case of a note not having
-    # any headers
-    combined_strings = [f"{filename}:{item}" for filename, items in subset_headers.items() for item in (items if len(items) > 0 else [''])]
-
-    # Filter out matched file's header's with tree query glob
-    if tree_q:
-        # Create regex out of fmatch glob
-        globexpression = f'*:{tree_q}'
-        reg_expr = re.compile(fnmatch.translate(globexpression), re.IGNORECASE)
-        matches = [f for f in combined_strings if re.match(reg_expr, f)]
-
-        #matches = fnmatch.filter(combined_strings, f'*:{tree_q}')
-    else:
-        matches = combined_strings
+    return apply_insertions(note_bytes, [insertion]).decode('utf-8')
+
+def write_insertions_atomic(note_path, note_bytes, insertions, before_replace=None):
+    """
+    Write note_bytes with [(offset, bytes), ...] inserted to note_path.
+    Goes through a temp file + rename with fsync so a crash leaves either the
+    old or the new note, never a partial one. The unchanged parts are written
+    straight from note_bytes without building a new copy of the note.
+
+    before_replace(tmp_path) is called once the temp file is durable, just
+    before it is renamed over the note
+    """
+    parent_dir, fname = os.path.split(note_path)
+    tmp_path = os.path.join(parent_dir, f'.{fname}.{os.getpid()}.tmp')
+
+    try:
+        # Released before returning, an mmap can't close while viewed
+        with memoryview(note_bytes) as note_view, open(tmp_path, 'wb') as f:
+            pos = 0
+            # Stable sort, insertions at the same offset keep their order
+            for offset, inserted in sorted(insertions, key=lambda x: x[0]):
+                f.write(note_view[pos:offset])
+                f.write(inserted)
+                pos = offset
+            f.write(note_view[pos:])
+            f.flush()
+            os.fsync(f.fileno())
+
+        # Keep the note's permissions
+        os.chmod(tmp_path, os.stat(note_path).st_mode & 0o7777)
+        if before_replace is not None:
+            before_replace(tmp_path)
+        os.replace(tmp_path, note_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    # Make the rename itself durable
+    dir_fd = os.open(parent_dir or '.', os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+@contextlib.contextmanager
+def lock_note(vault_path, note_path):
+    """
+    Advisory lock around a read-modify-write of a note, so back to back
+    captures running as separate processes don't overwrite each other.
+    The lock file lives in the cache dir since the note itself is replaced
+    on every write.
+    """
+    lock_dir = os.path.join(get_cache_dir(vault_path), 'locks')
+    os.makedirs(lock_dir, exist_ok=True)
+
+    # Two notes sharing a crc only means they share a lock
+    note_hash = f"{zlib.crc32(os.path.abspath(note_path).encode('utf-8')):08x}"
+    fd = os.open(os.path.join(lock_dir, f'{note_hash}.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+class NoteChangedError(Exception):
+    """
+    The note was modified by another program (eg Obsidian sync) between being
+    read and being replaced
+    """
+
+# Re-reads before giving up when the note keeps changing under us
+modify_note_attempts = 5
+
+def modify_note(vault_path, note_path, get_insertions, before_replace=None, snapshot=False):
+    """
+    Locked read-modify-write of a note. get_insertions(note_bytes) returns the
+    insertions to apply. If the note changed on disk after it was read, the
+    insertions are computed again from the new content.
+
+    snapshot - call get_insertions(note_bytes, document) with the note's
+    parse, kept between calls for notes over `note_snapshot.snapshot_min_bytes`.
+    While the snapshot matches the note, note_bytes is an mmap of it and only
+    the pages the insertions look at are read before the rewrite.
+    """
+    with lock_note(vault_path, note_path):
+        for _ in range(modify_note_attempts):
+            document = None
+            with open(note_path, 'rb') as f:
+                read_fingerprint = file_fingerprint(os.fstat(f.fileno()))
+                keep_snapshot = snapshot and read_fingerprint[1] >= note_snapshot.snapshot_min_bytes
+                if keep_snapshot:
+                    with tracing.stage('snapshot'):
+                        document = note_snapshot.load_snapshot(vault_path, note_path, read_fingerprint)
+
+                with tracing.stage('read'):
+                    if document is not None:
+                        note_bytes = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    else:
+                        note_bytes = f.read()
+            tracing.count('attempts')
+
+            try:
+                if snapshot and document is None:
+                    with tracing.stage('parse'):
+                        document = parse_document(note_bytes)
+                if isinstance(note_bytes, bytes):
+                    tracing.count('bytes_read', len(note_bytes))
+                else:
+                    tracing.count('snapshot_hits')
+
+                with tracing.stage('insertions'):
+                    insertions = get_insertions(note_bytes, document) if snapshot else get_insertions(note_bytes)
+
+                written = []
+                def check_unchanged(tmp_path):
+                    if file_fingerprint(os.stat(note_path)) != read_fingerprint:
+                        raise NoteChangedError(note_path)
+                    if keep_snapshot:
+                        with tracing.stage('patch'):
+                            written.append(note_snapshot.get_written_snapshot(document, insertions, tmp_path))
+                    if before_replace is not None:
+                        before_replace(tmp_path)
+
+                try:
+                    with tracing.stage('write'):
+                        write_insertions_atomic(note_path, note_bytes, insertions, before_replace=check_unchanged)
+                except NoteChangedError:
+                    sys.stderr.write(f"Warning - {note_path} changed while appending, re-applying")
+                    continue
+            finally:
+                if isinstance(note_bytes, mmap.mmap):
+                    note_bytes.close()
+
+            if keep_snapshot:
+                # The rename keeps the temp file's inode and mtime
+                note_snapshot.save_snapshot(vault_path, note_path, *written[0])
+            return
+
+    raise NoteChangedError(f"{note_path} kept changing, gave up after {modify_note_attempts} attempts")
+
+def append_to_daily_vault(vault_path, header, message, create_header_if_missing=False, duplicate_urls=None, find_url=None):
+    with tracing.traced('append_to_daily_vault', header=header):
+        return append_many_to_daily_vault(
+            vault_path, [(header, message)],
+            create_header_if_missing=create_header_if_missing,
+            duplicate_urls=duplicate_urls, find_url=find_url)
+
+def append_many_to_daily_vault(
+        vault_path, entries, create_header_if_missing=False, note_date: datetime.datetime=None,
+        duplicate_urls=None, find_url=None):
+    """
+    Append a list of (header, text) entries to the daily note with one read,
+    one parse and one write. Same result as calling `append_to_daily_vault`
+    for each entry in order. Returns the entries written.
+
+    duplicate_urls - `skip`, `annotate` or `link` entries with a url already
+        in the vault, see `url_index.dedupe_entries`
+    find_url - url -> occurrences, defaults to `url_index.lookup_vault`
+    """
+    daily_path = get_daily_note_path(vault_path, note_date=note_date)
 
-    # match on headers
-    out = []
-    for match in matches:
-        if ':' not in match:
-            sys.stderr.write(f"Can't split fname `{fname}` from full path `{match}`")
+    with tracing.traced('append_many_to_daily_vault') as trace:
+        if duplicate_urls and duplicate_urls != '0':
+            from scripts import url_index
+            mode = url_index.get_duplicate_mode(duplicate_urls)
+            with trace.stage('dedupe'):
+                if find_url is None:
+                    conn = url_index.open_index(vault_path)
+                    try:
+                        url_index.update_index(conn, vault_path, walk_vault(vault_path))
+                        entries = url_index.dedupe_entries(
+                            entries, mode, lambda url: url_index.lookup(conn, vault_path, url))
+                    finally:
+                        conn.close()
+                else:
+                    entries = url_index.dedupe_entries(entries, mode, find_url)
+
+        trace.count('entries', len(entries))
+        if not entries:
+            return entries
+
+        def get_insertions(note_bytes, document):
+            return get_batch_insertions(
+                note_bytes, entries,
+                create_header_if_missing=create_header_if_missing, document=document)
+
+        modify_note(vault_path, daily_path, get_insertions, snapshot=True)
+    return entries
+
+def get_batch_insertions(note_bytes, entries, create_header_if_missing=False, document=None):
+    """
+    Insertions for a list of (header, text) entries, see `get_insertion`
+    """
+    if document is None:
+        document = parse_document(note_bytes)
+
+    # Entries for the same header end up one after the other, so they can be
+    # inserted as one block
+    texts_by_header = {}
+    for header, text in entries:
+        texts_by_header.setdefault(header, []).append(text)
+
+    insertions = []
+    new_header_insertions = []
+    for header, texts in texts_by_header.items():
+        insertion = get_insertion(
+            note_bytes, header, '\n'.join(texts),
+            create_header_if_missing=create_header_if_missing,
+            document=document, close_fence=not new_header_insertions)
+
+        if document.find(header) is None:
+            new_header_insertions.append(insertion)
         else:
-            # get filname off of string before splitting parent dir + filename
-            basename = match.split(':')[0]
-            # Joins again to handle edge case of a colon being in markdown header
-            header = ':'.join(match.split(':')[1:])
+            insertions.append(insertion)
+
+    # New headers go at the very end, after anything else inserted there
+    return insertions + new_header_insertions
 
-            dir, fname = os.path.split(basename)
+def get_headers_index(filenames, workers=1):
+    """
+    Given a list of markdown files, return dict with list of headers in each file
 
-        out.append({
-            'title': f'{fname}:{header}' if len(header) > 1 else fname,
-            'subtitle': fname,
-            'arg': create_obsidian_url(
-                vault_path, fname,
-                heading=(header if len(header) > 1 else None)),
-        })
+    workers > 1 reads and parses files in parallel, see `parse_notes_parallel`
+    """
+    with tracing.traced('get_headers_index', workers=workers) as trace:
+        if workers > 1:
+            with trace.stage('parse_parallel'):
+                parsed, stats = parse_notes_parallel(filenames, workers=workers)
+            trace.count('files', stats['files'])
+            trace.count('bytes_read', stats['bytes'])
+            return dict((filename, headers) for filename, _, headers in parsed)
+
+        out = {} # fname: [headers]
+        for filename in filenames:
+            if filename.endswith('.md'):
+                with trace.stage('read'), open(filename, 'r') as f:
+                    content = f.read()
+
+                with trace.stage('parse'):
+                    out[filename] = get_headers(content)
+                trace.count('files')
+                trace.count('bytes_read', len(content))
+        return out
 
-    return out
+# TODO - rename this
+# Meant to handle 'note.name.*.cheat:## Foobar
+# note.path:# *python*
+def iter_tree_schema(
+        vault_path, query, headers_index=None, mtimes=None, limit=None, cache=None, generation=0,
+        fuzzy=False, fuzzy_index=None, previews=False, files=None, scan_index=None):
+    """
+    Generator of Alfred items for the best `limit` (all if None) matches,
+    best first, see `tree_query.iter_ranked_matches`. Urls are only built for
+    the items actually consumed.
+
+    headers_index - optional {filename: [headers]} already in memory, otherwise
+    the on disk index is brought up to date and used
+    mtimes - optional {filename: mtime} to rank recent notes first
+    cache / generation - optional `tree_query.QueryCache` and the generation
+    of headers_index, for processes that answer many queries
+    scan_index - optional `tree_query.ScanIndex` of headers_index and mtimes
+    fuzzy - when the globs match nothing, yield fuzzy trigram matches from
+    fuzzy_index, a `trigram_index.TrigramIndex` of headers_index (the one
+    saved in the cache dir, brought up to date, if not given)
+    previews - add the text under each header to its item, see
+    `section_preview`. files - index entries {rel_path: entry} of
+    headers_index with the header byte ranges, notes are parsed without them
+    """
+    # Stages are only recorded when called from a traced `tree_schema`
+    trace = tracing.current
+
+    from scripts.tree_query import TreeQuery, iter_ranked_matches
+
+    # Path and header globs are compiled once and run against the index directly
+    tree_query = TreeQuery(query)
+
+    # Step 0 - get index of headers, only notes changed since last search are re-read
+    if headers_index is None:
+        with trace.stage('index'):
+            files = get_cached_index(vault_path)
+            headers_index = get_headers_by_path(vault_path, files)
+            mtimes = get_mtimes_by_path(vault_path, files)
+
+    rel_path = make_rel_path(vault_path)
+
+    get_preview = None
+    if previews:
+        from scripts.section_preview import get_span, read_section
+
+        def get_preview(filename, header):
+            with trace.stage('previews'):
+                entry = files.get(rel_path(filename)) if files is not None else None
+                return read_section(
+                    filename, header, span=get_span(entry, header),
+                    fingerprint=entry['fp'] if entry is not None else None)
+
+    matched = False
+    ranked_matches = iter_ranked_matches(
+        tree_query, headers_index, rel_path, limit=limit, mtimes=mtimes, cache=cache, generation=generation,
+        scan_index=scan_index)
+    if trace:
+        # Matched up front, so matching and building items are timed apart
+        cache_before = cache.stats() if cache is not None else None
+        with trace.stage('match'):
+            ranked_matches = list(ranked_matches)
+        trace.count('matches', len(ranked_matches))
+        if cache is not None:
+            for name, value in cache.stats().items():
+                if name != 'size':
+                    trace.count(f'cache_{name}', value - cache_before[name])
+
+    with trace.stage('items'):
+        for filename, header in ranked_matches:
+            matched = True
+            yield get_tree_item(vault_path, rel_path, filename, header, get_preview=get_preview)
+
+    if fuzzy and not matched:
+        with trace.stage('fuzzy'):
+            if fuzzy_index is None:
+                from scripts.trigram_index import get_cached_index as get_cached_trigram_index
+                fuzzy_index = get_cached_trigram_index(vault_path, headers_index)
+            fuzzy_matches = fuzzy_index.search(query, limit=limit or fuzzy_limit, mtimes=mtimes)
+        trace.count('fuzzy_matches', len(fuzzy_matches))
+        for filename, header in fuzzy_matches:
+            yield get_tree_item(vault_path, rel_path, filename, header, get_preview=get_preview)
+
+def get_tree_item(vault_path, rel_path, filename, header, get_preview=None):
+    """
+    get_preview(filename, header) - optional, the item's subtitle becomes the
+    section's text, shown whole with Alfred's large type
+    """
+    fname = os.path.basename(filename)
+    item = {
+        'title': f'{fname}:{header}' if len(header) > 1 else fname,
+        'subtitle': rel_path(filename),
+        'arg': create_obsidian_url(
+            vault_path, rel_path(filename),
+            heading=(header if len(header) > 1 else None)),
+    }
+
+    if get_preview is not None:
+        from scripts.section_preview import get_summary
+
+        preview = get_preview(filename, header if len(header) > 1 else '')
+        if preview:
+            item['subtitle'] = f'{item["subtitle"]} - {get_summary(preview)}'
+            item['text'] = {'largetype': preview, 'copy': preview}
+        item['quicklookurl'] = filename
+    return item
+
+def tree_schema(vault_path, query, **kwargs):
+    """
+    List of `iter_tree_schema` items
+    """
+    with tracing.traced('tree_schema', query=query, limit=kwargs.get('limit')) as trace:
+        items = list(iter_tree_schema(vault_path, query, **kwargs))
+        trace.count('results', len(items))
+    return items
 
 def create_obsidian_url(vault_path, relative_path, heading=None, line_num=None):
+    # Imported here to keep urllib.parse off the start up of captures, which never build a url
+    from urllib.parse import quote
+
     relative_path_enc = quote(relative_path)
 
     vault_path = os.path.split(vault_path)[1]
@@ -300,7 +708,7 @@ def create_obsidian_url(vault_path, relative_path, heading=None, line_num=None):
         header = heading.replace('#', '').strip()
         url_scheme += f"&heading={quote(header)}"
     elif line_num:
-        url_scheme += f"&line={quote(line_num)}"
+        url_scheme += f"&line={quote(str(line_num))}"
 
 
     return url_scheme
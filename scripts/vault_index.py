@@ -0,0 +1,416 @@
+import os
+import sys
+import json
+import time
+
+from scripts.note_parser import get_headers, get_header_spans
+from scripts.vault_walk import walk_vault
+from scripts import tracing
+
+# Bump when the on disk layout changes, older caches are rebuilt from scratch
+INDEX_VERSION = 2
+
+default_cache_dir = '.alfred_cache'
+index_file_name = 'headers_index.json'
+
+# Same window as `utils.daily_config_racy_ns`, a note read this soon after it
+# was modified may be modified again within the same mtime tick without its
+# fingerprint changing. Its entry is marked `'racy'` and read again until
+# the window has passed.
+index_racy_ns = 2_000_000_000
+
+# Cold builds below this many notes aren't worth the process pool start up cost
+parallel_min_files = 500
+parallel_chunk_size = 256
+
+def get_cache_dir(vault_path):
+    """
+    Cache lives inside the vault so it travels with it. Can be overridden with
+    the `cache_dir` workflow variable.
+    """
+    cache_dir = os.environ.get('cache_dir')
+    if not cache_dir:
+        cache_dir = os.path.join(vault_path, default_cache_dir)
+    return os.path.expanduser(cache_dir)
+
+def get_index_path(vault_path):
+    return os.path.join(get_cache_dir(vault_path), index_file_name)
+
+def make_rel_path(vault_path):
+    """
+    Returns a function mapping note paths under vault_path to vault relative
+    paths, a plain slice in the common case since os.path.relpath is slow
+    """
+    prefix = os.path.join(vault_path, '')
+    def rel_path(filename):
+        if filename.startswith(prefix):
+            return filename[len(prefix):]
+        return os.path.relpath(filename, vault_path)
+    return rel_path
+
+def file_fingerprint(stat_result):
+    """
+    Anything that changes when a note is edited, replaced, or swapped by sync
+    """
+    return [stat_result.st_mtime_ns, stat_result.st_size, stat_result.st_ino]
+
+def make_entry(stat_result, headers, spans, read_ns):
+    """
+    Index entry of a note read at read_ns (`time.time_ns()` from before the read)
+    """
+    entry = {'fp': file_fingerprint(stat_result), 'headers': headers, 'spans': spans}
+    if read_ns - stat_result.st_mtime_ns <= index_racy_ns:
+        entry['racy'] = True
+    return entry
+
+def is_current(entry, stat_result):
+    """
+    True if entry doesn't need to be read again for the note at stat_result
+    """
+    return entry['fp'] == file_fingerprint(stat_result) and not entry.get('racy')
+
+def write_json_atomic(path, content, fsync=False):
+    """
+    Write json to a temp file next to `path` then rename it over, so a
+    crashed or concurrent run never leaves a half written file behind.
+    fsync=True also makes it survive a power loss.
+    """
+    parent_dir, _ = os.path.split(path)
+    if parent_dir and not os.path.exists(parent_dir):
+        os.makedirs(parent_dir)
+
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(content, f)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def load_index(vault_path):
+    """
+    Returns {relative_path: {'fp': fingerprint, 'headers': [headers], 'spans': [[start, end]]}},
+    spans being each header's byte range, see `note_parser.get_header_spans`,
+    and `'racy': True` for entries read within `index_racy_ns` of their mtime
+
+    Missing, unreadable, or out of date caches return an empty index
+    """
+    index_path = get_index_path(vault_path)
+    if not os.path.exists(index_path):
+        return {}
+
+    try:
+        with open(index_path, 'r') as f:
+            content = json.load(f)
+    except (OSError, ValueError) as e:
+        sys.stderr.write(f"Warning - could not read header index {index_path}, rebuilding: {e}")
+        return {}
+
+    if content.get('version') != INDEX_VERSION:
+        return {}
+
+    return content.get('files', {})
+
+def save_index(vault_path, files):
+    write_json_atomic(
+        get_index_path(vault_path),
+        {'version': INDEX_VERSION, 'files': files})
+
+def get_index_workers():
+    """
+    Worker count for cold index builds, `index_workers` workflow variable or
+    one per core
+    """
+    workers = os.environ.get('index_workers')
+    if workers:
+        try:
+            return max(1, int(workers))
+        except ValueError:
+            sys.stderr.write(f"Warning - ignoring `index_workers` {workers!r}, not a number")
+    return os.cpu_count() or 1
+
+def _read_note(filename):
+    try:
+        with open(filename, 'rb') as f:
+            stat_result = os.fstat(f.fileno())
+            content = f.read()
+    except OSError:
+        return None
+    return filename, stat_result, content
+
+def _parse_chunk(parse, contents):
+    return [parse(content) for content in contents]
+
+def _parse_in_pools(filenames, workers, chunk_size, parse):
+    """
+    `parse_notes_parallel`'s reads in a thread pool and parses in a process
+    pool, returns (out, total bytes)
+    """
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+    chunk_metas = [] # [(filename, stat_result), ...] per chunk
+    chunk_futures = []
+    total_bytes = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as read_pool, \
+            ProcessPoolExecutor(max_workers=workers) as parse_pool:
+
+        metas, contents = [], []
+        # map keeps submission order, reads still overlap with parsing
+        for result in read_pool.map(_read_note, filenames):
+            if result is None:
+                continue
+            filename, stat_result, content = result
+            total_bytes += stat_result.st_size
+
+            metas.append((filename, stat_result))
+            contents.append(content)
+
+            if len(contents) >= chunk_size:
+                chunk_metas.append(metas)
+                chunk_futures.append(parse_pool.submit(_parse_chunk, parse, contents))
+                metas, contents = [], []
+
+        if contents:
+            chunk_metas.append(metas)
+            chunk_futures.append(parse_pool.submit(_parse_chunk, parse, contents))
+
+        out = []
+        for metas, future in zip(chunk_metas, chunk_futures):
+            for (filename, stat_result), headers in zip(metas, future.result()):
+                out.append((filename, stat_result, headers))
+    return out, total_bytes
+
+def _parse_serial(filenames, parse):
+    out = []
+    total_bytes = 0
+    for result in map(_read_note, filenames):
+        if result is None:
+            continue
+        filename, stat_result, content = result
+        total_bytes += stat_result.st_size
+        out.append((filename, stat_result, parse(content)))
+    return out, total_bytes
+
+def parse_notes_parallel(filenames, workers=None, chunk_size=parallel_chunk_size, parse=get_headers):
+    """
+    File reads are fanned out to a thread pool and header extraction to a
+    process pool in chunks. Output is in `filenames` order regardless of which
+    worker finishes first.
+
+    parse - module level function of a note's bytes, run in the pool
+
+    Notes are parsed serially when the process pool can't start or breaks,
+    eg no semaphores in a sandbox or a worker killed.
+
+    Returns ([(filename, stat_result, parse result), ...], stats) where stats
+    has files/s and MB/s for tuning `workers`
+    """
+    # Pulls in multiprocessing, only cold builds pay for it
+    from concurrent.futures.process import BrokenProcessPool
+
+    if workers is None:
+        workers = get_index_workers()
+
+    filenames = [f for f in filenames if f.endswith('.md')]
+    start = time.perf_counter()
+
+    try:
+        out, total_bytes = _parse_in_pools(filenames, workers, chunk_size, parse)
+    except (OSError, NotImplementedError, BrokenProcessPool) as e:
+        sys.stderr.write(f"Warning - could not parse notes in a process pool, parsing them serially: {e}")
+        workers = 1
+        out, total_bytes = _parse_serial(filenames, parse)
+
+    seconds = time.perf_counter() - start
+    stats = {
+        'workers': workers,
+        'files': len(out),
+        'bytes': total_bytes,
+        'seconds': seconds,
+        'files_per_s': len(out) / seconds if seconds else 0.0,
+        'mb_per_s': total_bytes / 1e6 / seconds if seconds else 0.0,
+    }
+    return out, stats
+
+def build_index_parallel(vault_path, filenames, workers=None):
+    """
+    Cold build of the whole index across cores, returns (files, stats)
+    """
+    read_ns = time.time_ns()
+    parsed, stats = parse_notes_parallel(filenames, workers=workers, parse=get_header_spans)
+    rel_path = make_rel_path(vault_path)
+
+    files = {}
+    for filename, stat_result, (headers, spans) in parsed:
+        files[rel_path(filename)] = make_entry(stat_result, headers, spans, read_ns)
+    return files, stats
+
+def stat_notes(filenames):
+    """
+    (filename, stat_result) for the markdown files in filenames, the input
+    `update_index` takes. `vault_walk.walk_vault` yields the same thing.
+    """
+    for filename in filenames:
+        if not filename.endswith('.md'):
+            continue
+        try:
+            yield filename, os.stat(filename)
+        except OSError:
+            continue
+
+def update_index(vault_path, notes, files=None):
+    """
+    Bring `files` (loaded from disk if not given) up to date with `notes`, a
+    list of (filename, stat_result). Only notes whose fingerprint changed (or
+    whose entry is racy, see `index_racy_ns`) are re-read, notes that are no
+    longer in `notes` are dropped.
+
+    Returns (files, changed)
+    """
+    if files is None:
+        with tracing.stage('load'):
+            files = load_index(vault_path)
+
+    with tracing.stage('walk'):
+        notes = list(notes)
+    tracing.count('notes', len(notes))
+    if not files and len(notes) >= parallel_min_files and get_index_workers() > 1:
+        # No cache to reuse, build everything across cores
+        with tracing.stage('build_parallel'):
+            files, stats = build_index_parallel(vault_path, [filename for filename, _ in notes])
+        tracing.count('reread', stats['files'])
+        tracing.count('bytes_read', stats['bytes'])
+        sys.stderr.write(
+            f"Built header index for {stats['files']} notes with {stats['workers']} workers "
+            f"({stats['files_per_s']:.0f} files/s, {stats['mb_per_s']:.1f} MB/s)")
+        return files, True
+
+    changed = False
+    rel_path = make_rel_path(vault_path)
+    # Rebuilt in `notes` order so results don't depend on cache history
+    new_files = {}
+    for filename, stat_result in notes:
+        key = rel_path(filename)
+
+        entry = files.get(key)
+        if entry is None or not is_current(entry, stat_result):
+            new_entry = read_entry(filename, stat_result)
+            if new_entry is None:
+                # Deleted since it was listed
+                continue
+            # A racy entry read again is usually the same
+            changed = changed or new_entry != entry
+            entry = new_entry
+
+        new_files[key] = entry
+
+    if len(new_files) != len(files):
+        # Notes were deleted or renamed
+        changed = True
+
+    return new_files, changed
+
+def read_entry(filename, stat_result):
+    """
+    Index entry of a note, None if it can't be read
+    """
+    read_ns = time.time_ns()
+    try:
+        with tracing.stage('read'), open(filename, 'rb') as f:
+            content = f.read()
+    except OSError:
+        return None
+
+    with tracing.stage('parse'):
+        headers, spans = get_header_spans(content)
+        entry = make_entry(stat_result, headers, spans, read_ns)
+    tracing.count('reread')
+    tracing.count('bytes_read', stat_result.st_size)
+    return entry
+
+def apply_changes(vault_path, files, notes, removed):
+    """
+    Partial `update_index` for when the changed notes are known, eg from
+    `vault_watch`: notes, (filename, stat_result) pairs, are re-read if
+    their fingerprint changed or their entry is racy and removed filenames
+    are dropped. Other
+    entries are left alone, new notes go at the end.
+
+    Updates files in place, returns {filename: entry or None if removed}
+    for the entries that changed
+    """
+    rel_path = make_rel_path(vault_path)
+    changes = {}
+    for filename in removed:
+        if files.pop(rel_path(filename), None) is not None:
+            changes[filename] = None
+
+    for filename, stat_result in notes:
+        key = rel_path(filename)
+        old_entry = files.get(key)
+        if old_entry is not None and is_current(old_entry, stat_result):
+            continue
+
+        entry = read_entry(filename, stat_result)
+        if entry is None:
+            if files.pop(key, None) is not None:
+                changes[filename] = None
+            continue
+        files[key] = entry
+        if entry != old_entry:
+            changes[filename] = entry
+    return changes
+
+def get_cached_index(vault_path, notes=None):
+    """
+    Index entries {rel_path: {'fp', 'headers'}} brought up to date with
+    notes, (filename, stat_result) pairs defaulting to every note in the vault
+    """
+    if notes is None:
+        notes = walk_vault(vault_path)
+
+    files, changed = update_index(vault_path, notes)
+    if changed:
+        try:
+            with tracing.stage('save'):
+                save_index(vault_path, files)
+        except OSError as e:
+            sys.stderr.write(f"Warning - could not save header index: {e}")
+    return files
+
+def get_headers_by_path(vault_path, files):
+    """
+    {filename: [headers]} from index entries
+    """
+    return dict(
+        (os.path.join(vault_path, rel_path), entry['headers'])
+        for rel_path, entry in files.items())
+
+def get_mtimes_by_path(vault_path, files):
+    """
+    {filename: mtime_ns} from index entries, for ranking recent notes first
+    """
+    return dict(
+        (os.path.join(vault_path, rel_path), entry['fp'][0])
+        for rel_path, entry in files.items())
+
+def get_cached_headers_index(vault_path, notes=None):
+    """
+    Cached version of `utils.get_headers_index`, same output format:
+    {filename: [headers]}
+
+    notes - (filename, stat_result) list, defaults to every note in the vault
+    """
+    return get_headers_by_path(vault_path, get_cached_index(vault_path, notes))
+
+#### Run
+
+if __name__ == '__main__':
+    # Time a cold build, eg `python -m scripts.vault_index ~/vault 8`
+    vault_path = os.path.expanduser(sys.argv[1])
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+    filenames = [filename for filename, _ in walk_vault(vault_path)]
+    _, stats = build_index_parallel(vault_path, filenames, workers=workers)
+    print(json.dumps(stats))
@@ -0,0 +1,157 @@
+import os
+import re
+import sys
+import json
+
+# Folders Obsidian itself hides, on top of every `.`-prefixed folder
+default_ignored_dirs = set(['node_modules'])
+
+def compile_path_glob(pattern):
+    """
+    Compile a glob matched against vault relative paths, with `glob.glob`
+    semantics: `*` and `?` don't cross `/`, `**` does. Use with `fullmatch`.
+    """
+    out = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith('**/', i):
+            # Zero or more folders
+            out.append('(?:.*/)?')
+            i += 3
+            continue
+        elif pattern.startswith('**', i):
+            out.append('.*')
+            i += 2
+            continue
+        elif c == '*':
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            end = pattern.find(']', i + 1)
+            if end == -1:
+                out.append(re.escape(c))
+            else:
+                chars = pattern[i + 1:end]
+                if chars.startswith('!'):
+                    chars = '^' + chars[1:]
+                out.append(f'[{chars}]')
+                i = end
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return re.compile(''.join(out))
+
+def get_ignore_rules(vault_path):
+    """
+    Returns (ignored folder prefixes, functions matching relative paths) from
+    Obsidian's "Excluded files" and attachment folder settings in
+    `.obsidian/app.json`, plus the `ignore_globs` workflow variable
+    (comma separated globs)
+    """
+    prefixes = []
+    patterns = []
+
+    app_config_path = os.path.join(vault_path, '.obsidian', 'app.json')
+    if os.path.exists(app_config_path):
+        try:
+            with open(app_config_path, 'rb') as f:
+                app_config = json.loads(f.read())
+        except ValueError as e:
+            sys.stderr.write(f"Warning - could not parse {app_config_path}: {e}")
+            app_config = {}
+
+        for ignore_filter in app_config.get('userIgnoreFilters', []):
+            if len(ignore_filter) > 2 and ignore_filter.startswith('/') and ignore_filter.endswith('/'):
+                try:
+                    patterns.append(re.compile(ignore_filter[1:-1]).search)
+                except re.error as e:
+                    sys.stderr.write(f"Warning - ignoring invalid excluded files filter {ignore_filter}: {e}")
+            else:
+                prefixes.append(ignore_filter.rstrip('/'))
+
+        attachment_folder = app_config.get('attachmentFolderPath', '')
+        # `/` is the vault root and `./` next to each note, neither can be skipped
+        if attachment_folder and not attachment_folder.startswith('.') and attachment_folder != '/':
+            prefixes.append(attachment_folder.strip('/'))
+
+    for ignore_glob in os.environ.get('ignore_globs', '').split(','):
+        if ignore_glob.strip():
+            patterns.append(compile_path_glob(ignore_glob.strip()).fullmatch)
+
+    return prefixes, patterns
+
+def make_is_ignored(ignore_rules):
+    """
+    Function telling if a vault relative path is ignored by `get_ignore_rules`
+    rules. Hidden names and `default_ignored_dirs` are checked separately.
+    """
+    prefixes, patterns = ignore_rules
+
+    def is_ignored(rel_path):
+        for prefix in prefixes:
+            if rel_path == prefix or rel_path.startswith(prefix + '/'):
+                return True
+        for pattern in patterns:
+            if pattern(rel_path):
+                return True
+        return False
+    return is_ignored
+
+def walk_vault(vault_path, ignore_rules=None, rel_dir='', on_dir=None):
+    """
+    Yields (path, stat_result) for every markdown note under vault_path.
+    Hidden folders (.obsidian, .trash, .git, the cache dir, ...) and ignored
+    folders are pruned without being listed. Symlinked folders are followed,
+    each folder is walked once so symlink loops end.
+
+    rel_dir - only walk this vault relative folder
+    on_dir(dir_path, rel_dir) - called for each folder walked, `rel_dir` ends
+        with `/` except for the vault root
+    """
+    if ignore_rules is None:
+        ignore_rules = get_ignore_rules(vault_path)
+    is_ignored = make_is_ignored(ignore_rules)
+
+    if rel_dir:
+        rel_dir = rel_dir.rstrip('/') + '/'
+    stack = [(os.path.join(vault_path, rel_dir) if rel_dir else vault_path, rel_dir)]
+    visited = set() # (st_dev, st_ino) of the folders walked
+    while stack:
+        dir_path, rel_dir = stack.pop()
+        try:
+            dir_stat = os.stat(dir_path)
+            entries = list(os.scandir(dir_path))
+        except OSError:
+            continue
+        if (dir_stat.st_dev, dir_stat.st_ino) in visited:
+            continue
+        visited.add((dir_stat.st_dev, dir_stat.st_ino))
+        if on_dir is not None:
+            on_dir(dir_path, rel_dir)
+
+        # Listing order isn't stable across file systems
+        entries.sort(key=lambda entry: entry.name)
+        sub_dirs = []
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+
+            rel_path = rel_dir + entry.name
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                continue
+
+            if is_dir:
+                if entry.name not in default_ignored_dirs and not is_ignored(rel_path):
+                    sub_dirs.append((entry.path, rel_path + '/'))
+            elif entry.name.endswith('.md') and not is_ignored(rel_path):
+                try:
+                    yield entry.path, entry.stat()
+                except OSError:
+                    continue
+
+        # Depth first, in name order
+        stack.extend(reversed(sub_dirs))
@@ -0,0 +1,334 @@
+"""
+Watches a vault for note changes, so the daemon applies them to its indexes
+as they happen instead of stat'ing every note on each request.
+
+On Linux `InotifyWatcher` gets create / modify / delete / rename events from
+the kernel (through ctypes, no extra dependency). Elsewhere, or when inotify
+runs out of watches, `PollingWatcher` walks the vault every
+`watch_interval` seconds and diffs fingerprints.
+
+Either way events are gathered into a `ChangeBatch` until the vault has been
+quiet for `debounce` seconds (or `max_delay` after the first event), so a
+sync dropping hundreds of notes at once is re-parsed as one batch. A reader
+that can't wait, eg a search right after a capture, can `collect(0)` and
+`take` the pending batch itself.
+"""
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import threading
+
+from scripts.vault_walk import walk_vault, get_ignore_rules, make_is_ignored, default_ignored_dirs
+from scripts.vault_index import file_fingerprint
+
+default_debounce = 0.2
+default_max_delay = 2.0
+default_poll_interval = 2.0
+
+# Notes walked between checks for a request, see `between_requests`
+walk_chunk = 500
+
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+watch_mask = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+
+# struct inotify_event without its trailing name
+event_header = struct.Struct('iIII')
+
+class ChangeBatch:
+    """
+    paths - notes created, modified, deleted or renamed
+    dirs - vault relative folders created, deleted or renamed, every note
+        under them is re-checked
+    rescan - events were lost, the whole vault has to be re-checked
+    """
+    def __init__(self):
+        self.paths = set()
+        self.dirs = set()
+        self.rescan = False
+
+    def __bool__(self):
+        return bool(self.paths or self.dirs or self.rescan)
+
+def between_requests(items, idle=None, max_wait=0.05):
+    """
+    items, waiting before every `walk_chunk` of them until `idle` (a
+    threading.Event set while no request is handled) is set, at most
+    max_wait seconds. A walk in a background thread then mostly runs
+    between requests instead of taking the GIL from them.
+    """
+    for i, item in enumerate(items):
+        if idle is not None and not i % walk_chunk:
+            idle.wait(max_wait)
+        yield item
+
+class Watcher:
+    """
+    Events are added to `pending` by `collect`, from any thread
+
+    idle - optional threading.Event, see `between_requests`
+    """
+    def __init__(self, vault_path, ignore_rules=None):
+        self.vault_path = vault_path
+        self.ignore_rules = ignore_rules if ignore_rules is not None else get_ignore_rules(vault_path)
+        self.pending = ChangeBatch()
+        self.lock = threading.Lock()
+        self.idle = None
+
+    def take(self):
+        """
+        The changes collected so far, as a batch of their own
+        """
+        with self.lock:
+            batch, self.pending = self.pending, ChangeBatch()
+        return batch
+
+    def collect_pending(self):
+        """
+        Add the events that are already in, before a request
+        """
+        self.collect(0)
+
+    def close(self):
+        pass
+
+class InotifyWatcher(Watcher):
+    """
+    One inotify watch per folder walked, folders created or moved in later
+    get theirs as their events come in
+    """
+    def __init__(self, vault_path, ignore_rules=None):
+        import ctypes
+
+        super().__init__(vault_path, ignore_rules)
+        self.is_ignored = make_is_ignored(self.ignore_rules)
+        self.watches = {} # wd: (dir_path, rel_dir)
+
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError(f"inotify isn't available on {sys.platform}")
+        self.get_errno = ctypes.get_errno
+
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(self.get_errno(), os.strerror(self.get_errno()))
+        try:
+            self.add_watches('')
+        except OSError:
+            self.close()
+            raise
+
+    def add_watch(self, dir_path, rel_dir):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dir_path), watch_mask)
+        if wd < 0:
+            error = self.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                # Gone again already, its delete event follows
+                return
+            # ENOSPC is running out of `max_user_watches`
+            raise OSError(error, f"could not watch {dir_path}: {os.strerror(error)}")
+        self.watches[wd] = (dir_path, rel_dir)
+
+    def add_watches(self, rel_dir):
+        for _ in walk_vault(self.vault_path, self.ignore_rules, rel_dir=rel_dir, on_dir=self.add_watch):
+            pass
+
+    def remove_watches(self, rel_prefix):
+        for wd, (_, rel_dir) in list(self.watches.items()):
+            if rel_dir.startswith(rel_prefix):
+                # Fails harmlessly for folders already deleted
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.watches[wd]
+
+    def collect(self, timeout):
+        """
+        Add events arriving within timeout seconds to `pending`, returns
+        whether any of them were about notes
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+
+        added = False
+        with self.lock:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                # Read by another thread in between
+                return False
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = event_header.unpack_from(data, offset)
+                offset += event_header.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                if self.add_event(self.pending, wd, mask, name):
+                    added = True
+        return added
+
+    def add_event(self, batch, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            batch.rescan = True
+            return True
+        if mask & IN_IGNORED:
+            # Watched folder deleted or moved away
+            self.watches.pop(wd, None)
+            return False
+
+        watch = self.watches.get(wd)
+        if watch is None or not name or name.startswith('.'):
+            return False
+        dir_path, rel_dir = watch
+        rel_path = rel_dir + name
+
+        if mask & IN_ISDIR:
+            if name in default_ignored_dirs or self.is_ignored(rel_path):
+                return False
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self.add_watches(rel_path)
+            else:
+                self.remove_watches(rel_path + '/')
+            batch.dirs.add(rel_path)
+            return True
+
+        if not name.endswith('.md') or self.is_ignored(rel_path):
+            return False
+        batch.paths.add(os.path.join(dir_path, name))
+        return True
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+class PollingWatcher(Watcher):
+    """
+    Walks the vault every `interval` seconds, notes whose fingerprint
+    changed, appeared or disappeared since the last walk are the events
+    """
+    def __init__(self, vault_path, ignore_rules=None, interval=default_poll_interval):
+        super().__init__(vault_path, ignore_rules)
+        self.interval = interval
+        self.fingerprints = self.scan()
+        self.next_poll = time.monotonic() + interval
+
+    def collect_pending(self):
+        # A poll walks the whole vault, left to the watcher thread
+        pass
+
+    def scan(self):
+        return dict(
+            (filename, file_fingerprint(stat_result))
+            for filename, stat_result in between_requests(walk_vault(self.vault_path, self.ignore_rules), self.idle))
+
+    def collect(self, timeout):
+        wait = self.next_poll - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return False
+        time.sleep(max(wait, 0))
+
+        with self.lock:
+            if time.monotonic() < self.next_poll:
+                # Polled by another thread in between
+                return False
+            self.next_poll = time.monotonic() + self.interval
+
+        # Without the lock, `take` doesn't wait for the walk
+        fingerprints = self.scan()
+        with self.lock:
+            old_fingerprints, self.fingerprints = self.fingerprints, fingerprints
+            changed = [filename for filename, fingerprint in self.fingerprints.items()
+                       if old_fingerprints.get(filename) != fingerprint]
+            changed.extend(filename for filename in old_fingerprints if filename not in self.fingerprints)
+            self.pending.paths.update(changed)
+        return bool(changed)
+
+def get_watch_mode():
+    """
+    `watch` workflow variable: `1` (default) for inotify where available and
+    polling elsewhere, `poll` to always poll, `0` to not watch
+    """
+    mode = os.environ.get('watch', '1').strip().lower()
+    if mode in ('0', 'off'):
+        return None
+    if mode == 'poll':
+        return 'poll'
+    return 'auto'
+
+def get_poll_interval():
+    interval = os.environ.get('watch_interval')
+    return float(interval) if interval else default_poll_interval
+
+def open_watcher(vault_path, ignore_rules=None, mode='auto'):
+    """
+    InotifyWatcher if mode is `auto` and it can be set up, else PollingWatcher
+    """
+    if mode == 'auto':
+        try:
+            return InotifyWatcher(vault_path, ignore_rules)
+        except OSError as e:
+            if sys.platform.startswith('linux'):
+                sys.stderr.write(f"Warning - could not watch the vault with inotify, polling it instead: {e}")
+    return PollingWatcher(vault_path, ignore_rules, interval=get_poll_interval())
+
+def next_batch(watcher, stop_event=None, debounce=default_debounce, max_delay=default_max_delay, timeout=0.5):
+    """
+    Blocks until the first change, then keeps collecting changes until none
+    came for `debounce` seconds or `max_delay` passed, and takes them.
+    Returns None once stop_event is set, checked every `timeout` seconds.
+
+    The batch is empty if another thread took the changes first.
+    """
+    while not watcher.collect(timeout):
+        if stop_event is not None and stop_event.is_set():
+            return None
+
+    first = time.monotonic()
+    while True:
+        remaining = first + max_delay - time.monotonic()
+        if remaining <= 0 or not watcher.collect(min(debounce, remaining)):
+            return watcher.take()
+
+def resolve_batch(vault_path, batch, indexed, ignore_rules=None):
+    """
+    (notes, removed) for a batch, the input of `vault_index.apply_changes`:
+    (filename, stat_result) of the notes that exist now and filenames of
+    the ones that are gone.
+
+    indexed - filenames currently indexed, to find notes of removed folders
+    """
+    notes = []
+    removed = []
+    for filename in batch.paths:
+        try:
+            notes.append((filename, os.stat(filename)))
+        except OSError:
+            removed.append(filename)
+
+    for rel_dir in batch.dirs:
+        dir_notes = list(walk_vault(vault_path, ignore_rules, rel_dir=rel_dir))
+        notes.extend(dir_notes)
+
+        prefix = os.path.join(vault_path, rel_dir, '')
+        existing = set(filename for filename, _ in dir_notes)
+        removed.extend(
+            filename for filename in indexed
+            if filename.startswith(prefix) and filename not in existing)
+
+    return notes, removed
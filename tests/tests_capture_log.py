@@ -0,0 +1,163 @@
+import unittest
+from unittest import mock
+from scripts.utils import write_to_path, read_daily_note, modify_note
+from scripts import capture_log
+from scripts.capture_log import capture, compact, get_log_path, load_state
+import os
+import shutil
+import datetime
+import threading
+from freezegun import freeze_time
+
+
+class Crash(Exception):
+    pass
+
+
+class TestCaptureLog(unittest.TestCase):
+    config_vault_path = 'test_notes/'
+
+    def setUp(self) -> None:
+        os.environ['daily_note_format'] = "%Y-%m-%d"
+        write_to_path('test_notes/.obsidian/daily-notes.json', '{"template": ""}')
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        # Delete and recreate as empty note vault
+        shutil.rmtree('test_notes/')
+        os.makedirs('test_notes/')
+
+        return super().tearDown()
+
+    def read_note(self, day):
+        with open(f'test_notes/{day}.md', 'r') as fh:
+            return fh.read()
+
+    def test_capture_and_compact(self):
+        with freeze_time("2023-01-01"):
+            capture(self.config_vault_path, '## Todo', '- first')
+            capture(self.config_vault_path, '## Ideas', '- idea')
+        with freeze_time("2023-01-02"):
+            capture(self.config_vault_path, '## Todo', '- next day')
+            capture(self.config_vault_path, '## Todo', '- second')
+
+        # Nothing written to notes until compaction
+        assert not os.path.exists('test_notes/2023-01-01.md')
+
+        assert compact(self.config_vault_path) == 4
+
+        day_1 = self.read_note('2023-01-01').split('\n')
+        assert '- first' in day_1 and '- idea' in day_1
+        assert '- next day' not in day_1
+
+        day_2 = self.read_note('2023-01-02').split('\n')
+        assert day_2.index('- next day') + 1 == day_2.index('- second')
+
+        assert not os.path.exists(get_log_path(self.config_vault_path))
+        assert compact(self.config_vault_path) == 0
+
+    @freeze_time("2023-01-01")
+    def test_crash_before_note_replaced(self):
+        capture(self.config_vault_path, '## Todo', '- first')
+
+        def crashing_write(*args, before_replace=None, **kwargs):
+            def crash(tmp_path):
+                before_replace(tmp_path)
+                raise Crash()
+            return modify_note(*args, before_replace=crash, **kwargs)
+
+        with mock.patch.object(capture_log, 'modify_note', crashing_write):
+            with self.assertRaises(Crash):
+                compact(self.config_vault_path)
+
+        assert '- first' not in read_daily_note(self.config_vault_path)
+        assert load_state(self.config_vault_path)['pending'] is not None
+
+        # Captured while the compaction was broken
+        capture(self.config_vault_path, '## Todo', '- second')
+
+        assert compact(self.config_vault_path) == 1
+        assert compact(self.config_vault_path) == 1
+
+        lines = read_daily_note(self.config_vault_path).split('\n')
+        assert lines.count('- first') == 1
+        assert lines.count('- second') == 1
+
+    @freeze_time("2023-01-01")
+    def test_crash_after_note_replaced(self):
+        capture(self.config_vault_path, '## Todo', '- first')
+
+        def crashing_write(*args, **kwargs):
+            modify_note(*args, **kwargs)
+            raise Crash()
+
+        with mock.patch.object(capture_log, 'modify_note', crashing_write):
+            with self.assertRaises(Crash):
+                compact(self.config_vault_path)
+
+        assert '- first' in read_daily_note(self.config_vault_path)
+
+        # Recovery sees the write happened and doesn't apply it again
+        assert compact(self.config_vault_path) == 0
+        assert read_daily_note(self.config_vault_path).split('\n').count('- first') == 1
+        assert not os.path.exists(get_log_path(self.config_vault_path, capture_log.compacting_file_name))
+
+    def test_torn_line(self):
+        day = datetime.datetime(2023, 1, 1, 12)
+        capture(self.config_vault_path, '## Todo', '- first', capture_time=day)
+        # A capture killed mid write
+        with open(get_log_path(self.config_vault_path), 'a') as f:
+            f.write('{"id": "torn", "ts"')
+        capture(self.config_vault_path, '## Todo', '- second', capture_time=day)
+
+        assert compact(self.config_vault_path) == 2
+        lines = self.read_note('2023-01-01').split('\n')
+        assert '- first' in lines and '- second' in lines
+
+    def test_compact_when_quiet(self):
+        day = datetime.datetime(2023, 1, 1, 12)
+        capture(self.config_vault_path, '## Todo', '- first', capture_time=day)
+
+        # Another compactor is waiting, it gets the capture
+        fd = capture_log.try_lock(get_log_path(self.config_vault_path, capture_log.waiting_lock_file_name))
+        assert capture_log.compact_when_quiet(self.config_vault_path, delay=0.1) == 0
+        with mock.patch('subprocess.Popen') as popen:
+            capture_log.compact_soon(self.config_vault_path)
+        assert not popen.called
+        os.close(fd)
+
+        # No daemon, a compactor is started
+        with mock.patch('subprocess.Popen') as popen:
+            capture_log.compact_soon(self.config_vault_path)
+        assert popen.call_args[0][0][-2:] == ['compact', '--wait']
+
+        assert capture_log.compact_when_quiet(self.config_vault_path, delay=0.1) == 1
+        assert '- first' in self.read_note('2023-01-01').split('\n')
+
+    def test_concurrent_compaction(self):
+        day = datetime.datetime(2023, 1, 1, 12)
+        for i in range(300):
+            capture(self.config_vault_path, '## Todo', f'- item {i}', capture_time=day)
+
+        errors = []
+        counts = []
+        def run():
+            try:
+                counts.append(compact(self.config_vault_path))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        assert sum(counts) == 300
+        lines = self.read_note('2023-01-01').split('\n')
+        assert all(lines.count(f'- item {i}') == 1 for i in range(300))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+from scripts.utils import write_to_path, read_daily_note
+from scripts.capture_tabs import format_tab, get_front_window_tabs, capture_tabs
+import os
+import json
+import shutil
+from unittest import mock
+from freezegun import freeze_time
+
+
+class TestCaptureTabs(unittest.TestCase):
+    config_vault_path = 'test_notes/'
+
+    def setUp(self) -> None:
+        os.environ['daily_note_format'] = "%Y-%m-%d"
+        write_to_path(os.path.join(self.config_vault_path, '.obsidian/daily-notes.json'), '{"template": ""}')
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        # Delete and recreate as empty note vault
+        shutil.rmtree('test_notes/')
+        os.makedirs('test_notes/')
+
+        return super().tearDown()
+
+    def osascript(self, tabs):
+        return mock.patch('subprocess.check_output', return_value=json.dumps(tabs).encode())
+
+    def test_format_tab(self):
+        assert format_tab('https://python.org', 'Python') == '- [Python](https://python.org)'
+        # Brackets don't end the link text
+        assert format_tab('https://a.com', '[PR] Fix [x]') == r'- [\[PR\] Fix \[x\]](https://a.com)'
+        assert format_tab('https://a.com', r'a\b') == r'- [a\\b](https://a.com)'
+        # Parentheses and spaces don't end the target
+        assert format_tab('https://en.wikipedia.org/wiki/Python_(language)', 'Python') == \
+            '- [Python](<https://en.wikipedia.org/wiki/Python_(language)>)'
+        assert format_tab('file:///My Notes/a.pdf', 'a') == '- [a](<file:///My Notes/a.pdf>)'
+
+    def test_get_front_window_tabs(self):
+        with self.osascript([['https://python.org', 'Python']]) as check_output:
+            assert get_front_window_tabs() == [('https://python.org', 'Python')]
+            assert 'tab.title()' in check_output.call_args[0][0][-1]
+        with self.osascript([]) as check_output:
+            assert get_front_window_tabs('Safari') == []
+            assert 'tab.name()' in check_output.call_args[0][0][-1]
+
+    @freeze_time("2023-01-01")
+    def test_capture_tabs(self):
+        tabs = [
+            ['https://python.org', 'Python'],
+            ['https://en.wikipedia.org/wiki/Python_(language)', 'Python [language]'],
+        ]
+        with self.osascript(tabs):
+            assert capture_tabs(self.config_vault_path, get_front_window_tabs()) == 2
+        content = read_daily_note(self.config_vault_path)
+        assert content.split('## Bookmarks\n')[1].split('\n\n## ')[0] == (
+            '\n- [Python](https://python.org)\n'
+            r'- [Python \[language\]](<https://en.wikipedia.org/wiki/Python_(language)>)')
+
+
+if __name__ == '__main__':
+    unittest.main()
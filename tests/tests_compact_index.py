@@ -0,0 +1,133 @@
+import unittest
+from scripts.utils import write_to_path, tree_schema, get_headers_index
+from scripts.compact_index import CompactIndex
+from scripts.trigram_index import TrigramIndex
+from scripts.tree_query import iter_scan_order
+from scripts.vault_index import get_cached_index, get_headers_by_path, get_mtimes_by_path
+from scripts.note_parser import parse_document
+from scripts.vault_walk import walk_vault
+import os
+import shutil
+
+
+class TestCompactIndex(unittest.TestCase):
+    config_vault_path = 'test_notes/'
+
+    def setUp(self) -> None:
+        file_mapper = {
+            'code.python.snippets.md': '# Python\n\n## Datetime\n```\n# not a header\n```\n\n## Os walk\n',
+            'code.sql.lib.foobar.md': '## SQL\n',
+            'empty.md': 'no headers',
+            'Daily/2023-01-01.md': '## Todo\n\n- a\n\n## Ideas\n',
+            'Daily/2023-01-02.md': '## Todo\n\n## Ideas\n\n- ünïcode\n',
+            'Daily/Old/2022-12-31.md': '## Todo\n\n## Ideas\n',
+        }
+
+        for fname, contents in file_mapper.items():
+            write_to_path(os.path.join(self.config_vault_path, fname), contents)
+
+        self.filenames = [filename for filename, _ in walk_vault(self.config_vault_path)]
+        self.headers_index = get_headers_index(self.filenames)
+
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        # Delete and recreate as empty note vault
+        shutil.rmtree('test_notes/')
+        os.makedirs('test_notes/')
+
+        return super().tearDown()
+
+    def test_same_as_dict(self):
+        compact = CompactIndex.from_headers_index(self.config_vault_path, self.headers_index)
+
+        assert len(compact) == len(self.headers_index)
+        assert list(compact) == list(self.headers_index)
+        assert list(compact.items()) == list(self.headers_index.items())
+        assert dict(compact) == self.headers_index
+        assert compact['test_notes/Daily/2023-01-02.md'] == ['## Todo', '## Ideas']
+        assert 'test_notes/missing.md' not in compact
+
+        # Folders and repeated headers are stored once
+        assert len(compact.folders) == 3
+        assert compact.header_count() == 10
+        assert len(compact.texts) == 6
+
+        assert not compact.has_positions()
+        assert compact.positions('test_notes/code.sql.lib.foobar.md') == [('## SQL', 2, None, None)]
+
+    def test_positions(self):
+        compact = CompactIndex.from_notes(self.config_vault_path, self.filenames)
+        assert dict(compact) == self.headers_index
+        assert compact.has_positions()
+
+        for filename in self.filenames:
+            with open(filename, 'rb') as f:
+                document = parse_document(f.read())
+            assert compact.positions(filename) == [
+                (section.header, section.level, section.line, section.offset) for section in document.sections]
+
+        assert compact.positions('test_notes/code.python.snippets.md') == [
+            ('# Python', 1, 0, 0), ('## Datetime', 2, 2, 10), ('## Os walk', 2, 7, 46)]
+
+    def test_search(self):
+        compact = CompactIndex.from_headers_index(self.config_vault_path, self.headers_index)
+        mtimes = dict((filename, i) for i, filename in enumerate(self.headers_index))
+
+        for query in ['python:datetime', 'daily/*:todo', '*:', 'nomatch:todo']:
+            for limit in [None, 2]:
+                for kwargs in [{}, {'mtimes': mtimes}]:
+                    assert tree_schema(self.config_vault_path, query, headers_index=compact, limit=limit, **kwargs) == \
+                        tree_schema(self.config_vault_path, query, headers_index=self.headers_index, limit=limit, **kwargs)
+
+        fuzzy_index = TrigramIndex.from_headers_index(compact)
+        assert fuzzy_index.search('pyhton:datetmie') == [('test_notes/code.python.snippets.md', '## Datetime')]
+
+    def test_updates(self):
+        files = get_cached_index(self.config_vault_path)
+        headers_index = get_headers_by_path(self.config_vault_path, files)
+        mtimes = get_mtimes_by_path(self.config_vault_path, files)
+        compact = CompactIndex.from_files(self.config_vault_path, files)
+        assert dict(compact) == headers_index
+        assert dict(compact.mtimes()) == mtimes
+
+        # Same as assigning to / deleting from the dicts
+        for filename, headers, mtime in [
+                ('test_notes/Daily/2023-01-01.md', ['## Todo', '## New'], 5),
+                ('test_notes/New/note.md', ['# New note'], 7)]:
+            compact.set_note(filename, headers, mtime)
+            headers_index[filename] = headers
+            mtimes[filename] = mtime
+        compact.remove_note('test_notes/empty.md')
+        del headers_index['test_notes/empty.md']
+        del mtimes['test_notes/empty.md']
+
+        assert len(compact) == len(headers_index)
+        assert dict(compact) == headers_index
+        assert dict(compact.mtimes()) == mtimes
+        assert 'test_notes/empty.md' not in compact
+        assert [(filename, list(headers)) for filename, headers in iter_scan_order(compact, compact.mtimes())] == \
+            list(iter_scan_order(headers_index, mtimes))
+
+        for query in ['daily/*:new', 'new', '*:todo']:
+            assert tree_schema(self.config_vault_path, query, headers_index=compact, mtimes=compact.mtimes()) == \
+                tree_schema(self.config_vault_path, query, headers_index=headers_index, mtimes=mtimes)
+
+        assert not compact.needs_rebuild()
+        for _ in range(1001):
+            compact.set_note('test_notes/New/note.md', ['# New note'], 7)
+        assert compact.needs_rebuild()
+        assert dict(compact) == headers_index
+
+    def test_mtimes_line_up(self):
+        # Built without mtimes, a note set later still gets its own
+        compact = CompactIndex.from_headers_index(self.config_vault_path, self.headers_index)
+        compact.set_note('test_notes/New/note.md', ['# New note'], 7)
+        compact.add_note('test_notes/New/other.md', [('# Other', 1, None, None)])
+        assert compact.mtimes()['test_notes/New/note.md'] == 7
+        assert compact.mtimes()['test_notes/New/other.md'] == 0
+        assert compact.mtimes()['test_notes/empty.md'] == 0
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,267 @@
+import unittest
+from scripts.utils import write_to_path, tree_schema, read_daily_note
+from scripts.daemon import VaultServer
+from scripts import client
+import os
+import sys
+import shutil
+import socket
+import datetime
+import threading
+from unittest import mock
+from freezegun import freeze_time
+
+
+class TestDaemon(unittest.TestCase):
+    config_vault_path = 'test_notes/'
+
+    def setUp(self) -> None:
+        os.environ['daily_note_format'] = "%Y-%m-%d"
+
+        file_mapper = {
+            'code.python.snippets.md': '## Datetime\n\n## Os walk',
+            'code.sql.lib.foobar.md': '## SQL\n',
+            '.obsidian/daily-notes.json': '{"template": ""}',
+        }
+
+        for fname, contents in file_mapper.items():
+            fpath = os.path.join(self.config_vault_path, fname)
+            write_to_path(fpath, contents)
+
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        # Stop the daemon and its vault watcher first
+        self.doCleanups()
+
+        # Delete and recreate as empty note vault
+        shutil.rmtree('test_notes/')
+        os.makedirs('test_notes/')
+
+        return super().tearDown()
+
+    def start_server(self, watch=None):
+        server = VaultServer(self.config_vault_path, watch=watch)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+        def stop():
+            server.shutdown()
+            server.server_close()
+            thread.join()
+        self.addCleanup(stop)
+
+        return server
+
+    def test_no_daemon(self):
+        ok, result = client.call_daemon(self.config_vault_path, 'ping')
+        assert not ok
+
+        # Falls back to in process search
+        out = client.tree_schema(self.config_vault_path, 'python:datetime')
+        assert out == tree_schema(self.config_vault_path, 'python:datetime')
+
+    def test_search(self):
+        self.start_server()
+
+        ok, result = client.call_daemon(self.config_vault_path, 'ping')
+        assert ok and result
+
+        out = client.tree_schema(self.config_vault_path, 'python:datetime')
+        assert len(out) == 1
+        assert out == tree_schema(self.config_vault_path, 'python:datetime')
+
+        # New notes are picked up without restarting
+        write_to_path('test_notes/code.python.lib.pandas.md', '## Add a column\n')
+        out = client.tree_schema(self.config_vault_path, 'python')
+        assert len(out) == 3
+
+    def test_fuzzy_search(self):
+        self.start_server()
+
+        out = client.tree_schema(self.config_vault_path, 'pyhton:datetmie', fuzzy=True)
+        assert [x['title'] for x in out] == ['code.python.snippets.md:## Datetime']
+
+        # The trigram index follows note changes
+        write_to_path('test_notes/code.python.lib.pandas.md', '## Add a column\n')
+        out = client.tree_schema(self.config_vault_path, 'pandsa:add colum', fuzzy=True)
+        assert [x['title'] for x in out] == ['code.python.lib.pandas.md:## Add a column']
+
+    def test_query_cache_stats(self):
+        self.start_server()
+
+        for query in ['python:d', 'python:da', 'python:da']:
+            client.tree_schema(self.config_vault_path, query)
+        ok, stats = client.call_daemon(self.config_vault_path, 'stats')
+        assert stats['query_cache'] == {'hits': 1, 'refined': 1, 'misses': 1, 'size': 2}
+
+        # Index changes start a new generation
+        write_to_path('test_notes/code.python.lib.pandas.md', '## Add a column\n')
+        assert len(client.tree_schema(self.config_vault_path, 'python:da')) == 1
+        ok, stats = client.call_daemon(self.config_vault_path, 'stats')
+        assert stats['query_cache']['misses'] == 2
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'inotify is Linux only')
+    def test_watch(self):
+        self.start_server(watch='auto')
+
+        assert len(client.tree_schema(self.config_vault_path, 'python')) == 2
+        assert len(client.search_text(self.config_vault_path, 'walk')) == 1
+        assert client.find_url(self.config_vault_path, 'https://pandas.pydata.org') == []
+        ok, stats = client.call_daemon(self.config_vault_path, 'stats')
+        assert stats['watcher'] == 'InotifyWatcher'
+
+        # Changes come from the watcher from now on, without a sweep
+        with mock.patch('scripts.daemon.walk_vault', side_effect=AssertionError('swept the vault')):
+            write_to_path('test_notes/code.python.lib.pandas.md', '## Add a column\n- [docs](https://pandas.pydata.org/)\n')
+            os.remove('test_notes/code.sql.lib.foobar.md')
+
+            assert len(client.tree_schema(self.config_vault_path, 'python')) == 3
+            assert client.tree_schema(self.config_vault_path, 'sql') == []
+            out = client.search_text(self.config_vault_path, 'column')
+            assert [x['rel_path'] for x in out] == ['code.python.lib.pandas.md']
+            assert client.search_text(self.config_vault_path, 'sql') == []
+            out = client.find_url(self.config_vault_path, 'https://pandas.pydata.org')
+            assert [(x['rel_path'], x['line_num']) for x in out] == [('code.python.lib.pandas.md', 1)]
+
+    def test_search_text(self):
+        self.start_server()
+
+        out = client.search_text(self.config_vault_path, 'walk')
+        assert [x['rel_path'] for x in out] == ['code.python.snippets.md']
+
+    @freeze_time("2023-01-01")
+    def test_append(self):
+        self.start_server()
+
+        daily_path = client.create_daily_note(self.config_vault_path)
+        assert os.path.exists(daily_path)
+
+        client.append_to_daily_vault(self.config_vault_path, '## Todo', '- a thing')
+        assert '- a thing' in read_daily_note(self.config_vault_path).split('\n')
+
+        with self.assertRaises(ValueError):
+            client.append_to_daily_vault(self.config_vault_path, '## Missing', '- a thing')
+
+        # Already saved today, the daemon's url index has it
+        written = client.append_to_daily_vault(
+            self.config_vault_path, '## Bookmarks', '- [a](https://example.com)', duplicate_urls='skip')
+        assert written == [('## Bookmarks', '- [a](https://example.com)')]
+        written = client.append_to_daily_vault(
+            self.config_vault_path, '## Bookmarks', '- [a](https://example.com/)', duplicate_urls='skip')
+        assert written == []
+
+    def test_compact_soon(self):
+        from scripts import capture_log
+        server = self.start_server()
+
+        with mock.patch.object(capture_log, 'compact_delay', 0.2):
+            for text in ['- first', '- second']:
+                capture_log.capture(self.config_vault_path, '## Todo', text)
+                capture_log.compact_soon(self.config_vault_path)
+            # Debounced, one compaction for the burst
+            server.state.compact_timer.join(5.0)
+
+        lines = read_daily_note(self.config_vault_path).split('\n')
+        assert '- first' in lines and '- second' in lines
+        assert not os.path.exists(capture_log.get_log_path(self.config_vault_path))
+
+    def test_daily_sections(self):
+        write_to_path('test_notes/2023-01-01.md', '## Journal\n- first day\n')
+        write_to_path('test_notes/2023-01-03.md', '## Todo\n\n## Journal\n- third day\n')
+        server = self.start_server()
+        # Warmed up like `serve` does
+        with server.state.lock:
+            server.state.get_headers_index()
+
+        out = client.daily_sections(
+            self.config_vault_path, '## Journal', datetime.date(2023, 1, 1), datetime.date(2023, 1, 31))
+        assert [(x['date'], x['text']) for x in out] == [('2023-01-01', '- first day'), ('2023-01-03', '- third day')]
+
+        # The daemon only sends where the sections are, the client reads them
+        ok, locations = client.call_daemon(
+            self.config_vault_path, 'daily_sections', {'header': '## Journal', 'start': '2023-01-01', 'end': '2023-01-31'})
+        assert ok and [(date, rel_path, span) for date, _, rel_path, span, _ in locations] == [
+            ('2023-01-01', '2023-01-01.md', [0, 23]), ('2023-01-03', '2023-01-03.md', [9, 32])]
+
+        out = client.daily_sections(
+            self.config_vault_path, '## Journal', datetime.date(2023, 1, 1), datetime.date(2023, 1, 31), max_bytes=5)
+        assert [x['text'] for x in out] == ['- fir…', '- thi…']
+
+    def test_stale_socket(self):
+        # Socket file left behind with nobody listening
+        socket_path = client.get_socket_path(self.config_vault_path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(socket_path)
+        sock.close()
+        assert os.path.exists(socket_path)
+
+        ok, _ = client.call_daemon(self.config_vault_path, 'ping')
+        assert not ok
+
+        # A new daemon replaces it
+        self.start_server()
+        ok, _ = client.call_daemon(self.config_vault_path, 'ping')
+        assert ok
+
+    def test_already_running(self):
+        self.start_server()
+        with self.assertRaises(ValueError):
+            VaultServer(self.config_vault_path)
+
+        # The running daemon keeps its socket
+        ok, _ = client.call_daemon(self.config_vault_path, 'ping')
+        assert ok
+
+    def fake_daemon(self, answer):
+        """
+        Listens on the vault's socket, reads one request and sends `answer`
+        (None to hang until the client gives up) then hangs up
+        """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(client.get_socket_path(self.config_vault_path))
+        sock.listen()
+        # Don't wait forever on a test that failed before connecting
+        sock.settimeout(5)
+        done = threading.Event()
+
+        def serve():
+            try:
+                conn, _ = sock.accept()
+            except OSError:
+                return
+            conn.recv(65536)
+            if answer is None:
+                done.wait()
+            else:
+                conn.sendall(answer)
+            conn.close()
+        thread = threading.Thread(target=serve, daemon=True)
+        thread.start()
+
+        def stop():
+            done.set()
+            thread.join()
+            sock.close()
+            os.remove(client.get_socket_path(self.config_vault_path))
+        self.addCleanup(stop)
+
+    def test_daemon_not_answering(self):
+        self.fake_daemon(None)
+        assert client.call_daemon(self.config_vault_path, 'ping', timeout=0.1) == (False, None)
+
+    def test_truncated_response(self):
+        self.fake_daemon(b'{"ok": true, "res')
+        # Falls back to running in process
+        out = client.search_text(self.config_vault_path, 'datetime')
+        assert [x['rel_path'] for x in out] == ['code.python.snippets.md']
+
+    def test_write_not_answered(self):
+        self.fake_daemon(b'')
+        # The daemon may have written it, not written again in process
+        with self.assertRaises(ValueError):
+            client.append_to_daily_vault(self.config_vault_path, '## Todo', '- once')
+
+
+if __name__ == '__main__':
+    unittest.main()
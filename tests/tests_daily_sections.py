@@ -0,0 +1,93 @@
+import unittest
+from scripts.utils import write_to_path
+from scripts.daily_sections import iter_sections, iter_markdown, map_bounded, parse_date_range
+from scripts.vault_index import get_cached_index
+from scripts import section_preview
+import os
+import shutil
+import datetime
+import itertools
+from unittest import mock
+
+
+class TestDailySections(unittest.TestCase):
+    config_vault_path = 'test_notes/'
+
+    def setUp(self) -> None:
+        os.environ['daily_note_format'] = "Daily/%Y-%m-%d"
+
+        file_mapper = {
+            'Daily/2023-01-01.md': '## Todo\n- [ ] a\n\n## Journal\n- first day\n\n## Ideas\n',
+            'Daily/2023-01-02.md': '## Journal\n\n## Ideas\n- no journal today\n',
+            'Daily/2023-01-04.md': '# Wed\n\n## Journal\n- ünïcode\n- two lines\n\n### Later\n- sub header\n',
+            'Daily/2023-01-05.md': '## Todo\n',
+            'Daily/2022-12-31.md': '## Journal\n- out of range\n',
+            'code.python.snippets.md': '## Journal\n- not a daily note\n',
+        }
+
+        for fname, contents in file_mapper.items():
+            write_to_path(os.path.join(self.config_vault_path, fname), contents)
+
+        self.start = datetime.date(2023, 1, 1)
+        self.end = datetime.date(2023, 1, 5)
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        # Delete and recreate as empty note vault
+        shutil.rmtree('test_notes/')
+        os.makedirs('test_notes/')
+
+        return super().tearDown()
+
+    def sections(self, **kwargs):
+        return [(x['date'], x['rel_path'], x['text'])
+                for x in iter_sections(self.config_vault_path, '## Journal', self.start, self.end, **kwargs)]
+
+    def test_iter_sections(self):
+        expected = [
+            ('2023-01-01', 'Daily/2023-01-01.md', '- first day'),
+            ('2023-01-04', 'Daily/2023-01-04.md', '- ünïcode\n- two lines'),
+        ]
+        assert self.sections() == expected
+        assert self.sections(workers=3) == expected
+        assert self.sections(max_bytes=5) == [
+            ('2023-01-01', 'Daily/2023-01-01.md', '- fir…'), ('2023-01-04', 'Daily/2023-01-04.md', '- ün…')]
+
+        # Read at the index's offsets, the notes aren't parsed
+        files = get_cached_index(self.config_vault_path)
+        with mock.patch.object(section_preview, 'find_span', side_effect=AssertionError('parsed the note')):
+            assert self.sections(files=files) == expected
+
+        # Changed since it was indexed
+        write_to_path('test_notes/Daily/2023-01-04.md', '## Journal\n- rewritten\n')
+        assert self.sections(files=files)[1] == ('2023-01-04', 'Daily/2023-01-04.md', '- rewritten')
+
+    def test_lazy(self):
+        # Only a few items are read ahead of the consumer
+        items = itertools.count()
+        assert list(itertools.islice(map_bounded(lambda x: x * 2, items, workers=2), 3)) == [0, 2, 4]
+        assert next(items) <= 8
+
+        entries = iter_sections(self.config_vault_path, '## Journal', self.start, datetime.date(9999, 1, 1))
+        assert next(entries)['date'] == '2023-01-01'
+
+    def test_markdown(self):
+        entries = iter_sections(self.config_vault_path, '## Journal', self.start, self.end)
+        assert ''.join(iter_markdown(entries, '## Journal')) == (
+            '### [[Daily/2023-01-01]]\n- first day\n\n'
+            '### [[Daily/2023-01-04]]\n- ünïcode\n- two lines\n\n')
+
+    def test_parse_date_range(self):
+        today = datetime.date(2023, 3, 15)
+        assert parse_date_range('90', today) == (datetime.date(2022, 12, 16), today)
+        assert parse_date_range('1', today) == (today, today)
+        assert parse_date_range('week', today) == (datetime.date(2023, 3, 13), today)
+        assert parse_date_range('month', today) == (datetime.date(2023, 3, 1), today)
+        assert parse_date_range('year', today) == (datetime.date(2023, 1, 1), today)
+        assert parse_date_range('2023-01-01..2023-01-31', today) == (datetime.date(2023, 1, 1), datetime.date(2023, 1, 31))
+        with self.assertRaises(ValueError):
+            parse_date_range('fortnight', today)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import unittest
+from scripts.utils import write_to_path
+from scripts.fulltext_index import open_index, update_index, search, search_vault, get_postings
+from scripts.vault_walk import walk_vault
+import os
+import shutil
+
+
+class TestFulltextIndex(unittest.TestCase):
+    config_vault_path = 'test_notes/'
+
+    def setUp(self) -> None:
+        file_mapper = {
+            'code.python.snippets.md': '## Datetime\n\nimport datetime\ndatetime.datetime.now()\n\n## Os walk\nos.walk(path)',
+            'code.sql.lib.foobar.md': '## SQL\nselect * from table\n',
+            'journal/2023-01-01.md': '## Journal\n\n- learned about python datetime today\n',
+            'empty.md': '',
+        }
+
+        for fname, contents in file_mapper.items():
+            write_to_path(os.path.join(self.config_vault_path, fname), contents)
+
+        self.conn = open_index(self.config_vault_path)
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        self.conn.close()
+        # Delete and recreate as empty note vault
+        shutil.rmtree('test_notes/')
+        os.makedirs('test_notes/')
+
+        return super().tearDown()
+
+    def get_notes(self):
+        return list(walk_vault(self.config_vault_path))
+
+    def test_postings(self):
+        postings, length = get_postings('Foo bar\nfoo\n\nbaz foo')
+        assert postings['foo'] == [3, [0, 1, 3]]
+        assert postings['bar'] == [1, [0]]
+        assert length == 5
+
+    def test_search_ranked_with_line(self):
+        assert update_index(self.conn, self.config_vault_path, self.get_notes()) == 4
+
+        out = search(self.conn, self.config_vault_path, 'datetime')
+        assert [x['rel_path'] for x in out] == ['code.python.snippets.md', os.path.join('journal', '2023-01-01.md')]
+        # First line containing the token
+        assert out[0]['line_num'] == 0
+        assert out[0]['line'] == '## Datetime'
+
+        out = search(self.conn, self.config_vault_path, 'python datetime')
+        assert out[0]['rel_path'] == os.path.join('journal', '2023-01-01.md')
+        # Line with the most query tokens
+        assert out[0]['line'] == '- learned about python datetime today'
+
+    def test_prefix_search(self):
+        update_index(self.conn, self.config_vault_path, self.get_notes())
+
+        out = search(self.conn, self.config_vault_path, 'sele')
+        assert [x['rel_path'] for x in out] == ['code.sql.lib.foobar.md']
+        assert search(self.conn, self.config_vault_path, 'nothingmatches') == []
+
+    def test_incremental_update(self):
+        update_index(self.conn, self.config_vault_path, self.get_notes())
+        assert update_index(self.conn, self.config_vault_path, self.get_notes()) == 0
+
+        write_to_path('test_notes/code.sql.lib.foobar.md', '## SQL\nselect datetime from table with joins\n')
+        os.remove('test_notes/empty.md')
+        assert update_index(self.conn, self.config_vault_path, self.get_notes()) == 2
+
+        out = search(self.conn, self.config_vault_path, 'joins')
+        assert [x['rel_path'] for x in out] == ['code.sql.lib.foobar.md']
+
+        # Old postings are gone, and so are terms no note has anymore
+        assert search(self.conn, self.config_vault_path, 'star') == []
+        assert self.conn.execute("SELECT COUNT(*) FROM terms WHERE token = 'select'").fetchone() == (1,)
+        assert self.conn.execute("SELECT COUNT(*) FROM terms WHERE df <= 0").fetchone() == (0,)
+
+    def test_invalid_utf8(self):
+        with open('test_notes/latin1.md', 'wb') as f:
+            f.write('## Caf\xe9\nmeeting notes\n'.encode('latin-1'))
+
+        assert update_index(self.conn, self.config_vault_path, self.get_notes()) == 5
+        out = search(self.conn, self.config_vault_path, 'meeting')
+        assert [(x['rel_path'], x['line']) for x in out] == [('latin1.md', 'meeting notes')]
+
+    def test_search_vault(self):
+        out = search_vault(self.config_vault_path, 'os walk')
+        assert out[0]['rel_path'] == 'code.python.snippets.md'
+        assert out[0]['line'] == '## Os walk'
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import unittest
+from scripts.utils import write_to_path, read_daily_note, append_to_daily_vault, get_daily_note_path, get_insertion
+from scripts.note_parser import parse_document, patch_document
+from scripts.note_snapshot import get_snapshot_path, snapshot_cache
+from scripts import utils, note_snapshot
+import os
+import shutil
+from unittest import mock
+from freezegun import freeze_time
+
+
+def dump(document):
+    return [
+        (section.header, section.level, section.line, section.offset, section.last_line, section.last_offset,
+         section.body_end_line, section.body_end_offset, section.end_line, section.end_offset,
+         section.parent.header if section.parent is not None else None, len(section.children))
+        for section in document.sections], document.line_count, document.size
+
+
+class TestNoteSnapshot(unittest.TestCase):
+    config_vault_path = 'test_notes/'
+
+    def setUp(self) -> None:
+        os.environ['daily_note_format'] = "%Y-%m-%d"
+        self.daily_content = '# Day\n\n## Todo\n\n## Journal\n- morning\n\n### Later\n\n## Bookmarks\n- [a](b)'
+
+        # Snapshot the small test notes too
+        patcher = mock.patch.object(note_snapshot, 'snapshot_min_bytes', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        snapshot_cache.clear()
+
+        # Delete and recreate as empty note vault
+        shutil.rmtree('test_notes/')
+        os.makedirs('test_notes/')
+
+        return super().tearDown()
+
+    def test_patch_document(self):
+        data = self.daily_content.encode('utf-8')
+        document = parse_document(data)
+
+        for header, text in [
+                ('## Todo', '- a'), ('## Journal', '- ünïcode\n- b'), ('### Later', '- c'),
+                ('## Bookmarks', '- [c](d)'), ('# Day', 'intro')]:
+            insertions = [get_insertion(data, header, text, document=document)]
+            new_data = utils.apply_insertions(data, insertions)
+            assert dump(patch_document(document, insertions, new_data)) == dump(parse_document(new_data))
+
+        # Several at once
+        insertions = utils.get_batch_insertions(data, [('## Todo', '- a'), ('## Bookmarks', '- b'), ('## Todo', '- c')])
+        new_data = utils.apply_insertions(data, insertions)
+        assert dump(patch_document(document, insertions, new_data)) == dump(parse_document(new_data))
+
+        # Inserted headers or code fences can change the header tree
+        for text in ['## New', '```\n# code']:
+            insertions = [get_insertion(data, '## Todo', text, document=document)]
+            assert patch_document(document, insertions, utils.apply_insertions(data, insertions)) is None
+
+    @freeze_time("2023-01-01")
+    def test_captures_reuse_snapshot(self):
+        daily_path = get_daily_note_path(self.config_vault_path)
+        write_to_path(daily_path, self.daily_content)
+
+        append_to_daily_vault(self.config_vault_path, '## Todo', '- first')
+        assert os.path.exists(get_snapshot_path(self.config_vault_path))
+
+        # Only the first capture parses the note, also from a fresh process
+        snapshot_cache.clear()
+        with mock.patch.object(utils, 'parse_document', side_effect=AssertionError('parsed the note')):
+            append_to_daily_vault(self.config_vault_path, '## Todo', '- second')
+            append_to_daily_vault(self.config_vault_path, '## Bookmarks', '- [c](d)')
+            append_to_daily_vault(self.config_vault_path, '### Later', '- third')
+
+        content = read_daily_note(self.config_vault_path)
+        assert content == (
+            '# Day\n\n## Todo\n\n- first\n- second\n\n## Journal\n- morning\n\n### Later\n\n- third\n\n'
+            '## Bookmarks\n- [a](b)\n- [c](d)')
+
+    @freeze_time("2023-01-01")
+    def test_changed_externally(self):
+        daily_path = get_daily_note_path(self.config_vault_path)
+        write_to_path(daily_path, self.daily_content)
+        append_to_daily_vault(self.config_vault_path, '## Todo', '- first')
+
+        # Edited in Obsidian, the snapshot no longer applies
+        write_to_path(daily_path, '## Todo\n- edited\n\n## Journal\n')
+        append_to_daily_vault(self.config_vault_path, '## Journal', '- second')
+        assert read_daily_note(self.config_vault_path) == '## Todo\n- edited\n\n## Journal\n\n- second\n'
+
+        # A new header is parsed into the snapshot
+        append_to_daily_vault(self.config_vault_path, '## Ideas', '- idea', create_header_if_missing=True)
+        with mock.patch.object(utils, 'parse_document', side_effect=AssertionError('parsed the note')):
+            append_to_daily_vault(self.config_vault_path, '## Ideas', '- another')
+        assert read_daily_note(self.config_vault_path) == \
+            '## Todo\n- edited\n\n## Journal\n\n- second\n\n## Ideas\n\n- idea\n- another\n'
+
+    def test_same_size_edit_in_racy_window(self):
+        daily_path = get_daily_note_path(self.config_vault_path)
+        write_to_path(daily_path, self.daily_content)
+        append_to_daily_vault(self.config_vault_path, '## Todo', '- first')
+
+        # Rewritten in place within the same mtime tick, the fingerprint can't tell
+        stat_result = os.stat(daily_path)
+        with open(daily_path, 'r+b') as f:
+            data = f.read().replace(b'- morning', b'## Ideas!')
+            f.seek(0)
+            f.write(data)
+        os.utime(daily_path, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns))
+
+        append_to_daily_vault(self.config_vault_path, '## Journal', '- second')
+        assert read_daily_note(self.config_vault_path) == (
+            '# Day\n\n## Todo\n\n- first\n\n## Journal\n\n- second\n\n## Ideas!\n\n### Later\n\n## Bookmarks\n- [a](b)')
+
+        # Not saved at all without the note's crc
+        snapshot_cache.clear()
+        os.remove(get_snapshot_path(self.config_vault_path))
+        fingerprint = utils.file_fingerprint(os.stat(daily_path))
+        note_snapshot.save_snapshot(self.config_vault_path, daily_path, fingerprint, parse_document(b''))
+        assert not os.path.exists(get_snapshot_path(self.config_vault_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+from scripts.utils import write_to_path, tree_schema
+from scripts.section_preview import read_section, get_span
+from scripts.vault_index import get_cached_index
+import os
+import shutil
+
+
+class TestSectionPreview(unittest.TestCase):
+    config_vault_path = 'test_notes/'
+
+    def setUp(self) -> None:
+        file_mapper = {
+            'code.python.snippets.md':
+                'Intro line\n\n# Python\n\n## Datetime\n\n- now()\n```\n# not a header\n```\n\n## Os walk\n- ünïcode\n',
+            'empty.md': '',
+        }
+
+        for fname, contents in file_mapper.items():
+            write_to_path(os.path.join(self.config_vault_path, fname), contents)
+
+        self.files = get_cached_index(self.config_vault_path)
+
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        # Delete and recreate as empty note vault
+        shutil.rmtree('test_notes/')
+        os.makedirs('test_notes/')
+
+        return super().tearDown()
+
+    def read(self, header, **kwargs):
+        entry = self.files['code.python.snippets.md']
+        return read_section(
+            'test_notes/code.python.snippets.md', header,
+            span=get_span(entry, header), fingerprint=entry['fp'], **kwargs)
+
+    def test_read_section(self):
+        entry = self.files['code.python.snippets.md']
+        assert entry['headers'] == ['# Python', '## Datetime', '## Os walk']
+        assert entry['spans'] == [[12, 22], [22, 67], [67, 90]]
+
+        assert self.read('## Datetime') == '- now()\n```\n# not a header\n```'
+        assert self.read('## Os walk') == '- ünïcode'
+        assert self.read('# Python') == ''
+        assert self.read('') == 'Intro line'
+        assert self.read('## Missing') == ''
+
+        # Cut to max_bytes, never in the middle of a character
+        assert self.read('## Datetime', max_bytes=4) == '- n…'
+        assert self.read('## Os walk', max_bytes=4) == '- ü…'
+        assert self.read('## Os walk', max_bytes=3) == '-…'
+
+        assert read_section('test_notes/empty.md', '## Datetime') == ''
+        assert read_section('test_notes/missing.md', '## Datetime') == ''
+
+    def test_changed_since_indexed(self):
+        # Spans and fingerprint are stale, the note is parsed again
+        write_to_path('test_notes/code.python.snippets.md', '## Os walk\nos.walk(path)\n\n## Datetime\n- today()\n')
+        assert self.read('## Datetime') == '- today()'
+        assert self.read('## Os walk') == 'os.walk(path)'
+
+    def test_tree_schema(self):
+        out = tree_schema(self.config_vault_path, 'python:datetime', previews=True)
+        assert len(out) == 1
+        assert out[0]['subtitle'] == 'code.python.snippets.md - - now() ``` # not a header ```'
+        assert out[0]['text']['largetype'] == '- now()\n```\n# not a header\n```'
+        assert out[0]['quicklookurl'] == 'test_notes/code.python.snippets.md'
+
+        # Same with a headers index in memory and no spans
+        headers_index = {'test_notes/code.python.snippets.md': ['# Python', '## Datetime', '## Os walk']}
+        assert tree_schema(self.config_vault_path, 'python:datetime', headers_index=headers_index, previews=True) == out
+
+        assert 'text' not in tree_schema(self.config_vault_path, 'python:datetime')[0]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,20 @@
+import unittest
+from benchmarks.bench_startup import \
+    entry_points, import_budgets_ms, forbidden_imports, get_import_times, get_entry_import_ms
+
+
+class TestStartup(unittest.TestCase):
+    def test_forbidden_imports(self):
+        for name, statement in entry_points.items():
+            imported = get_import_times(statement)
+            for module in forbidden_imports[name]:
+                assert module not in imported, f"`{name}` imports {module}"
+
+    def test_import_budget(self):
+        for name, budget_ms in import_budgets_ms.items():
+            import_ms = get_entry_import_ms(name, repeat=3)
+            assert import_ms <= budget_ms, f"`{name}` imports take {import_ms:.1f}ms, budget {budget_ms}ms"
+
+
+if __name__ == '__main__':
+    unittest.main()
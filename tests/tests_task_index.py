@@ -0,0 +1,99 @@
+import unittest
+from scripts.utils import write_to_path, read_daily_note, create_daily_note
+from scripts.task_index import open_index, update_index, get_open_tasks, get_tasks, get_note_date
+from scripts.vault_walk import walk_vault
+import os
+import datetime
+import shutil
+from unittest import mock
+from freezegun import freeze_time
+
+
+class TestTaskIndex(unittest.TestCase):
+    config_vault_path = 'test_notes/'
+
+    def setUp(self) -> None:
+        os.environ['daily_note_format'] = "%Y-%m-%d"
+
+        file_mapper = {
+            '2022-10-01.md': '## Todo\n- [ ] ancient\n',
+            '2022-12-29.md': '## Todo\n- [ ] a\n- [x] b\n- [ ] c\n\n## Journal\n- [ ] not a todo\n',
+            '2022-12-30.md': '# Day\n\n## Todo\n- [ ] a\n- [X] c\n  - [ ] d nested\n\n- [ ] e\n',
+            'projects/garden.md': '## Todo\n- [ ] buy seeds\n',
+        }
+
+        for fname, contents in file_mapper.items():
+            write_to_path(os.path.join(self.config_vault_path, fname), contents)
+
+        self.conn = open_index(self.config_vault_path)
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        self.conn.close()
+        os.environ.pop('carry_over_days', None)
+
+        # Delete and recreate as empty note vault
+        shutil.rmtree('test_notes/')
+        os.makedirs('test_notes/')
+
+        return super().tearDown()
+
+    def update(self):
+        return update_index(self.conn, self.config_vault_path, walk_vault(self.config_vault_path))
+
+    def open_tasks(self, **kwargs):
+        return [(x['text'], x['rel_path'], x['line_num']) for x in get_open_tasks(self.conn, self.config_vault_path, **kwargs)]
+
+    def test_get_tasks(self):
+        assert get_tasks(b'## Todo\n- [ ] a\n* [x] b\n- not a task\n- [ ]\n\n## Ideas\n- [ ] idea') == \
+            [(1, 'a', False), (2, 'b', True)]
+        assert get_tasks(b'## Ideas\n- [ ] idea') == []
+        assert get_tasks('## Todo\n\n- [ ] ünïcode\r\n'.encode('utf-8')) == [(2, 'ünïcode', False)]
+
+        assert get_note_date('2022-12-30.md', '%Y-%m-%d') == '2022-12-30'
+        assert get_note_date('Daily/2022-12-30.md', 'Daily/%Y-%m-%d.md') == '2022-12-30'
+        assert get_note_date('projects/garden.md', '%Y-%m-%d') is None
+
+    def test_open_tasks(self):
+        assert self.update() == 4
+        assert self.update() == 0
+
+        # Latest daily note decides, `c` was checked off on the 30th
+        assert self.open_tasks() == [
+            ('ancient', '2022-10-01.md', 1), ('a', '2022-12-30.md', 3),
+            ('d nested', '2022-12-30.md', 5), ('e', '2022-12-30.md', 7)]
+        assert self.open_tasks(before='2022-12-30', since='2022-12-01') == [('a', '2022-12-29.md', 1), ('c', '2022-12-29.md', 3)]
+
+        write_to_path('test_notes/2022-12-30.md', '## Todo\n- [x] a\n')
+        os.remove('test_notes/2022-10-01.md')
+        assert self.update() == 2
+        # `c` isn't in the 30th's note anymore, the 29th decides again
+        assert self.open_tasks() == [('c', '2022-12-29.md', 3)]
+
+        # Dates follow the daily note format
+        with mock.patch.dict(os.environ, {'daily_note_format': 'Daily/%Y-%m-%d'}):
+            assert self.update() == 3
+            assert self.open_tasks() == []
+
+    @freeze_time("2023-01-01")
+    def test_carry_over(self):
+        daily_path = create_daily_note(
+            self.config_vault_path, template_text='## Todo\n\n## Ideas\n', carry_over=True)
+        assert read_daily_note(self.config_vault_path) == \
+            '## Todo\n\n- [ ] a\n- [ ] d nested\n- [ ] e\n\n## Ideas\n'
+
+        # Tomorrow the same tasks come from today's note
+        write_to_path(daily_path, '## Todo\n\n- [x] a\n- [ ] d nested\n- [ ] e\n')
+        tomorrow = datetime.datetime(2023, 1, 2)
+        os.environ['carry_over_days'] = '0'
+        with open(create_daily_note(self.config_vault_path, note_date=tomorrow, template_text='', carry_over=True)) as f:
+            assert f.read() == '\n## Todo\n\n- [ ] ancient\n- [ ] d nested\n- [ ] e\n'
+
+        # Off by default
+        day_after = datetime.datetime(2023, 1, 3)
+        with open(create_daily_note(self.config_vault_path, note_date=day_after, template_text='## Todo\n')) as f:
+            assert f.read() == '## Todo\n'
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import unittest
+from scripts.utils import write_to_path, tree_schema, create_daily_note, append_to_daily_vault
+from scripts import tracing
+import io
+import os
+import json
+import time
+import shutil
+import contextlib
+from freezegun import freeze_time
+
+
+class TestTracing(unittest.TestCase):
+    config_vault_path = 'test_notes/'
+
+    def setUp(self) -> None:
+        os.environ['daily_note_format'] = "%Y-%m-%d"
+
+        file_mapper = {
+            'code.python.snippets.md': '## Datetime\n\n## Os walk',
+            'code.sql.lib.foobar.md': '## SQL\n',
+            '.obsidian/daily-notes.json': '{"template": ""}',
+        }
+
+        for fname, contents in file_mapper.items():
+            write_to_path(os.path.join(self.config_vault_path, fname), contents)
+            # Out of the index's racy window, so a warm index reads nothing
+            os.utime(os.path.join(self.config_vault_path, fname), (time.time() - 60, time.time() - 60))
+
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        os.environ.pop('trace', None)
+        # Delete and recreate as empty note vault
+        shutil.rmtree('test_notes/')
+        os.makedirs('test_notes/')
+
+        return super().tearDown()
+
+    def get_traces(self, func):
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            result = func()
+
+        traces = []
+        for line in stderr.getvalue().splitlines():
+            if line.startswith('{'):
+                traces.append(json.loads(line))
+        return result, traces
+
+    def test_disabled(self):
+        out, traces = self.get_traces(lambda: tree_schema(self.config_vault_path, 'python:datetime'))
+        assert len(out) == 1
+        assert traces == []
+        assert tracing.current is tracing.null_trace
+
+    def test_tree_schema(self):
+        os.environ['trace'] = '1'
+        out, traces = self.get_traces(lambda: tree_schema(self.config_vault_path, 'python:datetime'))
+        assert len(out) == 1
+
+        assert len(traces) == 1
+        trace = traces[0]
+        assert trace['op'] == 'tree_schema'
+        assert trace['args'] == {'query': 'python:datetime', 'limit': None}
+        assert set(trace['stages']) >= set(['index', 'walk', 'read', 'parse', 'save', 'match', 'items'])
+        assert trace['counters']['notes'] == 2
+        assert trace['counters']['reread'] == 2
+        assert trace['counters']['matches'] == 1
+        assert trace['counters']['results'] == 1
+
+        # Warm index, nothing re-read
+        _, traces = self.get_traces(lambda: tree_schema(self.config_vault_path, 'python:datetime'))
+        assert 'reread' not in traces[0]['counters']
+        assert tracing.current is tracing.null_trace
+
+    @freeze_time("2023-01-01")
+    def test_nested_calls(self):
+        os.environ['trace'] = '1'
+        _, traces = self.get_traces(lambda: create_daily_note(self.config_vault_path))
+        assert traces[0]['op'] == 'create_daily_note'
+        assert traces[0]['counters'] == {'created': 1}
+
+        # append_many_to_daily_vault is a stage of append_to_daily_vault
+        _, traces = self.get_traces(
+            lambda: append_to_daily_vault(self.config_vault_path, '## Todo', '- Foo the baz'))
+        assert len(traces) == 1
+        assert traces[0]['op'] == 'append_to_daily_vault'
+        assert set(['append_many_to_daily_vault', 'read', 'insertions', 'write']) <= set(traces[0]['stages'])
+        assert traces[0]['counters']['entries'] == 1
+        assert traces[0]['counters']['attempts'] == 1
+
+    def test_error(self):
+        os.environ['trace'] = '1'
+
+        def fail():
+            with tracing.traced('failing'):
+                raise ValueError('boom')
+
+        with self.assertRaises(ValueError):
+            self.get_traces(fail)
+        assert tracing.current is tracing.null_trace
+
+    def test_log_file_rotation(self):
+        log_path = os.path.join(self.config_vault_path, 'logs', 'trace.jsonl')
+        os.environ['trace'] = log_path
+
+        for _ in range(3):
+            tree_schema(self.config_vault_path, 'python:datetime')
+        with open(log_path) as f:
+            assert [json.loads(line)['op'] for line in f] == ['tree_schema'] * 3
+
+        tracing.rotate_log(log_path, max_bytes=1, backups=2)
+        assert not os.path.exists(log_path)
+        assert os.path.exists(log_path + '.1')
+
+        tree_schema(self.config_vault_path, 'python:datetime')
+        tracing.rotate_log(log_path, max_bytes=1, backups=2)
+        tree_schema(self.config_vault_path, 'python:datetime')
+        tracing.rotate_log(log_path, max_bytes=1, backups=2)
+        # Only `backups` old logs are kept
+        assert os.path.exists(log_path + '.2')
+        assert not os.path.exists(log_path + '.3')
+
+
+if __name__ == '__main__':
+    unittest.main()
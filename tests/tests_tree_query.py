@@ -0,0 +1,182 @@
+import unittest
+import random
+from scripts.tree_query import \
+    TreeQuery, QueryCache, ScanIndex, iter_matches, iter_ranked_matches, iter_scan_order, rank_matches, \
+    compile_header_glob
+from scripts.vault_index import make_rel_path
+
+
+class TestTreeQuery(unittest.TestCase):
+    vault_path = 'vault/'
+    headers_index = {
+        'vault/code.python.snippets.md': ['## Datetime', '## Os walk', '## Time: zones'],
+        'vault/code.sql.md': ['## SQL datetime'],
+        'vault/Notes/python.md': ['# Python'],
+        'vault/empty.md': [],
+    }
+
+    def get_matches(self, query):
+        rel_path = make_rel_path(self.vault_path)
+        return list(iter_matches(TreeQuery(query), self.headers_index.items(), rel_path))
+
+    def test_header_glob(self):
+        assert compile_header_glob('*datetime*').search('## DateTime')
+        assert compile_header_glob('## Date*').search('## Datetime')
+        assert not compile_header_glob('## Date*').search('### Datetime')
+        assert compile_header_glob('*time').search('## Datetime')
+        assert not compile_header_glob('*time').search('## Datetimes')
+        assert compile_header_glob('*').search('')
+
+    def test_path_and_header(self):
+        assert self.get_matches('python:datetime') == [('vault/code.python.snippets.md', '## Datetime')]
+        assert self.get_matches('*:datetime') == [
+            ('vault/code.python.snippets.md', '## Datetime'), ('vault/code.sql.md', '## SQL datetime')]
+
+    def test_path_only(self):
+        # Note names match in any folder, notes without headers match once
+        assert len(self.get_matches('python')) == 4
+        assert self.get_matches('empty') == [('vault/empty.md', '')]
+        assert self.get_matches('Notes/*') == [('vault/Notes/python.md', '# Python')]
+
+    def test_colon_in_header(self):
+        assert self.get_matches('python:time: zones') == [('vault/code.python.snippets.md', '## Time: zones')]
+
+
+    def test_ranking(self):
+        headers_index = {
+            'vault/old.md': ['## Datetime'],
+            'vault/glob.md': ['## Parse a datetime'],
+            'vault/prefix.md': ['## Datetime parsing'],
+            'vault/new.md': ['# datetime'],
+        }
+        mtimes = {'vault/old.md': 1, 'vault/glob.md': 4, 'vault/prefix.md': 3, 'vault/new.md': 2}
+        rel_path = make_rel_path(self.vault_path)
+
+        out = list(iter_ranked_matches(TreeQuery(':datetime'), headers_index, rel_path, mtimes=mtimes))
+        # Exact matches newest first, then prefix, then glob
+        assert [filename for filename, _ in out] == ['vault/new.md', 'vault/old.md', 'vault/prefix.md', 'vault/glob.md']
+
+        out = list(iter_ranked_matches(TreeQuery(':datetime'), headers_index, rel_path, limit=3, mtimes=mtimes))
+        assert [filename for filename, _ in out] == ['vault/new.md', 'vault/old.md', 'vault/prefix.md']
+
+        # Note names rank path only queries
+        out = list(iter_ranked_matches(TreeQuery('new'), headers_index, rel_path, limit=1))
+        assert out == [('vault/new.md', '# datetime')]
+
+    def test_top_k_stops_early(self):
+        class CountingIndex(dict):
+            reads = 0
+
+            def __getitem__(self, key):
+                CountingIndex.reads += 1
+                return super().__getitem__(key)
+
+        headers_index = CountingIndex((f'vault/note{i}.md', ['## Todo']) for i in range(100))
+        mtimes = dict((filename, i) for i, filename in enumerate(headers_index))
+        rel_path = make_rel_path(self.vault_path)
+
+        out = list(iter_ranked_matches(TreeQuery(':todo'), headers_index, rel_path, limit=5, mtimes=mtimes))
+        assert [filename for filename, _ in out] == [f'vault/note{i}.md' for i in range(99, 94, -1)]
+        # Stopped once `limit` exact matches were found
+        assert CountingIndex.reads == 5
+
+
+    def test_refines(self):
+        assert TreeQuery('python:datet').refines(TreeQuery('python:date'))
+        assert TreeQuery('python:date').refines(TreeQuery('pyth'))
+        assert TreeQuery('python:date').refines(TreeQuery(':'))
+        assert not TreeQuery('python:date').refines(TreeQuery('python:datet'))
+        assert not TreeQuery('python:dat[ea]').refines(TreeQuery('python:dat['))
+        # Switches from note names to relative paths
+        assert not TreeQuery('Notes/p').refines(TreeQuery('Notes'))
+
+    def test_query_cache(self):
+        cache = QueryCache(max_size=2)
+        rel_path = make_rel_path(self.vault_path)
+
+        def search(query, generation=0):
+            tree_query = TreeQuery(query)
+            return list(iter_ranked_matches(
+                tree_query, self.headers_index, rel_path, cache=cache, generation=generation))
+
+        for query in ['*:d', '*:da', '*:dat', '*:datetime', '*:datetime', 'sql:datetime']:
+            assert search(query) == list(iter_ranked_matches(TreeQuery(query), self.headers_index, rel_path))
+        assert cache.stats() == {'hits': 1, 'refined': 4, 'misses': 1, 'size': 2}
+
+        # A new index generation never reuses older matches
+        search('*:datetime', generation=1)
+        assert cache.misses == 2
+        # and drops them right away
+        assert list(cache.entries) == ['*:datetime']
+
+    def test_query_cache_limit(self):
+        cache = QueryCache()
+        rel_path = make_rel_path(self.vault_path)
+        scanned = []
+
+        def search(query, limit):
+            tree_query = TreeQuery(query)
+
+            def search():
+                scanned.append(query)
+                return rank_matches(tree_query, iter_matches(tree_query, self.headers_index.items(), rel_path), limit)
+
+            out = cache.get_ranked(tree_query, 0, limit, search, rel_path)
+            assert out == list(iter_ranked_matches(tree_query, self.headers_index, rel_path, limit=limit))
+            return out
+
+        # Cut short at 1 of 3 matches, only the same query with a limit up to 1 reuses it
+        assert search('*:t', 1) == [('vault/code.python.snippets.md', '## Time: zones')]
+        search('*:t', 1)
+        search('*:ti', 1)
+        assert scanned == ['*:t', '*:ti']
+        assert cache.stats()['hits'] == 1
+
+        # Every match seen, refined without a scan and for any limit
+        search('*:time', 5)
+        search('*:time', None)
+        search('*:time:', 5)
+        assert scanned == ['*:t', '*:ti', '*:time']
+        assert cache.stats() == {'hits': 2, 'refined': 1, 'misses': 3, 'size': 4}
+
+    def test_scan_index(self):
+        rel_path = make_rel_path(self.vault_path)
+        rng = random.Random(0)
+        words = ['Date', 'time', 'ıs', 'Straße', 'ΣΟΦΙΑ', 'σοφίας', 'İstanbul', 'sql', '#x', 'a b']
+        headers_index = {}
+        for i in range(300):
+            folder = rng.choice(['', 'Notes/', 'Notes/Code/', 'Daily/'])
+            name = '.'.join(rng.sample(words, 2)).replace(' ', '_')
+            headers_index[f'vault/{folder}{name}.{i}.md'] = [
+                '#' * rng.randint(1, 3) + ' ' + ' '.join(rng.sample(words, rng.randint(1, 3))) + rng.choice(['', ' '])
+                for _ in range(rng.randint(0, 4))]
+        mtimes = dict((filename, rng.randint(0, 50)) for filename in headers_index)
+        scan_index = ScanIndex(headers_index, rel_path, mtimes)
+
+        queries = [
+            '', ':', '*', ':*', 'date', 'Date:time', ':time', ':## time', ':#x', ':# #x', ':is', ':IS',
+            ':straße', ':STRASSE', ':σοφια', ':ΣΟΦΊΑΣ', ':istanbul', 'notes/code/*', 'Notes/*:sql',
+            'notes/*:sql', ':d*e', ':[st]ql', ':[!s]ql', ':[', 'a_b', ':a b', ':time ', 'ıs.date', 'code',
+        ]
+        for query in queries:
+            tree_query = TreeQuery(query)
+            for limit in [None, 1, 5, 50]:
+                expected = rank_matches(
+                    tree_query, iter_matches(tree_query, iter_scan_order(headers_index, mtimes), rel_path), limit)
+                out = scan_index.search(tree_query, limit)
+                assert out[0] == expected[0], (query, limit)
+                if out[1] is not None:
+                    assert out[1] == expected[1], (query, limit)
+            # Searches finding every match can seed the cache
+            assert scan_index.search(tree_query)[1] is not None
+
+        # Narrow paths are scanned directly, the same with a low threshold
+        scan_index.narrow_path_lines = 0
+        for query in ['Notes/*:sql', 'date:time', 'sql:#']:
+            tree_query = TreeQuery(query)
+            assert scan_index.search(tree_query, 5)[0] == list(iter_ranked_matches(
+                tree_query, headers_index, rel_path, limit=5, mtimes=mtimes))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+import unittest
+from scripts.trigram_index import TrigramIndex, get_trigrams, match_postings, get_cached_index, load_index, save_index, get_index_path
+from unittest import mock
+import random
+import json
+import os
+import shutil
+
+
+class TestTrigramIndex(unittest.TestCase):
+    config_vault_path = 'test_notes/'
+    headers_index = {
+        'vault/code.python.snippets.md': ['## Datetime', '## Os walk'],
+        'vault/code.sql.lib.foobar.md': ['## SQL', '## Window functions'],
+        'vault/Notes/recipes.md': ['# Recipes', '## Pancakes'],
+        'vault/empty.md': [],
+    }
+
+    def tearDown(self) -> None:
+        # Delete and recreate as empty note vault
+        shutil.rmtree('test_notes/')
+        os.makedirs('test_notes/')
+
+        return super().tearDown()
+
+    def test_trigrams(self):
+        assert get_trigrams('## Os walk') == set([' os', 'os ', ' wa', 'wal', 'alk', 'lk '])
+        assert get_trigrams('#') == set()
+
+    def test_typos(self):
+        index = TrigramIndex.from_headers_index(self.headers_index)
+
+        assert index.search(':datetmie')[0] == ('vault/code.python.snippets.md', '## Datetime')
+        assert index.search('pyhton:datetime') == [('vault/code.python.snippets.md', '## Datetime')]
+        # Path only queries return every header of the note
+        assert index.search('recipse') == [('vault/Notes/recipes.md', '# Recipes'), ('vault/Notes/recipes.md', '## Pancakes')]
+        assert index.search('emty') == [('vault/empty.md', '')]
+        assert index.search(':zzzz') == []
+        assert index.search(':') == []
+
+    def test_update(self):
+        index = TrigramIndex.from_headers_index(self.headers_index)
+        assert index.update(self.headers_index) == 0
+
+        headers_index = dict(self.headers_index)
+        headers_index['vault/code.sql.lib.foobar.md'] = ['## SQL', '## Common table expressions']
+        del headers_index['vault/Notes/recipes.md']
+
+        assert index.update(headers_index) == 2
+        assert index.search(':window functions') == []
+        assert index.search(':pancakes') == []
+        assert index.search(':comon table') == [('vault/code.sql.lib.foobar.md', '## Common table expressions')]
+
+    def test_save_load(self):
+        index = TrigramIndex.from_headers_index(self.headers_index)
+        # Removed notes leave None ids behind
+        index.update(dict((filename, headers) for filename, headers in self.headers_index.items() if filename != 'vault/empty.md'))
+        save_index(self.config_vault_path, index)
+
+        # Plain data, a json line then the arrays
+        with open(get_index_path(self.config_vault_path), 'rb') as f:
+            assert json.loads(f.readline())['note_names'][-1] is None
+
+        index = load_index(self.config_vault_path)
+        assert 'vault/empty.md' not in index.notes
+        assert index.search('pyhton:datetime') == [('vault/code.python.snippets.md', '## Datetime')]
+
+        headers_index = dict(self.headers_index)
+        headers_index['vault/Notes/recipes.md'] = ['## Waffles']
+        # The changed note and the removed one back again
+        assert index.update(headers_index) == 2
+        assert index.search(':pancakes') == []
+        assert index.search(':wafles') == [('vault/Notes/recipes.md', '## Waffles')]
+        assert index.search('emty') == [('vault/empty.md', '')]
+
+    def test_needs_rebuild(self):
+        index = TrigramIndex()
+        for i in range(1_002):
+            index.add_note(f'note{i}.md', [])
+        for i in range(1_001):
+            index.remove_note(f'note{i}.md')
+        assert index.needs_rebuild()
+
+    def test_unreadable_cache(self):
+        os.makedirs(os.path.dirname(get_index_path(self.config_vault_path)), exist_ok=True)
+        with open(get_index_path(self.config_vault_path), 'wb') as f:
+            f.write(b'{"version": 2, "byteorder": "little", "itemsize": 4, "arrays": [["header_notes", 10]]}\n')
+        with mock.patch('sys.stderr.write'):
+            assert load_index(self.config_vault_path) is None
+
+    def test_cached_index(self):
+        assert load_index(self.config_vault_path) is None
+        get_cached_index(self.config_vault_path, self.headers_index)
+
+        # Loaded from the cache dir, only changed notes are re-indexed
+        headers_index = dict(self.headers_index)
+        headers_index['vault/empty.md'] = ['## Now with a header']
+        add_note = TrigramIndex.add_note
+        with mock.patch.object(TrigramIndex, 'add_note', autospec=True, side_effect=add_note) as mock_add_note:
+            index = get_cached_index(self.config_vault_path, headers_index)
+        assert mock_add_note.call_count == 1
+
+        assert index.search(':now with') == [('vault/empty.md', '## Now with a header')]
+        assert load_index(self.config_vault_path).search(':now with') == [('vault/empty.md', '## Now with a header')]
+
+    def test_pruning_matches_brute_force(self):
+        rng = random.Random(0)
+        words = ['alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'theta', 'kappa']
+        docs = [' '.join(rng.choices(words, k=rng.randint(1, 4))) for _ in range(300)]
+
+        postings = {}
+        for doc_id, doc in enumerate(docs):
+            for gram in get_trigrams(doc):
+                postings.setdefault(gram, set()).add(doc_id)
+
+        for query in ['alpah', 'gamma delta', 'kapa thet', 'epsilon zeta beta']:
+            query_grams = get_trigrams(query)
+            expected = {}
+            for doc_id, doc in enumerate(docs):
+                share = len(query_grams & get_trigrams(doc)) / len(query_grams)
+                if share >= 0.4:
+                    expected[doc_id] = share
+            assert match_postings(postings, query_grams, 0.4) == expected
+
+            # With a limit, every doc above the cut off is still there
+            top = match_postings(postings, query_grams, 0.4, limit=5)
+            assert len(top) >= min(5, len(expected))
+            cutoff = min(top.values())
+            assert top == dict((doc_id, share) for doc_id, share in expected.items() if share >= cutoff)
+
+
+if __name__ == '__main__':
+    unittest.main()
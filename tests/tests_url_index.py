@@ -0,0 +1,144 @@
+import unittest
+from scripts.utils import write_to_path, read_daily_note, append_many_to_daily_vault, create_daily_note
+from scripts.url_index import \
+    open_index, update_index, lookup, lookup_vault, normalize_url, get_links, dedupe_entries, get_duplicate_mode
+from scripts.capture_tabs import capture_tabs
+from scripts.vault_walk import walk_vault
+import os
+import shutil
+from unittest import mock
+from freezegun import freeze_time
+
+
+class TestUrlIndex(unittest.TestCase):
+    config_vault_path = 'test_notes/'
+
+    def setUp(self) -> None:
+        os.environ['daily_note_format'] = "%Y-%m-%d"
+
+        file_mapper = {
+            '2022-12-30.md': '## Bookmarks\n- [Python](https://www.python.org/)\n- [Docs](https://docs.python.org/3/#top)\n',
+            '2022-12-31.md': '## Bookmarks\n- [Python again](http://python.org?utm_source=twitter)\n',
+            'code.python.snippets.md': '## Links\nSee <https://docs.python.org/3>, or https://pypi.org.\n',
+        }
+
+        for fname, contents in file_mapper.items():
+            write_to_path(os.path.join(self.config_vault_path, fname), contents)
+        # Oldest first
+        for i, fname in enumerate(['2022-12-30.md', '2022-12-31.md', 'code.python.snippets.md']):
+            os.utime(os.path.join(self.config_vault_path, fname), (1_600_000_000 + i, 1_600_000_000 + i))
+
+        self.conn = open_index(self.config_vault_path)
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        self.conn.close()
+        # Delete and recreate as empty note vault
+        shutil.rmtree('test_notes/')
+        os.makedirs('test_notes/')
+
+        return super().tearDown()
+
+    def lookup(self, url):
+        return [(x['rel_path'], x['line_num']) for x in lookup(self.conn, self.config_vault_path, url)]
+
+    def test_normalize_url(self):
+        assert normalize_url('HTTPS://www.Example.com/Path/?utm_source=x&id=1#top') == 'example.com/Path?id=1'
+        assert normalize_url('http://example.com:80') == 'example.com'
+        assert normalize_url('https://example.com/?fbclid=1') == 'example.com'
+        # Path and kept parameters stay case sensitive
+        assert normalize_url('https://example.com/a?B=1') != normalize_url('https://example.com/A?b=1')
+
+        assert get_links('[a](https://a.com) and https://a.com/.\nnothing\n<https://b.com/x>') == \
+            [('a.com', 0), ('b.com/x', 2)]
+
+    def test_lookup(self):
+        assert update_index(self.conn, self.config_vault_path, walk_vault(self.config_vault_path)) == 3
+
+        assert self.lookup('https://python.org') == [('2022-12-30.md', 1), ('2022-12-31.md', 1)]
+        assert self.lookup('https://docs.python.org/3/') == [('2022-12-30.md', 2), ('code.python.snippets.md', 1)]
+        assert self.lookup('https://pypi.org') == [('code.python.snippets.md', 1)]
+        assert self.lookup('https://example.com') == []
+
+        # Only changed and removed notes are re-read
+        write_to_path('test_notes/2022-12-31.md', '## Bookmarks\n- [Example](https://example.com)\n')
+        os.remove('test_notes/code.python.snippets.md')
+        assert update_index(self.conn, self.config_vault_path, walk_vault(self.config_vault_path)) == 2
+        assert self.lookup('https://python.org') == [('2022-12-30.md', 1)]
+        assert self.lookup('https://example.com') == [('2022-12-31.md', 1)]
+        assert self.lookup('https://pypi.org') == []
+        assert update_index(self.conn, self.config_vault_path, walk_vault(self.config_vault_path)) == 0
+
+        assert [x['rel_path'] for x in lookup_vault(self.config_vault_path, 'https://example.com/')] == ['2022-12-31.md']
+
+    def test_unreadable_note(self):
+        with open('test_notes/latin1.md', 'wb') as f:
+            f.write(b'## Caf\xe9\n- https://example.com\n')
+        update_index(self.conn, self.config_vault_path, walk_vault(self.config_vault_path))
+        assert self.lookup('https://example.com') == [('latin1.md', 1)]
+
+        # Its links are dropped and it isn't read again until it changes
+        write_to_path('test_notes/latin1.md', '## Other\n- https://example.com/other\n')
+        real_open = open
+        def failing_open(path, *args, **kwargs):
+            if path.endswith('latin1.md'):
+                raise PermissionError(path)
+            return real_open(path, *args, **kwargs)
+        with mock.patch('builtins.open', failing_open):
+            assert update_index(self.conn, self.config_vault_path, walk_vault(self.config_vault_path)) == 1
+            assert update_index(self.conn, self.config_vault_path, walk_vault(self.config_vault_path)) == 0
+        assert self.lookup('https://example.com') == []
+        assert self.lookup('https://example.com/other') == []
+
+    def test_dedupe_entries(self):
+        update_index(self.conn, self.config_vault_path, walk_vault(self.config_vault_path))
+        find = lambda url: lookup(self.conn, self.config_vault_path, url)
+
+        entries = [
+            ('## Bookmarks', '- [Python](https://python.org)'),
+            ('## Bookmarks', '- [New](https://new.com)'),
+            ('## Todo', '- [ ] read https://new.com/'),
+            ('## Todo', '- no link'),
+        ]
+        assert dedupe_entries(entries, 'skip', find) == [entries[1], entries[3]]
+        assert dedupe_entries(entries, 'annotate', find) == [
+            ('## Bookmarks', '- [Python](https://python.org) (saved 2 times before)'),
+            entries[1],
+            ('## Todo', '- [ ] read https://new.com/ (saved 1 time before)'),
+            entries[3],
+        ]
+        assert dedupe_entries(entries, 'link', find) == [
+            ('## Bookmarks', '- [Python](https://python.org) (first saved in [[2022-12-30]])'),
+        ] + entries[1:]
+
+        assert get_duplicate_mode(None) is None
+        assert get_duplicate_mode('0') is None
+        assert get_duplicate_mode(' Skip') == 'skip'
+        with self.assertRaises(ValueError):
+            get_duplicate_mode('drop')
+
+    @freeze_time("2023-01-01")
+    def test_capture(self):
+        create_daily_note(self.config_vault_path)
+        written = append_many_to_daily_vault(
+            self.config_vault_path,
+            [('## Bookmarks', '- [Python](https://python.org)'), ('## Bookmarks', '- [PyPI](https://pypi.org)')],
+            create_header_if_missing=True, duplicate_urls='link')
+        assert written == [
+            ('## Bookmarks', '- [Python](https://python.org) (first saved in [[2022-12-30]])'),
+            ('## Bookmarks', '- [PyPI](https://pypi.org) (first saved in [[code.python.snippets]])'),
+        ]
+
+        # Today's note is indexed too, nothing left to write
+        tabs = [('https://pypi.org/', 'PyPI'), ('https://www.python.org', 'Python')]
+        assert capture_tabs(self.config_vault_path, tabs, duplicate_urls='skip') == 0
+        assert capture_tabs(self.config_vault_path, tabs + [('https://new.com', 'New')], duplicate_urls='skip') == 1
+        content = read_daily_note(self.config_vault_path)
+        assert content.split('## Bookmarks\n')[1].split('\n\n## ')[0] == (
+            '\n- [Python](https://python.org) (first saved in [[2022-12-30]])\n'
+            '- [PyPI](https://pypi.org) (first saved in [[code.python.snippets]])\n'
+            '- [New](https://new.com)')
+
+
+if __name__ == '__main__':
+    unittest.main()
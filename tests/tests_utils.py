@@ -2,16 +2,20 @@
 import unittest
 from scripts.utils import \
     create_daily_note, get_daily_note_path, \
-    write_to_path, append_to_daily_vault, \
-    tree_schema, find_header_pos, create_obsidian_url, insert_text, read_daily_note
+    write_to_path, append_to_daily_vault, append_many_to_daily_vault, \
+    tree_schema, iter_tree_schema, find_header_pos, create_obsidian_url, insert_text, read_daily_note, \
+    modify_note, get_batch_insertions, get_daily_config, get_daily_template
+from scripts import utils
 
-from scripts.note_parser import get_header_sections
+from scripts.note_parser import get_header_sections, parse_document
 import os
 import datetime
 from freezegun import freeze_time
 import datetime
 import json
 import shutil
+import multiprocessing
+from unittest import mock
 from urllib.parse import urlparse
 from urllib.parse import parse_qs
 
@@ -47,6 +51,28 @@ fake_note_01 = \
 
 """
 
+fake_note_02 = \
+"""# Python
+
+Some intro
+
+## Datetime
+```python
+# not a header
+import datetime
+```
+
+## Os walk
+- walk
+
+# Sql
+## Joins"""
+
+def append_worker(args):
+    vault_path, worker, count = args
+    for i in range(count):
+        append_to_daily_vault(vault_path, '## Todo', f'- worker {worker} item {i}')
+
 # Tests
 
 class TestUtils(unittest.TestCase):
@@ -237,6 +263,22 @@ class TestModifyNote(TestUtils):
         assert lines.index('## Bazfoo') == 4
         assert lines.index('a thing') + 1 == lines.index('a second thing')
   
+    @freeze_time("2023-01-01")
+    def test_create_header_after_open_fence(self):
+        daily_path = get_daily_note_path(self.config_vault_path)
+        write_to_path(daily_path, '## Todo\n```python\n# not a header\n')
+
+        for text in ['- first', '- second']:
+            append_many_to_daily_vault(
+                self.config_vault_path, [('## Bazfoo', text), ('## Other', text)], create_header_if_missing=True)
+
+        # The code block is closed once, the headers are found again
+        content = read_daily_note(self.config_vault_path)
+        assert content.count('```') == 2
+        assert parse_document(content).headers == ['## Todo', '## Bazfoo', '## Other']
+        lines = content.split('\n')
+        assert lines.index('- first') + 1 == lines.index('- second')
+
     @freeze_time("2023-01-01")
     def test_append_to_daily(self):
         append_to_daily_vault(self.config_vault_path,
@@ -253,8 +295,182 @@ class TestModifyNote(TestUtils):
 
         assert 'a thing' in lines
         assert '## Foobar' not in lines
+
+    @freeze_time("2023-01-01")
+    def test_append_only_touches_section(self):
+        daily_path = get_daily_note_path(self.config_vault_path)
+        content = '# Log\n' + ''.join(f'- entry {i}\n' for i in range(1000)) + '\n## Todo\n- first\n\n## Notes\n'
+        write_to_path(daily_path, content)
+
+        append_to_daily_vault(self.config_vault_path, '## Todo', '- second')
+        append_to_daily_vault(self.config_vault_path, '## Notes', '- a note')
+
+        new_content = read_daily_note(self.config_vault_path)
+        assert new_content == content.replace('- first\n', '- first\n- second\n') + '\n- a note\n'
+
+        # No temp files left behind
+        assert os.listdir(os.path.dirname(daily_path)) == ['01.md']
+
+    @freeze_time("2023-01-01")
+    def test_append_many(self):
+        entries = [
+            ('## Todo', '- first'),
+            ('## Bazfoo', '- new header'),
+            ('## Notes', '- a note'),
+            ('## Todo', '- second'),
+            ('## Bazfoo', '- new header again'),
+        ]
+        for header, text in entries:
+            append_to_daily_vault(self.config_vault_path, header, text, create_header_if_missing=True)
+        expected = read_daily_note(self.config_vault_path)
+
+        # Reset to the template and append as one batch
+        write_to_path(get_daily_note_path(self.config_vault_path), self.test_template)
+        append_many_to_daily_vault(self.config_vault_path, entries, create_header_if_missing=True)
+
+        assert read_daily_note(self.config_vault_path) == expected
+        lines = expected.split('\n')
+        assert lines.index('- first') + 1 == lines.index('- second')
+
+    @freeze_time("2023-01-01")
+    def test_append_many_missing_header(self):
+        with self.assertRaises(ValueError):
+            append_many_to_daily_vault(self.config_vault_path, [('## Todo', '- a'), ('## Missing', '- b')])
+
+        # Nothing written when one entry fails
+        assert read_daily_note(self.config_vault_path) == self.test_template
         
 
+class TestConcurrentAppend(unittest.TestCase):
+    config_vault_path = 'test_notes/'
+
+    def setUp(self):
+        os.environ['daily_note_format'] = "%Y-%m-%d"
+        set_test_vault_daily_config(overwrite=True)
+        create_daily_note(self.config_vault_path)
+
+    def tearDown(self) -> None:
+        shutil.rmtree('test_notes/')
+        os.makedirs('test_notes/')
+
+        return super().tearDown()
+
+    def test_concurrent_appends(self):
+        workers, count = 12, 25
+        with multiprocessing.Pool(workers) as pool:
+            pool.map(append_worker, [(self.config_vault_path, w, count) for w in range(workers)])
+
+        lines = read_daily_note(self.config_vault_path).split('\n')
+        for w in range(workers):
+            items = [lines.index(f'- worker {w} item {i}') for i in range(count)]
+            # None lost, and each worker's items stay in order
+            assert items == sorted(items)
+        assert len([l for l in lines if l.startswith('- worker')]) == workers * count
+
+    def test_external_change_reapplied(self):
+        daily_path = get_daily_note_path(self.config_vault_path)
+        changed = []
+
+        def get_insertions(note_bytes):
+            if not changed:
+                # Simulate Obsidian saving the note after we read it
+                changed.append(True)
+                with open(daily_path, 'a') as fh:
+                    fh.write('- added in obsidian\n')
+            return get_batch_insertions(note_bytes, [('## Todo', '- captured')])
+
+        modify_note(self.config_vault_path, daily_path, get_insertions)
+
+        lines = read_daily_note(self.config_vault_path).split('\n')
+        assert '- added in obsidian' in lines
+        assert '- captured' in lines
+
+class TestDailyConfigCache(unittest.TestCase):
+    config_vault_path = 'test_notes/'
+    template_path = 'test_notes/Templates/Daily.md'
+
+    def setUp(self):
+        set_test_vault_daily_config(config_args={'template': 'Templates/Daily.md'}, overwrite=True)
+        self.write_old('test_notes/.obsidian/daily-notes.json')
+        self.write_old(self.template_path, '## Todo\n')
+
+    def tearDown(self) -> None:
+        utils.daily_config_cache.clear()
+        shutil.rmtree('test_notes/')
+        os.makedirs('test_notes/')
+
+        return super().tearDown()
+
+    def write_old(self, path, text=None, age=60):
+        """
+        Write text (or keep the file) with an mtime `age` seconds ago, past
+        the window where mtimes aren't trusted
+        """
+        if text is not None:
+            write_to_path(path, text)
+        mtime = os.stat(path).st_mtime - age
+        os.utime(path, (mtime, mtime))
+
+    def get_config(self):
+        with mock.patch('scripts.utils.get_daily_template', wraps=get_daily_template) as config_reads:
+            config = get_daily_config(self.config_vault_path)
+        return config, config_reads.call_count
+
+    def test_cached(self):
+        config, reads = self.get_config()
+        assert config['template_text'] == '## Todo\n'
+        assert reads == 1
+
+        config, reads = self.get_config()
+        assert config['template_text'] == '## Todo\n'
+        assert reads == 0
+
+        # A new process starts from the on disk snapshot
+        utils.daily_config_cache.clear()
+        config, reads = self.get_config()
+        assert config['template_text'] == '## Todo\n'
+        assert reads == 0
+
+    def test_template_edited(self):
+        self.get_config()
+
+        self.write_old(self.template_path, '## Todo\n\n## Ideas\n', age=30)
+        config, reads = self.get_config()
+        assert config['template_text'] == '## Todo\n\n## Ideas\n'
+        assert reads == 1
+
+    def test_config_edited(self):
+        self.get_config()
+
+        self.write_old('test_notes/Templates/Other.md', '## Other\n')
+        set_test_vault_daily_config(config_args={'template': 'Templates/Other.md'}, overwrite=True)
+        self.write_old('test_notes/.obsidian/daily-notes.json', age=30)
+        config, reads = self.get_config()
+        assert config['template_text'] == '## Other\n'
+        assert reads == 1
+
+        # Template removed from the config
+        os.remove('test_notes/.obsidian/daily-notes.json')
+        config, _ = self.get_config()
+        assert config['template_text'] == utils.default_daily_template
+
+    def test_recently_modified_not_cached(self):
+        # Same size, could share its mtime with the previous version
+        write_to_path(self.template_path, '## Tada\n')
+        for _ in range(2):
+            config, reads = self.get_config()
+            assert config['template_text'] == '## Tada\n'
+            assert reads == 1
+
+    @freeze_time("2023-01-01")
+    def test_create_daily_note(self):
+        os.environ['daily_note_format'] = "%Y-%m-%d"
+        self.get_config()
+
+        create_daily_note(self.config_vault_path)
+        with open('test_notes/2023-01-01.md') as f:
+            assert f.read() == '## Todo\n'
+
 class TestGetHeader(unittest.TestCase):
     config_vault_path = 'test_notes/'
     test_template_path = 'templates/daily-note.md'
@@ -295,6 +511,32 @@ class TestGetHeader(unittest.TestCase):
 
         #breakpoint()
 
+    def test_code_fence_not_header(self):
+        start_line, end_line = find_header_pos(fake_note_02, '## Datetime')
+        assert (start_line, end_line) == (4, 8)
+
+        assert find_header_pos(fake_note_02, '# not a header') == (None, None)
+        assert '# not a header' not in get_header_sections(fake_note_02)
+
+    def test_document_tree(self):
+        document = parse_document(fake_note_02)
+
+        assert document.headers == ['# Python', '## Datetime', '## Os walk', '# Sql', '## Joins']
+        assert [s.header for s in document.roots] == ['# Python', '# Sql']
+
+        python, datetime_section, os_walk, sql, joins = document.sections
+        assert [s.header for s in python.children] == ['## Datetime', '## Os walk']
+        assert os_walk.parent is python
+        assert (python.line, python.last_line, python.end_line) == (0, 2, 12)
+        assert (joins.line, joins.last_line, joins.end_line) == (14, None, 14)
+
+        # Offsets slice the same text as line numbers
+        data = fake_note_02.encode('utf-8')
+        lines = fake_note_02.split('\n')
+        assert data[os_walk.offset:os_walk.end_offset].decode() == '\n'.join(lines[os_walk.line:os_walk.end_line + 1]) + '\n'
+        assert data[sql.offset:sql.end_offset].decode() == '\n'.join(lines[sql.line:])
+        assert data[datetime_section.offset:datetime_section.last_offset].decode().endswith('```\n')
+
 class TestGlobSearch(unittest.TestCase):
     config_vault_path = 'test_notes/'
 
@@ -377,6 +619,32 @@ class TestGlobSearch(unittest.TestCase):
         out = tree_schema(self.config_vault_path, search_query)
         assert len(out) == 2
         assert len(set([x['subtitle'].split(':')[0] for x in out])) == 1
+
+    def test_limit(self):
+        out = tree_schema(self.config_vault_path, "python", limit=2)
+        assert len(out) == 2
+
+        items = iter_tree_schema(self.config_vault_path, "python")
+        assert next(items)['subtitle'].startswith('code.python')
+
+    def test_fuzzy_fallback(self):
+        assert tree_schema(self.config_vault_path, "pyhton:datetmie") == []
+
+        out = tree_schema(self.config_vault_path, "pyhton:datetmie", fuzzy=True)
+        assert [x['title'] for x in out] == ['code.python.snippets.md:## Datetime']
+
+        # Glob matches win, no fuzzy results mixed in
+        out = tree_schema(self.config_vault_path, "python:datetime", fuzzy=True)
+        assert len(out) == 1
+
+    def test_subfolders(self):
+        # Globs without a `/` match note names in every folder
+        out = tree_schema(self.config_vault_path, "01-01:todo")
+        assert sorted(x['subtitle'] for x in out) == ['Notes 2022/01-01.md', 'Notes 2023/01-01.md']
+
+        out = tree_schema(self.config_vault_path, "Notes 2023/*:todo")
+        assert len(out) == 1
+        assert 'filepath=Notes%202023/01-01.md' in out[0]['arg']
         
     def test_search_and_get_url(self):
         search_query = "python:Datetime"
@@ -0,0 +1,155 @@
+import unittest
+from scripts.utils import write_to_path, tree_schema, get_headers_index
+from scripts.vault_index import \
+    get_cached_headers_index, get_index_path, load_index, update_index, \
+    build_index_parallel, index_racy_ns, get_index_workers, parse_notes_parallel
+from scripts.note_parser import get_headers
+from scripts.vault_walk import walk_vault
+import os
+import time
+import shutil
+from unittest import mock
+
+test_pid = os.getpid()
+
+def get_headers_in_test_process(content):
+    # Pool workers die, a serial fallback parses as usual
+    if os.getpid() != test_pid:
+        os._exit(1)
+    return get_headers(content)
+
+
+class TestHeaderIndex(unittest.TestCase):
+    config_vault_path = 'test_notes/'
+
+    def setUp(self) -> None:
+        file_mapper = {
+            'code.python.snippets.md': '## Datetime\n\n## Os walk',
+            'code.sql.lib.foobar.md': '## SQL\n',
+            'empty.md': 'empty',
+        }
+
+        for fname, contents in file_mapper.items():
+            fpath = os.path.join(self.config_vault_path, fname)
+            write_to_path(fpath, contents)
+            # Out of the racy window, see `test_racy_entries`
+            os.utime(fpath, (time.time() - 60, time.time() - 60))
+
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        # Delete and recreate as empty note vault
+        shutil.rmtree('test_notes/')
+        os.makedirs('test_notes/')
+
+        return super().tearDown()
+
+    def get_notes(self):
+        return list(walk_vault(self.config_vault_path))
+
+    def test_index_is_persisted(self):
+        out = get_cached_headers_index(self.config_vault_path, self.get_notes())
+
+        assert out['test_notes/code.python.snippets.md'] == ['## Datetime', '## Os walk']
+        assert out['test_notes/empty.md'] == []
+        assert os.path.exists(get_index_path(self.config_vault_path))
+
+        files = load_index(self.config_vault_path)
+        assert set(files.keys()) == set(['code.python.snippets.md', 'code.sql.lib.foobar.md', 'empty.md'])
+
+    def test_unchanged_index(self):
+        get_cached_headers_index(self.config_vault_path, self.get_notes())
+
+        _, changed = update_index(self.config_vault_path, self.get_notes())
+        assert not changed
+
+    def test_only_changed_files_reparsed(self):
+        get_cached_headers_index(self.config_vault_path, self.get_notes())
+        files = load_index(self.config_vault_path)
+        sql_entry = files['code.sql.lib.foobar.md']
+
+        write_to_path('test_notes/code.python.snippets.md', '## Datetime\n\n## Os walk\n\n## Pathlib')
+        files, changed = update_index(self.config_vault_path, self.get_notes(), files=files)
+
+        assert changed
+        assert files['code.python.snippets.md']['headers'][-1] == '## Pathlib'
+        # Untouched note keeps its cached entry
+        assert files['code.sql.lib.foobar.md'] is sql_entry
+
+    def test_racy_entries(self):
+        filename = 'test_notes/code.python.snippets.md'
+        write_to_path(filename, '## Datetime\n')
+        mtime_ns = os.stat(filename).st_mtime_ns
+        files, _ = update_index(self.config_vault_path, self.get_notes())
+        assert files['code.python.snippets.md']['racy']
+        assert 'racy' not in files['code.sql.lib.foobar.md']
+
+        # Same size rewrite within the same mtime tick, the fingerprint doesn't change
+        write_to_path(filename, '## Pathlib\n')
+        os.utime(filename, ns=(mtime_ns, mtime_ns))
+        files, changed = update_index(self.config_vault_path, self.get_notes(), files=files)
+        assert changed
+        assert files['code.python.snippets.md']['headers'] == ['## Pathlib']
+
+        # Read again once more after the window, then trusted
+        with mock.patch('time.time_ns', return_value=mtime_ns + index_racy_ns + 1):
+            files, changed = update_index(self.config_vault_path, self.get_notes(), files=files)
+        assert changed and 'racy' not in files['code.python.snippets.md']
+        _, changed = update_index(self.config_vault_path, self.get_notes(), files=files)
+        assert not changed
+
+    def test_deleted_files_dropped(self):
+        get_cached_headers_index(self.config_vault_path, self.get_notes())
+        os.remove('test_notes/empty.md')
+
+        out = get_cached_headers_index(self.config_vault_path, self.get_notes())
+        assert 'test_notes/empty.md' not in out
+        assert 'empty.md' not in load_index(self.config_vault_path)
+
+    def test_corrupt_index_rebuilt(self):
+        get_cached_headers_index(self.config_vault_path, self.get_notes())
+        with open(get_index_path(self.config_vault_path), 'w') as fh:
+            fh.write('{not json')
+
+        out = tree_schema(self.config_vault_path, 'python:datetime')
+        assert len(out) == 1
+
+    def test_parallel_build_matches_serial(self):
+        for i in range(20):
+            write_to_path(os.path.join(self.config_vault_path, f'note{i:02}.md'), f'# Note {i}\n\n## Sub {i}\n')
+
+        filenames = [filename for filename, _ in self.get_notes()]
+        serial = get_headers_index(filenames)
+        parallel = get_headers_index(filenames, workers=2)
+
+        assert serial == parallel
+        assert list(serial.keys()) == list(parallel.keys())
+
+        files, stats = build_index_parallel(self.config_vault_path, filenames, workers=2)
+        assert list(files.keys()) == [os.path.relpath(f, self.config_vault_path) for f in filenames]
+        assert stats['files'] == len(filenames)
+        assert stats['files_per_s'] > 0
+
+    def test_invalid_index_workers(self):
+        with mock.patch.dict(os.environ, {'index_workers': 'auto'}):
+            assert get_index_workers() == (os.cpu_count() or 1)
+        with mock.patch.dict(os.environ, {'index_workers': '0'}):
+            assert get_index_workers() == 1
+
+    def test_pool_fallback(self):
+        filenames = [filename for filename, _ in self.get_notes()]
+        serial = get_headers_index(filenames)
+
+        with mock.patch('concurrent.futures.ProcessPoolExecutor', side_effect=OSError('no semaphores')):
+            parsed, stats = parse_notes_parallel(filenames, workers=2)
+        assert dict((filename, headers) for filename, _, headers in parsed) == serial
+        assert stats['workers'] == 1
+
+        # Broken while parsing
+        parsed, stats = parse_notes_parallel(filenames, workers=2, parse=get_headers_in_test_process)
+        assert dict((filename, headers) for filename, _, headers in parsed) == serial
+        assert stats['workers'] == 1
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+from scripts.utils import write_to_path
+from scripts.vault_walk import walk_vault, get_ignore_rules, compile_path_glob
+import os
+import json
+import shutil
+
+
+class TestVaultWalk(unittest.TestCase):
+    config_vault_path = 'test_notes/'
+
+    def setUp(self) -> None:
+        file_mapper = {
+            'a.md': '# A',
+            'b.txt': 'not a note',
+            'Projects/p1.md': '# P1',
+            'Projects/deep/er/p2.md': '# P2',
+            'Attachments/pasted.md': '# Pasted',
+            'Archive/old.md': '# Old',
+            '.obsidian/workspace.md': '# Hidden',
+            '.trash/deleted.md': '# Deleted',
+            'node_modules/pkg/readme.md': '# Readme',
+        }
+
+        for fname, contents in file_mapper.items():
+            write_to_path(os.path.join(self.config_vault_path, fname), contents)
+
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        os.environ.pop('ignore_globs', None)
+        # Delete and recreate as empty note vault
+        shutil.rmtree('test_notes/')
+        os.makedirs('test_notes/')
+
+        return super().tearDown()
+
+    def get_rel_paths(self):
+        return [os.path.relpath(path, self.config_vault_path) for path, _ in walk_vault(self.config_vault_path)]
+
+    def test_walk_prunes_hidden(self):
+        rel_paths = self.get_rel_paths()
+        # Each folder's notes before its sub folders
+        assert rel_paths == [
+            'a.md', 'Archive/old.md', 'Attachments/pasted.md', 'Projects/p1.md', 'Projects/deep/er/p2.md']
+
+        path, stat_result = next(walk_vault(self.config_vault_path))
+        assert stat_result.st_size == os.stat(path).st_size
+
+    def test_obsidian_ignore_filters(self):
+        write_to_path(os.path.join(self.config_vault_path, '.obsidian/app.json'), json.dumps({
+            'userIgnoreFilters': ['Archive/', '/deep/'],
+            'attachmentFolderPath': 'Attachments',
+        }))
+
+        assert self.get_rel_paths() == ['a.md', 'Projects/p1.md']
+
+    def test_invalid_ignore_filter(self):
+        write_to_path(os.path.join(self.config_vault_path, '.obsidian/app.json'), json.dumps({
+            'userIgnoreFilters': ['/deep[/', 'Archive/'],
+        }))
+
+        # Skipped, the other filters still apply
+        assert 'Archive/old.md' not in self.get_rel_paths()
+        assert 'Projects/deep/er/p2.md' in self.get_rel_paths()
+
+    def test_symlink_loop(self):
+        os.symlink('..', os.path.join(self.config_vault_path, 'Projects/loop'))
+        os.symlink('../Archive', os.path.join(self.config_vault_path, 'Projects/linked'))
+
+        rel_paths = self.get_rel_paths()
+        assert len(rel_paths) == len(set(os.path.realpath(path) for path, _ in walk_vault(self.config_vault_path)))
+        assert rel_paths.count('Projects/p1.md') == 1
+
+    def test_ignore_globs_variable(self):
+        os.environ['ignore_globs'] = 'Projects/**, *.md'
+        assert get_ignore_rules(self.config_vault_path)[0] == []
+        # Only top level notes match `*.md`
+        assert self.get_rel_paths() == ['Archive/old.md', 'Attachments/pasted.md']
+
+    def test_path_glob(self):
+        assert compile_path_glob('*.md').fullmatch('a.md')
+        assert not compile_path_glob('*.md').fullmatch('Projects/p1.md')
+        assert compile_path_glob('**/*.md').fullmatch('a.md')
+        assert compile_path_glob('**/*.md').fullmatch('Projects/deep/p2.md')
+        assert compile_path_glob('Projects/*').fullmatch('Projects/p1.md')
+        assert compile_path_glob('p[0-9].md').fullmatch('p1.md')
+        assert not compile_path_glob('p[!0-9].md').fullmatch('p1.md')
+
+
+if __name__ == '__main__':
+    unittest.main()
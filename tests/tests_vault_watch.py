@@ -0,0 +1,132 @@
+import unittest
+from scripts.utils import write_to_path
+from scripts.vault_watch import InotifyWatcher, PollingWatcher, next_batch, resolve_batch, between_requests
+from scripts.vault_index import get_cached_headers_index
+import os
+import sys
+import time
+import shutil
+import threading
+
+
+class TestVaultWatch(unittest.TestCase):
+    config_vault_path = 'test_notes/'
+
+    def setUp(self) -> None:
+        os.environ['ignore_globs'] = 'Archive/**'
+
+        file_mapper = {
+            'code.python.snippets.md': '## Datetime\n',
+            'Daily/2023-01-01.md': '## Todo\n',
+            'Daily/Old/2022-12-31.md': '## Todo\n',
+        }
+
+        for fname, contents in file_mapper.items():
+            write_to_path(os.path.join(self.config_vault_path, fname), contents)
+        os.makedirs('test_notes/Archive')
+
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        del os.environ['ignore_globs']
+
+        # Delete and recreate as empty note vault
+        shutil.rmtree('test_notes/')
+        os.makedirs('test_notes/')
+
+        return super().tearDown()
+
+    def open_watcher(self, watcher_class):
+        watcher = watcher_class(self.config_vault_path)
+        self.addCleanup(watcher.close)
+        return watcher
+
+    def get_batch(self, watcher):
+        return next_batch(watcher, debounce=0.1, max_delay=2.0, timeout=2.0)
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'inotify is Linux only')
+    def test_inotify(self):
+        watcher = self.open_watcher(InotifyWatcher)
+        indexed = get_cached_headers_index(self.config_vault_path)
+
+        write_to_path('test_notes/code.python.snippets.md', '## Datetime\n\n## Os walk\n')
+        write_to_path('test_notes/code.sql.md', '## SQL\n')
+        os.remove('test_notes/Daily/2023-01-01.md')
+        # Ignored
+        write_to_path('test_notes/notes.txt', 'not a note')
+        write_to_path('test_notes/.obsidian/app.json', '{}')
+        write_to_path('test_notes/Archive/old.md', '## Old\n')
+
+        batch = self.get_batch(watcher)
+        assert batch.paths == set([
+            'test_notes/code.python.snippets.md', 'test_notes/code.sql.md', 'test_notes/Daily/2023-01-01.md'])
+        assert not batch.dirs and not batch.rescan
+
+        notes, removed = resolve_batch(self.config_vault_path, batch, indexed)
+        assert sorted(filename for filename, _ in notes) == ['test_notes/code.python.snippets.md', 'test_notes/code.sql.md']
+        assert removed == ['test_notes/Daily/2023-01-01.md']
+
+        # Folders moved in get watched too
+        os.rename('test_notes/Daily/Old', 'test_notes/Old')
+        batch = self.get_batch(watcher)
+        assert batch.dirs == set(['Daily/Old', 'Old'])
+
+        notes, removed = resolve_batch(self.config_vault_path, batch, indexed)
+        assert [filename for filename, _ in notes] == ['test_notes/Old/2022-12-31.md']
+        assert removed == ['test_notes/Daily/Old/2022-12-31.md']
+
+        write_to_path('test_notes/Old/2023-01-02.md', '## Todo\n')
+        assert self.get_batch(watcher).paths == set(['test_notes/Old/2023-01-02.md'])
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'inotify is Linux only')
+    def test_burst(self):
+        watcher = self.open_watcher(InotifyWatcher)
+
+        # Eg a sync dropping a folder of notes, comes in as one batch
+        for i in range(300):
+            write_to_path(f'test_notes/Synced/note {i}.md', f'## Note {i}\n')
+
+        batch = self.get_batch(watcher)
+        assert batch.dirs == set(['Synced']) and not batch.rescan
+        notes, removed = resolve_batch(self.config_vault_path, batch, {})
+        assert len(set(filename for filename, _ in notes)) == 300
+        assert not removed
+
+        stop_event = threading.Event()
+        stop_event.set()
+        assert next_batch(watcher, stop_event=stop_event, timeout=0.1) is None
+
+    def test_polling(self):
+        watcher = PollingWatcher(self.config_vault_path, interval=0.05)
+
+        write_to_path('test_notes/code.python.snippets.md', '## Datetime\n\n## Os walk\n')
+        os.remove('test_notes/Daily/2023-01-01.md')
+        write_to_path('test_notes/Archive/old.md', '## Old\n')
+
+        batch = self.get_batch(watcher)
+        assert batch.paths == set(['test_notes/code.python.snippets.md', 'test_notes/Daily/2023-01-01.md'])
+
+        # Taken by another reader first
+        write_to_path('test_notes/code.sql.md', '## SQL\n')
+        assert watcher.collect(1.0)
+        assert watcher.take().paths == set(['test_notes/code.sql.md'])
+        assert not watcher.take()
+
+    def test_between_requests(self):
+        idle = threading.Event()
+        assert list(between_requests(range(3))) == [0, 1, 2]
+
+        # Waits for the request, at most max_wait
+        threading.Timer(0.1, idle.set).start()
+        start = time.monotonic()
+        assert list(between_requests(range(3), idle, max_wait=5.0)) == [0, 1, 2]
+        assert 0.05 < time.monotonic() - start < 4.0
+
+        idle.clear()
+        start = time.monotonic()
+        assert list(between_requests(range(3), idle, max_wait=0.1)) == [0, 1, 2]
+        assert time.monotonic() - start < 4.0
+
+
+if __name__ == '__main__':
+    unittest.main()